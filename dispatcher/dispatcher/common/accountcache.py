@@ -0,0 +1,133 @@
+# coding=utf-8
+from webob import Response
+from eventlet import spawn_n
+from dispatcher.common.lru import LRU
+import time
+
+
+class AccountEntry(object):
+    """ the status and headers of a merged account HEAD """
+    def __init__(self, status, headerlist, expires):
+        self.status = status
+        self.headerlist = headerlist
+        self.expires = expires
+        self.refreshing = False
+
+
+class AccountCache(object):
+    """
+    a cache of merged account HEAD responses, keyed by the location, the
+    account and the tokens of each cluster.
+
+    an entry is served for ttl seconds. for stale_ttl seconds more it is
+    still served, and refreshed by one background HEAD fan-out
+    (stale-while-revalidate). writes relayed to an account drop its
+    entries, and a refresh which started before the write is not stored.
+
+    :param ttl: seconds an entry is fresh.
+    :param stale_ttl: seconds an expired entry is served while refreshed.
+    :param max_entries: the least recently used entries over this are dropped.
+    """
+    def __init__(self, ttl=10, stale_ttl=60, max_entries=10000, logger=None, metrics=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.logger = logger
+        self.metrics = metrics
+        self.entries = LRU()
+        self.accounts = {}  # account -> keys of the account
+        self.generations = {}  # account -> writes, while it has entries or fetches
+        self.fetching = {}
+        self.counters = {'hits': 0, 'stale_hits': 0, 'misses': 0,
+                         'refreshes': 0, 'invalidations': 0}
+
+    def get(self, key, fetch):
+        """
+        :param key: (location, account, tokens)
+        :param fetch: a callable returning the merged account HEAD response.
+        :return: a response of the entry of key, or of fetch().
+        """
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry and now < entry.expires + self.stale_ttl:
+            if now < entry.expires:
+                self._count('hits')
+            else:
+                self._count('stale_hits')
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    spawn_n(self._refresh, key, entry, fetch)
+            return self._response(entry)
+        if entry:
+            self._remove(key, entry)
+        self._count('misses')
+        return self._fetch(key, fetch)
+
+    def invalidate(self, account):
+        """ drop the entries of account, which a write made stale """
+        self.generations[account] = self.generations.get(account, 0) + 1
+        for key in list(self.accounts.get(account, ())):
+            self._remove(key, self.entries.get(key))
+            self._count('invalidations')
+        self._forget(account)
+
+    def snapshot(self):
+        snapshot = dict(self.counters)
+        snapshot['entries'] = len(self.entries)
+        return snapshot
+
+    def _refresh(self, key, entry, fetch):
+        self._count('refreshes')
+        try:
+            self._fetch(key, fetch)
+        except Exception, err:
+            if self.logger:
+                self.logger.warn('refreshing the merged account %s failed: %s' % (key[1], err))
+        entry.refreshing = False
+
+    def _fetch(self, key, fetch):
+        """ fetch() and store it unless the account was written meanwhile """
+        account = key[1]
+        generation = self.generations.get(account, 0)
+        self.fetching[account] = self.fetching.get(account, 0) + 1
+        try:
+            resp = fetch()
+        finally:
+            self.fetching[account] -= 1
+            if not self.fetching[account]:
+                del self.fetching[account]
+        if resp.status_int // 100 == 2 and self.generations.get(account, 0) == generation:
+            self._store(key, resp)
+        self._forget(account)
+        return resp
+
+    def _forget(self, account):
+        if account not in self.accounts and account not in self.fetching:
+            self.generations.pop(account, None)
+
+    def _store(self, key, resp):
+        self._remove(key, self.entries.get(key))
+        self.entries[key] = AccountEntry(resp.status, list(resp.headerlist),
+                                         time.time() + self.ttl)
+        self.accounts.setdefault(key[1], set()).add(key)
+        while len(self.entries) > self.max_entries:
+            old_key = self.entries.oldest()
+            self._remove(old_key, self.entries[old_key])
+            self._forget(old_key[1])
+
+    def _remove(self, key, entry):
+        if entry is None:
+            return
+        self.entries.pop(key, None)
+        keys = self.accounts.get(key[1])
+        keys.discard(key)
+        if not keys:
+            del self.accounts[key[1]]
+
+    def _response(self, entry):
+        return Response(status=entry.status, headerlist=list(entry.headerlist))
+
+    def _count(self, name):
+        self.counters[name] += 1
+        if self.metrics:
+            self.metrics.incr('account_cache_%s' % name)
@@ -0,0 +1,213 @@
+# coding=utf-8
+from __future__ import with_statement
+from collections import deque
+from eventlet.event import Event
+from eventlet.timeout import Timeout
+import time
+
+LISTING = 'listing'
+OBJECT = 'object'
+BULK = 'bulk'
+CLASSES = (LISTING, OBJECT, BULK)
+
+
+def parse_pairs(value, convert=float):
+    """ 'listing:4, object:2' -> {'listing': 4.0, 'object': 2.0} """
+    pairs = {}
+    for pair in (value or '').split(','):
+        if pair.strip():
+            name, number = pair.rsplit(':', 1)
+            pairs[name.strip()] = convert(number)
+    return pairs
+
+
+class Ticket(object):
+    """ a running request of an account in a location, released once """
+    def __init__(self, admission, queue, account):
+        self.admission = admission
+        self.queue = queue
+        self.account = account
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.admission.release(self)
+
+
+class Waiter(object):
+    def __init__(self, account):
+        self.account = account
+        self.event = Event()
+        self.ticket = None
+
+
+class LocationQueue(object):
+    """ the running requests and the waiters of a location """
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        self.accounts = {}
+        self.waiters = dict([(cls, deque()) for cls in CLASSES])
+        self.waiting = 0
+        self.passes = dict([(cls, 0.0) for cls in CLASSES])
+        self.virtual = 0.0
+
+
+class Admission(object):
+    """
+    admission control of the requests of each location.
+
+    at most location_limit requests of a location (or the one of the location
+    in location_limits), and account_limit of an account in it, run at once.
+    the others wait in the queue of their request class, at most queue_size
+    per location, for timeout seconds at most; a request which finds the
+    queue full or waits too long is rejected.
+
+    a freed slot goes to the class with the least pass, and admitting a
+    request of a class adds 1 / its weight to its pass (stride scheduling),
+    so busy classes share the slots by their weights and an idle class
+    does not bank credit.
+
+    :param location_limit: 0 for no limit.
+    :param account_limit: 0 for no limit.
+    :param weights: {class: weight} of LISTING, OBJECT and BULK.
+    :param bulk_size: PUTs larger than this, or of unknown size, and copies
+                      are BULK.
+    """
+    def __init__(self, location_limit=0, account_limit=0, queue_size=256, timeout=10,
+                 weights=None, location_limits=None, bulk_size=1048576, metrics=None):
+        self.location_limit = location_limit
+        self.location_limits = location_limits or {}
+        self.account_limit = account_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.weights = {LISTING: 4.0, OBJECT: 2.0, BULK: 1.0}
+        self.weights.update(weights or {})
+        self.bulk_size = bulk_size
+        self.metrics = metrics
+        self.queues = {}
+        self.counters = {'admitted': 0, 'queued': 0, 'queue_full': 0, 'timeout': 0}
+
+    def classify(self, req, path_str_ls):
+        """ the request class of req to path_str_ls, the real path """
+        if len(path_str_ls) <= 3:
+            return LISTING
+        if req.method == 'COPY' or req.method == 'PUT' and \
+                (req.headers.has_key('x-copy-from') or req.content_length is None or
+                 req.content_length > self.bulk_size):
+            return BULK
+        return OBJECT
+
+    def admit(self, location, account, cls):
+        """
+        wait for a slot of location and account.
+        :return: a Ticket to release when the request is done, None if rejected.
+        """
+        queue = self._queue(location)
+        if queue.waiting >= self.queue_size:
+            self._reject(queue, cls, 'queue_full')
+            return None
+        waiter = Waiter(account)
+        if not queue.waiters[cls]:
+            queue.passes[cls] = max(queue.passes[cls], queue.virtual)
+        queue.waiters[cls].append(waiter)
+        queue.waiting += 1
+        self._schedule(queue)
+        started = time.time()
+        if not waiter.ticket:
+            self.counters['queued'] += 1
+            with Timeout(self.timeout, False):
+                waiter.event.wait()
+        # the slot may be given just when the timeout expires.
+        if not waiter.ticket:
+            queue.waiters[cls].remove(waiter)
+            queue.waiting -= 1
+            self._reject(queue, cls, 'timeout')
+            return None
+        self.counters['admitted'] += 1
+        if self.metrics:
+            self.metrics.observe('admission_wait', time.time() - started,
+                                 (('location', location), ('class', cls)))
+        return waiter.ticket
+
+    def release(self, ticket):
+        queue = ticket.queue
+        queue.running -= 1
+        queue.accounts[ticket.account] -= 1
+        if not queue.accounts[ticket.account]:
+            del queue.accounts[ticket.account]
+        self._schedule(queue)
+
+    def snapshot(self):
+        snapshot = dict(self.counters)
+        snapshot['locations'] = dict([(name, {'running': queue.running,
+                                              'limit': queue.limit,
+                                              'waiting': dict([(cls, len(waiters)) for cls, waiters
+                                                               in queue.waiters.iteritems()])})
+                                      for name, queue in self.queues.iteritems()])
+        return snapshot
+
+    def _queue(self, location):
+        queue = self.queues.get(location)
+        if not queue:
+            queue = self.queues[location] = \
+                LocationQueue(location, self.location_limits.get(location, self.location_limit))
+        return queue
+
+    def _admissible(self, queue, account):
+        return (not queue.limit or queue.running < queue.limit) and \
+            (not self.account_limit or queue.accounts.get(account, 0) < self.account_limit)
+
+    def _schedule(self, queue):
+        """ give the free slots of queue to the waiters, by class pass """
+        while queue.waiting and (not queue.limit or queue.running < queue.limit):
+            for cls in sorted(CLASSES, key=lambda c: queue.passes[c]):
+                waiter = None
+                for each in queue.waiters[cls]:
+                    if self._admissible(queue, each.account):
+                        waiter = each
+                        break
+                if waiter:
+                    break
+            else:
+                # every waiter is over its account limit.
+                return
+            queue.waiters[cls].remove(waiter)
+            queue.waiting -= 1
+            queue.running += 1
+            queue.accounts[waiter.account] = queue.accounts.get(waiter.account, 0) + 1
+            queue.virtual = queue.passes[cls]
+            queue.passes[cls] += 1.0 / self.weights[cls]
+            waiter.ticket = Ticket(self, queue, waiter.account)
+            waiter.event.send()
+
+    def _reject(self, queue, cls, reason):
+        self.counters[reason] += 1
+        if self.metrics:
+            self.metrics.incr('admission_rejected',
+                              (('location', queue.name), ('class', cls), ('reason', reason)))
+
+
+class AdmittedIter(object):
+    """ a response body which releases its ticket when it ends or is closed """
+    def __init__(self, app_iter, ticket):
+        self.app_iter = app_iter
+        self.iter = iter(app_iter)
+        self.ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self.iter.next()
+        except:
+            self.ticket.release()
+            raise
+
+    def close(self):
+        self.ticket.release()
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
@@ -0,0 +1,96 @@
+# coding=utf-8
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    per-backend circuit breakers.
+
+    a backend is ejected (open) after error_threshold consecutive failures.
+    after cooldown seconds one trial request is let through (half-open);
+    its success closes the breaker, its failure opens it for another cooldown.
+
+    :param error_threshold: consecutive failures to open a breaker.
+                            0 disables the breakers.
+    :param cooldown: seconds an open breaker rejects requests.
+    """
+    def __init__(self, error_threshold=5, cooldown=30.0, logger=None):
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.logger = logger
+        self.backends = {}
+
+    def _backend(self, server):
+        backend = self.backends.get(server)
+        if not backend:
+            backend = self.backends.setdefault(server, {'state': CLOSED,
+                                                        'failures': 0,
+                                                        'opened_at': 0,
+                                                        'trial_at': 0,
+                                                        'ejections': 0})
+        return backend
+
+    def state(self, server):
+        backend = self.backends.get(server)
+        return backend['state'] if backend else CLOSED
+
+    def available(self, server):
+        """ whether a request may be sent to server now. no state change. """
+        if not self.error_threshold:
+            return True
+        backend = self.backends.get(server)
+        if not backend or backend['state'] == CLOSED:
+            return True
+        now = time.time()
+        if backend['state'] == OPEN:
+            return now - backend['opened_at'] >= self.cooldown
+        # half-open: only one trial at a time, unless the trial got lost.
+        return now - backend['trial_at'] >= self.cooldown
+
+    def filter(self, servers):
+        """
+        the available servers in the given order.
+        if every server is ejected, all of them, so that requests
+        still have a chance to get through.
+        """
+        available = [s for s in servers if self.available(s)]
+        return available or servers
+
+    def attempt(self, server):
+        """ call just before sending a request to server """
+        backend = self.backends.get(server)
+        if backend and backend['state'] != CLOSED:
+            backend['state'] = HALF_OPEN
+            backend['trial_at'] = time.time()
+
+    def success(self, server):
+        backend = self.backends.get(server)
+        if not backend:
+            return
+        if backend['state'] != CLOSED and self.logger:
+            self.logger.info('circuit breaker of %s closed' % server)
+        backend['state'] = CLOSED
+        backend['failures'] = 0
+
+    def failure(self, server):
+        if not self.error_threshold:
+            return
+        backend = self._backend(server)
+        backend['failures'] += 1
+        if backend['state'] == HALF_OPEN or \
+                (backend['state'] == CLOSED and backend['failures'] >= self.error_threshold):
+            backend['state'] = OPEN
+            backend['opened_at'] = time.time()
+            backend['ejections'] += 1
+            if self.logger:
+                self.logger.warn('circuit breaker of %s opened after %d failures' %
+                                 (server, backend['failures']))
+
+    def snapshot(self):
+        """ the state of each backend for debugging """
+        return dict([(server, dict(backend))
+                     for server, backend in self.backends.items()])
@@ -0,0 +1,129 @@
+# coding=utf-8
+from __future__ import with_statement
+from eventlet import Timeout
+from eventlet.semaphore import Semaphore
+import select
+import time
+
+
+class PoolTimeout(Exception):
+    """ no connection of a key was given back within acquire_timeout """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    a pool of persistent HTTP/1.1 connections per backend.
+
+    connections are keyed by an arbitrary hashable key,
+    e.g. (scheme, host, port, proxy) in the dispatcher.
+
+    :param max_per_host: the max number of open connections (in use and idle)
+                         for each key. get() blocks when it is reached.
+    :param idle_timeout: idle connections older than this (seconds) are closed
+                         instead of reused.
+    :param acquire_timeout: seconds get() waits while max_per_host connections
+                            are in use, None to wait for good.
+    """
+    def __init__(self, max_per_host=32, idle_timeout=30.0, acquire_timeout=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.idle = {}
+        self.semaphores = {}
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0,
+                         'expired': 0, 'discarded': 0, 'acquire_timeouts': 0}
+
+    def get(self, key, factory):
+        """
+        get an idle connection of key, or make a new one by factory().
+        the connection must be given back by put() or discard().
+        :raise PoolTimeout: if no connection of key is free within acquire_timeout.
+        """
+        sem = self.semaphores.get(key)
+        if not sem:
+            sem = self.semaphores.setdefault(key, Semaphore(self.max_per_host))
+        acquired = False
+        with Timeout(self.acquire_timeout, False):
+            acquired = sem.acquire()
+        if not acquired:
+            self.counters['acquire_timeouts'] += 1
+            raise PoolTimeout('%d connections of %s in use' % (self.max_per_host, key))
+        try:
+            conn = self._get_idle(key)
+            if conn:
+                self.counters['hits'] += 1
+                conn.pool_reused = True
+            else:
+                self.counters['misses'] += 1
+                conn = factory()
+                conn.pool_reused = False
+        except:
+            sem.release()
+            raise
+        conn.pool_key = key
+        conn.pool_released = False
+        return conn
+
+    def put(self, conn):
+        """ give back a connection which finished reading a whole response. """
+        if getattr(conn, 'pool_released', True):
+            return
+        if not conn.sock:
+            return self.discard(conn)
+        conn.pool_released = True
+        conn.pool_last_used = time.time()
+        # idle connections are only made by get() misses while no idle one
+        # exists, so in use + idle never exceeds max_per_host.
+        self.idle.setdefault(conn.pool_key, []).append(conn)
+        self.semaphores[conn.pool_key].release()
+
+    def discard(self, conn):
+        """ close a connection which can't be reused. """
+        if getattr(conn, 'pool_released', True):
+            return
+        conn.pool_released = True
+        self.counters['discarded'] += 1
+        self._close(conn)
+        self.semaphores[conn.pool_key].release()
+
+    def stats(self):
+        """ counters and the number of idle connections. """
+        stats = dict(self.counters)
+        stats['idle'] = sum([len(v) for v in self.idle.itervalues()])
+        return stats
+
+    def _get_idle(self, key):
+        idle = self.idle.get(key)
+        now = time.time()
+        while idle:
+            conn = idle.pop()
+            if now - conn.pool_last_used > self.idle_timeout:
+                self.counters['expired'] += 1
+                self._close(conn)
+                continue
+            if self._is_stale(conn):
+                self.counters['stale'] += 1
+                self._close(conn)
+                continue
+            return conn
+        return None
+
+    def _is_stale(self, conn):
+        """
+        an idle socket must not be readable,
+        readable means EOF (closed by the peer) or garbage.
+        """
+        if not conn.sock:
+            return True
+        try:
+            readable, _junk, _junk = select.select([conn.sock.fileno()], [], [], 0)
+        except (select.error, ValueError, IOError):
+            return True
+        return bool(readable)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
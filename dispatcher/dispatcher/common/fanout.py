@@ -0,0 +1,62 @@
+# coding=utf-8
+from eventlet import Timeout
+from greenlet import GreenletExit
+from swift.common.utils import ContextPool
+from dispatcher.common.metrics import WIDTH_BUCKETS
+
+
+class FanOut(object):
+    """
+    relay one request to every swift cluster of a merged location concurrently.
+
+    :param concurrency: the max number of clusters requested at the same time
+                        in one fan-out. 0 means all clusters at once.
+    :param timeout: the deadline (seconds) for the whole fan-out.
+                    0 or None means no deadline.
+    :param partial: if True, the callers may drop the clusters which missed
+                    the deadline from the results, otherwise they fail.
+    """
+    def __init__(self, concurrency=0, timeout=None, partial=False, logger=None, metrics=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.partial = partial
+        self.logger = logger
+        self.metrics = metrics
+
+    def run(self, func, args_list):
+        """
+        call func(*args) for each args in args_list concurrently.
+
+        :return list: results in the same order as args_list.
+                      a result of a call which missed the deadline
+                      (or raised an exception) is None.
+        """
+        results = [None] * len(args_list)
+        if not args_list:
+            return results
+
+        def store(gt, i):
+            try:
+                results[i] = gt.wait()
+            except GreenletExit:
+                # killed by the pool at the deadline, counted as missed below.
+                pass
+            except (Exception, Timeout), err:
+                if self.logger:
+                    self.logger.error('fan-out: request %d failed: %s' % (i, err))
+
+        size = self.concurrency if self.concurrency > 0 else len(args_list)
+        with ContextPool(min(size, len(args_list))) as pool:
+            with Timeout(self.timeout or None, False):
+                for i, args in enumerate(args_list):
+                    pool.spawn(func, *args).link(store, i)
+                pool.waitall()
+        missed = len([r for r in results if r is None])
+        if self.metrics:
+            self.metrics.observe('fanout_width', len(args_list), buckets=WIDTH_BUCKETS)
+            if missed:
+                self.metrics.incr('fanout_missed', value=missed)
+        if missed and self.logger:
+            self.logger.warn('fan-out: %d of %d requests missed the deadline %ss' %
+                             (missed, len(args_list), self.timeout))
+        return results
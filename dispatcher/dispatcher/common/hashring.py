@@ -0,0 +1,57 @@
+# coding=utf-8
+from bisect import bisect
+from hashlib import md5
+
+
+class HashRing(object):
+    """
+    a consistent hash ring with virtual nodes.
+
+    each node has vnodes points on the ring. a key belongs to the node of
+    the first point after the hash of the key, and falls over to the next
+    distinct nodes along the ring, so that adding or removing a node only
+    moves the keys of that node.
+    """
+    def __init__(self, nodes, vnodes=128):
+        self.nodes = tuple(nodes)
+        points = []
+        for node in self.nodes:
+            for i in range(vnodes):
+                points.append((self._hash('%s#%d' % (node, i)), node))
+        points.sort()
+        self.hashes = [h for h, node in points]
+        self.points = [node for h, node in points]
+
+    def _hash(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return int(md5(key).hexdigest()[:8], 16)
+
+    def nodes_for(self, key):
+        """ :return list: the distinct nodes in the ring order from key """
+        nodes = []
+        if not self.points:
+            return nodes
+        start = bisect(self.hashes, self._hash(key))
+        for i in xrange(len(self.points)):
+            node = self.points[(start + i) % len(self.points)]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == len(self.nodes):
+                    break
+        return nodes
+
+    def get(self, key, available=None):
+        """
+        :param available: a function telling whether a node may be used.
+        :return: the first available node of key, or its first node
+                 if none is available.
+        """
+        nodes = self.nodes_for(key)
+        if not nodes:
+            return None
+        if available:
+            for node in nodes:
+                if available(node):
+                    return node
+        return nodes[0]
@@ -0,0 +1,110 @@
+# coding=utf-8
+from eventlet import GreenPool, sleep, spawn
+from urlparse import urlparse
+from eventlet.green import socket
+import time
+
+
+class BackendHealth(object):
+    """
+    EWMA latency and error rate of each backend (swift proxy), fed by
+    relayed requests and periodic probes, to rank the servers of a cluster.
+
+    :param alpha: the weight of a new sample in the EWMAs.
+    :param error_penalty: seconds added to the latency score per error rate,
+                          i.e. a backend failing every request scores
+                          error_penalty seconds slower.
+    """
+    def __init__(self, alpha=0.3, error_penalty=10.0, probe_timeout=1.0, logger=None):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.probe_timeout = probe_timeout
+        self.logger = logger
+        self.stats = {}
+        self.prober = None
+
+    def record(self, server, latency, error=False):
+        """ add a sample of latency (seconds) and error of server """
+        stat = self.stats.get(server)
+        if not stat:
+            self.stats[server] = {'latency': latency,
+                                  'error_rate': 1.0 if error else 0.0,
+                                  'samples': 1,
+                                  'errors': 1 if error else 0,
+                                  'updated': time.time()}
+            return
+        a = self.alpha
+        stat['latency'] = a * latency + (1 - a) * stat['latency']
+        stat['error_rate'] = a * (1.0 if error else 0.0) + (1 - a) * stat['error_rate']
+        stat['samples'] += 1
+        if error:
+            stat['errors'] += 1
+        stat['updated'] = time.time()
+
+    def score(self, server):
+        """ lower is better. unknown servers score 0 to be measured soon. """
+        stat = self.stats.get(server)
+        if not stat:
+            return 0.0
+        return stat['latency'] + stat['error_rate'] * self.error_penalty
+
+    def rank(self, servers):
+        """ servers sorted by score, keeping the given order for ties. """
+        if len(servers) < 2:
+            return servers
+        return sorted(servers, key=self.score)
+
+    def probe(self, server):
+        """ measure a TCP connect to server """
+        parsed = urlparse(server)
+        nl = parsed.netloc.split(':')
+        addr = (nl[0], int(nl[1])) if len(nl) == 2 \
+            else (nl[0], 80 if parsed.scheme == 'http' else 443)
+        start = time.time()
+        sock = None
+        try:
+            sock = socket.create_connection(addr, self.probe_timeout)
+            self.record(server, time.time() - start)
+        except (socket.error, socket.timeout):
+            self.record(server, self.probe_timeout, error=True)
+        finally:
+            if sock:
+                sock.close()
+
+    def probe_all(self, servers):
+        """ probe servers in parallel """
+        pool = GreenPool(max(len(servers), 1))
+        for server in servers:
+            pool.spawn_n(self.probe, server)
+        pool.waitall()
+
+    def start_prober(self, servers_func, interval):
+        """
+        probe servers_func() every interval seconds in a green thread.
+        the socket module must be green (eventlet.monkey_patch) for the
+        probes to run in parallel.
+        """
+        def prober():
+            while True:
+                try:
+                    self.probe_all(servers_func())
+                except Exception, err:
+                    if self.logger:
+                        self.logger.error('health probe failed: %s' % err)
+                sleep(interval)
+        if not self.prober:
+            self.prober = spawn(prober)
+        return self.prober
+
+    def stop_prober(self):
+        if self.prober:
+            self.prober.kill()
+            self.prober = None
+
+    def snapshot(self):
+        """ the stats and the score of each backend for debugging """
+        snap = {}
+        for server, stat in self.stats.items():
+            snap[server] = dict(stat)
+            snap[server]['score'] = self.score(server)
+        return snap
@@ -0,0 +1,86 @@
+# coding=utf-8
+from collections import deque
+
+
+class HedgePolicy(object):
+    """
+    when to hedge a GET or HEAD (send it to the next swift proxy as well)
+    and how many hedges a location may send.
+
+    :param percentile: hedge when no headers arrived in this percentile
+                       of the recent time-to-headers of the location.
+    :param budget: the max ratio of hedges to hedgeable requests per location.
+    :param default_delay: the hedge delay (seconds) until min_samples
+                          latencies of the location are recorded.
+    :param min_delay: the lower bound (seconds) of the hedge delay.
+    :param window: the number of recent latencies kept per location.
+    """
+    def __init__(self, percentile=95, budget=0.05, default_delay=0.5, min_delay=0.01,
+                 window=1000, min_samples=20):
+        self.percentile = percentile
+        self.budget = budget
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.latencies = {}
+        self.delays = {}
+        self.unsorted = {}
+        self.counters = {}
+
+    def _counter(self, location):
+        counter = self.counters.get(location)
+        if not counter:
+            counter = self.counters.setdefault(location, {'requests': 0, 'hedges': 0,
+                                                          'wins': 0})
+        return counter
+
+    def record(self, location, latency):
+        """ add a time-to-headers sample of location """
+        samples = self.latencies.get(location)
+        if samples is None:
+            samples = self.latencies.setdefault(location, deque(maxlen=self.window))
+        samples.append(latency)
+        self.unsorted[location] = self.unsorted.get(location, 0) + 1
+        # sorting the window on each request is too costly,
+        # refresh the delay every few samples.
+        if len(samples) >= self.min_samples and \
+                (location not in self.delays or self.unsorted[location] >= 10):
+            self.unsorted[location] = 0
+            ordered = sorted(samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+            self.delays[location] = max(self.min_delay, ordered[index])
+
+    def delay(self, location):
+        """ seconds to wait for headers before hedging """
+        return self.delays.get(location, self.default_delay)
+
+    def request(self, location):
+        """ count a hedgeable request of location """
+        counter = self._counter(location)
+        counter['requests'] += 1
+        if counter['requests'] >= 100000:
+            # decay, so that the budget follows the recent traffic.
+            counter['requests'] /= 2
+            counter['hedges'] /= 2
+            counter['wins'] /= 2
+
+    def allow(self, location):
+        """ take a hedge from the budget of location, if any is left """
+        counter = self._counter(location)
+        if counter['hedges'] + 1 > counter['requests'] * self.budget:
+            return False
+        counter['hedges'] += 1
+        return True
+
+    def won(self, location):
+        """ count a hedge which answered first """
+        self._counter(location)['wins'] += 1
+
+    def snapshot(self):
+        """ the delay and the counters of each location for debugging """
+        snap = {}
+        for location, counter in self.counters.items():
+            snap[location] = dict(counter)
+            snap[location]['delay'] = self.delay(location)
+        return snap
@@ -0,0 +1,383 @@
+# coding=utf-8
+"""
+streaming merge of swift account listings from multiple clusters.
+
+each cluster's listing is parsed incrementally from its response body
+(text/plain, application/json or application/xml) into Records, the sorted
+streams are merged with a heap, and the merged listing is serialized
+incrementally in chunks of SERIALIZE_BATCH_SIZE entries.
+"""
+import simplejson as json
+from simplejson.encoder import encode_basestring_ascii
+from heapq import merge
+from itertools import chain, imap, islice
+from operator import itemgetter
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+SERIALIZE_BATCH_SIZE = 1000
+
+
+class Record(tuple):
+    """
+    a listing entry, (name, count, bytes, subdir, extra) in a tuple so
+    that the entries of a large listing stay small and compare by name.
+
+    name is a utf-8 str, so that it sorts as swift sorts.
+    count and bytes are ints, or None if the listing has none.
+    objects have no count, and a text/plain listing has only names.
+    subdir is True for a pseudo directory of a delimiter listing.
+    extra holds the other fields as (field, value) pairs, e.g. hash,
+    content_type and last_modified of an object.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, count=None, bytes_used=None, subdir=False, extra=()):
+        return tuple.__new__(cls, (name, count, bytes_used, subdir, extra))
+
+    name = property(itemgetter(0))
+    count = property(itemgetter(1))
+    bytes = property(itemgetter(2))
+    subdir = property(itemgetter(3))
+    extra = property(itemgetter(4))
+
+    def renamed(self, name):
+        return tuple.__new__(Record, (name,) + self[1:])
+
+    def as_dict(self):
+        """ the entry as swift's json listing has it """
+        if self[3]:
+            return {'subdir': self[0].decode('utf-8')}
+        entry = dict(self[4])
+        entry['name'] = self[0].decode('utf-8')
+        if self[1] is not None:
+            entry['count'] = self[1]
+        if self[2] is not None:
+            entry['bytes'] = self[2]
+        return entry
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def record_of(entry):
+    """ a Record of an entry dict of a json or xml listing """
+    if 'subdir' in entry:
+        return Record(_utf8(entry['subdir']), subdir=True)
+    if len(entry) == 3 and 'count' in entry and 'bytes' in entry:
+        # an account listing entry, the most common one.
+        return Record(_utf8(entry['name']), int(entry['count']), int(entry['bytes']))
+    extra = [(k, v) for k, v in entry.iteritems() if k not in ('name', 'count', 'bytes')]
+    return Record(_utf8(entry['name']), _int(entry.get('count')), _int(entry.get('bytes')),
+                  extra=tuple(extra))
+
+
+def iter_plain(chunks):
+    """ parse a text/plain listing, yield a Record of each name """
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            if line:
+                yield Record(line)
+    if rest:
+        yield Record(rest)
+
+
+def iter_json(chunks):
+    """ parse an application/json listing, yield a Record of each entry """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    bulk = False
+    chunks = iter(chunks)
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if not started and pos < len(buf):
+            if buf[pos] != '[':
+                raise ValueError('json listing must be an array')
+            started = True
+            pos += 1
+            continue
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        if bulk:
+            # decode the complete entries of buf at once. a '}' in a name
+            # cuts a string, which fails, and the entries are decoded one
+            # by one instead.
+            bulk = False
+            cut = buf.rfind('}') + 1
+            if cut > pos:
+                try:
+                    entries = json.loads('[%s]' % buf[pos:cut])
+                except ValueError:
+                    pass
+                else:
+                    for entry in entries:
+                        yield record_of(entry)
+                    pos = cut
+                    continue
+        try:
+            entry, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                if buf[pos:].strip():
+                    raise ValueError('truncated json listing')
+                return
+            buf = buf[pos:] + chunk
+            pos = 0
+            bulk = True
+            continue
+        # a number at the end of buf may continue in the next chunk,
+        # but listing entries are objects, so they are always complete.
+        yield record_of(entry)
+        pos = end
+
+
+class _XMLListingParser(object):
+    """ expat handler collecting <container>/<object>/<subdir> elements """
+    def __init__(self):
+        self.parser = expat.ParserCreate('UTF-8')
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.data
+        self.root = None
+        self.root_name = None
+        self.entries = []
+        self.entry = None
+        self.field = None
+        self.text = []
+
+    def start(self, name, attrs):
+        if self.root is None:
+            self.root = name
+            self.root_name = attrs.get('name')
+        elif self.entry is None:
+            self.entry = {}
+            if name == 'subdir':
+                self.entry['subdir'] = attrs.get('name')
+        else:
+            self.field = name
+            self.text = []
+
+    def end(self, name):
+        if self.field is not None:
+            self.entry[self.field] = u''.join(self.text)
+            self.field = None
+        elif self.entry is not None and name != self.root:
+            self.entries.append(record_of(self.entry))
+            self.entry = None
+
+    def data(self, text):
+        if self.field is not None:
+            self.text.append(text)
+
+
+def iter_xml(chunks, info=None):
+    """
+    parse an application/xml listing, yield a Record of each entry.
+
+    :param info: if given, a dict to store the root element name ('root') and
+                 its name attribute ('name', i.e. the account name).
+    """
+    handler = _XMLListingParser()
+    for chunk in chunks:
+        handler.parser.Parse(chunk, False)
+        if info is not None and handler.root:
+            info.setdefault('root', handler.root)
+            info.setdefault('name', handler.root_name)
+        entries, handler.entries = handler.entries, []
+        for entry in entries:
+            yield entry
+    handler.parser.Parse('', True)
+    for entry in handler.entries:
+        yield entry
+
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def merge_listings(streams, combinater_char=':', limit=None):
+    """
+    k-way merge of sorted listings, each name prefixed by its container prefix.
+
+    :param streams: a list of (container prefix, iterator of Records),
+                    each iterator sorted by name.
+    :param limit: stop after this number of entries.
+    """
+    def prefixed(prefix, entries):
+        head = _utf8('%s%s' % (prefix, combinater_char))
+        return imap(lambda entry: entry.renamed(head + entry[0]), entries)
+    # the prefixes differ, so Records of different streams differ by name.
+    merged = merge(*[prefixed(prefix, entries) for prefix, entries in streams])
+    if limit is not None:
+        return islice(merged, limit)
+    return merged
+
+
+def cluster_query(prefix, combinater_char, marker=None, end_marker=None, list_prefix=None):
+    """
+    translate marker, end_marker and prefix of the merged namespace
+    into the ones of a cluster which has container prefix 'prefix'.
+
+    :return dict: the query for the cluster, or None if none of the
+                  cluster's containers is in the requested range.
+    """
+    head = '%s%s' % (prefix, combinater_char)
+    query = {}
+    if marker:
+        if marker.startswith(head):
+            query['marker'] = marker[len(head):]
+        elif marker[:len(head)] > head:
+            return None
+    if end_marker:
+        if end_marker.startswith(head):
+            if not end_marker[len(head):]:
+                return None
+            query['end_marker'] = end_marker[len(head):]
+        elif end_marker[:len(head)] <= head:
+            return None
+    if list_prefix:
+        if list_prefix.startswith(head):
+            if list_prefix[len(head):]:
+                query['prefix'] = list_prefix[len(head):]
+        elif not head.startswith(list_prefix):
+            return None
+    return query
+
+
+def parse_listing(content_type, chunks, info=None):
+    """ an entry iterator for a listing body of content_type """
+    if content_type.startswith('application/json'):
+        return iter_json(chunks)
+    if content_type.startswith('application/xml') or content_type.startswith('text/xml'):
+        return iter_xml(chunks, info)
+    return iter_plain(chunks)
+
+
+def _batches(entries, size=SERIALIZE_BATCH_SIZE):
+    """ lists of size entries """
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, size))
+        if not batch:
+            return
+        yield batch
+
+
+def serialize_plain(entries):
+    first = True
+    for batch in _batches(entries):
+        chunk = '\n'.join([entry[0] for entry in batch])
+        if first:
+            first = False
+            yield chunk
+        else:
+            yield '\n' + chunk
+
+
+def _json_entry(entry):
+    name, count, bytes_used, subdir, extra = entry
+    if subdir:
+        return '{"subdir": %s}' % encode_basestring_ascii(name)
+    if extra:
+        return json.dumps(entry.as_dict())
+    if count is None:
+        if bytes_used is None:
+            return '{"name": %s}' % encode_basestring_ascii(name)
+        return '{"name": %s, "bytes": %d}' % (encode_basestring_ascii(name), bytes_used)
+    return '{"name": %s, "count": %d, "bytes": %d}' % \
+        (encode_basestring_ascii(name), count, bytes_used or 0)
+
+
+def serialize_json(entries):
+    yield '['
+    first = True
+    for batch in _batches(entries):
+        chunk = ', '.join([_json_entry(entry) for entry in batch])
+        if first:
+            first = False
+            yield chunk
+        else:
+            yield ', ' + chunk
+    yield ']'
+
+
+def _xml_text(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return escape(value)
+
+
+def _xml_entry(element, entry):
+    name, count, bytes_used, subdir, extra = entry
+    if subdir:
+        return '<subdir name=%s><name>%s</name></subdir>' % (quoteattr(name), escape(name))
+    if not extra and bytes_used is not None:
+        if count is None:
+            return '<%s><name>%s</name><bytes>%s</bytes></%s>' % \
+                (element, escape(name), bytes_used, element)
+        return '<%s><name>%s</name><count>%d</count><bytes>%s</bytes></%s>' % \
+            (element, escape(name), count, bytes_used, element)
+    fields = [('name', name)]
+    if count is not None:
+        fields.append(('count', count))
+    if bytes_used is not None:
+        fields.append(('bytes', bytes_used))
+    fields.extend(extra)
+    fields.sort(key=lambda f: _xml_field_order(f[0]))
+    return '<%s>%s</%s>' % (element, ''.join(['<%s>%s</%s>' % (k, _xml_text(v), k)
+                                              for k, v in fields]), element)
+
+
+def serialize_xml(entries, info=None):
+    """
+    :param info: the dict filled by iter_xml(). it is read after the first
+                 entry has been parsed, so the root element can be written.
+    """
+    entries = iter(entries)
+    try:
+        first = [entries.next()]
+    except StopIteration:
+        first = []
+    info = info or {}
+    root = _utf8(info.get('root') or 'account')
+    if info.get('name') is None:
+        head = '<?xml version="1.0" encoding="UTF-8"?><%s>' % root
+    else:
+        head = '<?xml version="1.0" encoding="UTF-8"?><%s name=%s>' % \
+            (root, _utf8(quoteattr(info['name'])))
+    element = 'container' if root == 'account' else 'object'
+    for batch in _batches(chain(first, entries)):
+        yield head + ''.join([_xml_entry(element, entry) for entry in batch])
+        head = ''
+    yield head + '</%s>' % root
+
+
+_XML_FIELDS = ('name', 'hash', 'count', 'bytes', 'content_type', 'last_modified')
+
+def _xml_field_order(field):
+    try:
+        return (_XML_FIELDS.index(field), field)
+    except ValueError:
+        return (len(_XML_FIELDS), field)
+
+
+def serialize_listing(content_type, entries, info=None):
+    """ a chunk iterator of entries serialized as content_type """
+    if content_type.startswith('application/json'):
+        return serialize_json(entries)
+    if content_type.startswith('application/xml') or content_type.startswith('text/xml'):
+        return serialize_xml(entries, info)
+    return serialize_plain(entries)
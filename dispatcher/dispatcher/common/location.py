@@ -4,116 +4,190 @@ from urlparse import urlparse
 import time
 import socket
 import re
+from eventlet import sleep, spawn
+from dispatcher.common.hashring import HashRing
+
+class RoutingTable(object):
+    """
+    an immutable snapshot of relay rules, precompiled into maps
+    which are looked up in O(1) on each request.
+    a Location swaps the whole snapshot when the server list files change.
+
+    :param webcaches: {location: {swift: [webcaches]}}, a consistent hash
+                      ring is made for the swift servers with several webcaches.
+    """
+    def __init__(self, locations, files, age, webcaches=None):
+        self.locations = locations
+        self.files = tuple(files)
+        self.age = age
+        self.merged = {}
+        self.netloc_prefix = {}
+        self.servers_by_prefix = {}
+        self.cluster_index = {}
+        swift_servers = []
+        for loc, servers in locations.iteritems():
+            for cluster in servers['swift']:
+                swift_servers.extend([svr for svr in cluster if svr not in swift_servers])
+            self.merged[loc] = len(servers['swift']) > 1
+            netloc_prefix = {}
+            for svr in servers['webcache'].iterkeys():
+                p = urlparse(svr)
+                netloc_prefix[svr] = servers['container_prefix'].get(p.scheme + '://' + p.netloc)
+            self.netloc_prefix[loc] = netloc_prefix
+            by_prefix = {}
+            for svr, prefix in servers['container_prefix'].iteritems():
+                by_prefix.setdefault(prefix, []).append(svr)
+            self.servers_by_prefix[loc] = by_prefix
+            index = {}
+            for i, cluster in enumerate(servers['swift']):
+                for svr in cluster:
+                    p = urlparse(svr)
+                    index.setdefault(servers['container_prefix'].get(p.scheme + '://' + p.netloc), i)
+            self.cluster_index[loc] = index
+        self.swift_servers = tuple(swift_servers)
+        self.webcache_rings = {}
+        rings = {}
+        for loc, caches_of in (webcaches or {}).iteritems():
+            self.webcache_rings[loc] = {}
+            for svr, caches in caches_of.iteritems():
+                if len(caches) > 1:
+                    caches = tuple(caches)
+                    if caches not in rings:
+                        rings[caches] = HashRing(caches)
+                    self.webcache_rings[loc][svr] = rings[caches]
+
 
 class Location(object):
 
-    def __init__(self, location_str):
-        self.locations = None
+    def __init__(self, location_str, reload_interval=0):
+        self.table = None
         self.location_str = location_str
-        self.locations, self.age = self._load(location_str)
+        self.table, self.age = self._load(location_str)
         if self.age == 0:
             raise ValueError('initialize error.')
-        
+        self.reload_interval = reload_interval
+        self.watcher = None
+        if reload_interval > 0:
+            self.start_watcher(reload_interval)
+
+    @property
+    def locations(self):
+        return self.table.locations
 
     def _load(self, location_str):
-        locations = None
+        table = None
         age = 0
         try:
-            locations, age = self._parse_location_str(self.location_str)
+            locations, files, age, webcaches = self._parse_location_str(self.location_str)
+            table = RoutingTable(locations, files, age, webcaches)
         except Exception, err:
-            if self.locations != None:
+            if self.table != None:
                 print 'Error: %s go on using old location settings.' % err
-                return self.locations, age
+                return self.table, 0
             print err
-        return locations, age
+        return table, age
 
     def reload(self):
+        """
+        reload relay rules if a server list file was updated,
+        and swap the routing snapshot at once.
+        """
         try:
             if self.check_file_age(self.location_str) > self.age:
-                locations, age = self._load(self.location_str)
+                table, age = self._load(self.location_str)
                 if age == 0:
                     self.age = age
                 else:
-                    self.locations = locations
+                    self.table = table
                     self.age = age
         except Exception, err:
             print 'Error: %s go on using old location settings.' % err
 
+    def start_watcher(self, interval):
+        """
+        watch the server list files in a green thread,
+        so that requests don't stat them on the hot path.
+        """
+        def watch():
+            while True:
+                sleep(interval)
+                self.reload()
+        if not self.watcher:
+            self.watcher = spawn(watch)
+        return self.watcher
+
+    def stop_watcher(self):
+        if self.watcher:
+            self.watcher.kill()
+            self.watcher = None
+
     def has_location(self, location_str):
-        if location_str:
-            return self.locations.has_key(location_str)
-        else:
-            return self.locations.has_key('')
+        return self.table.locations.has_key(location_str or '')
 
     def servers_of(self, location_str):
-        if location_str:
-            try:
-                return self.locations[location_str]
-            except KeyError:
-                return None
-        else:
-            return self.locations['']
+        return self.table.locations.get(location_str or '')
 
     def swift_of(self, location_str):
-        if location_str:
-            try:
-                return self.locations[location_str]['swift']
-            except KeyError:
-                return None
-        else:
-            return self.locations['']['swift']
+        try:
+            return self.table.locations[location_str or '']['swift']
+        except KeyError:
+            return None
+
+    def swift_servers(self):
+        """ all swift servers of all locations, without duplicates """
+        return self.table.swift_servers
 
     def webcache_of(self, location_str):
-        if location_str:
-            try:
-                return self.locations[location_str]['webcache']
-            except KeyError:
-                return None
-        else:
-            return self.locations['']['webcache']
+        try:
+            return self.table.locations[location_str or '']['webcache']
+        except KeyError:
+            return None
+
+    def webcache_ring_of(self, location_str, swift):
+        """ the HashRing of the webcaches of swift, None unless it has several """
+        try:
+            return self.table.webcache_rings[location_str or ''].get(swift)
+        except KeyError:
+            return None
 
     def is_merged(self, prefix_str):
-        if prefix_str:
-            try:
-                if len(self.locations[prefix_str]['swift']) > 1:
-                    return True
-                return False
-            except KeyError:
-                return None
-        else:
-            if len(self.locations['']['swift']) > 1:
-                return True
-            return False
+        return self.table.merged.get(prefix_str or '')
 
     def container_prefix_of(self, location_str, swift):
-        if location_str:
+        try:
+            cont_prefix = self.table.netloc_prefix[location_str or ''][swift]
+        except KeyError:
             try:
-                cont_prefix = self.locations[location_str]['container_prefix']
+                cont_prefix = self.table.locations[location_str or '']['container_prefix']
             except KeyError:
                 return False
-        else:
-            cont_prefix = self.locations['']['container_prefix']
-        p = urlparse(swift)
-        key = p.scheme + '://' + p.netloc
-        try:
-            cont_prefix_name = cont_prefix[key]
-        except KeyError:
-            return False
-        if cont_prefix_name:
-            return cont_prefix_name
+            p = urlparse(swift)
+            try:
+                cont_prefix = cont_prefix[p.scheme + '://' + p.netloc]
+            except KeyError:
+                return False
+        if cont_prefix:
+            return cont_prefix
         return None
 
     def container_prefixes_of(self, location_str):
-        if location_str:
-            try:
-                return self.locations[location_str]['container_prefix']
-            except KeyError:
-                return None
-        else:
-            return self.locations['']['container_prefix']
+        try:
+            return self.table.locations[location_str or '']['container_prefix']
+        except KeyError:
+            return None
 
     def servers_by_container_prefix_of(self, location_str, container_prefix):
-        return [k for k,v in self.container_prefixes_of(location_str).iteritems() if v == container_prefix]
+        try:
+            return self.table.servers_by_prefix[location_str or ''].get(container_prefix, [])
+        except KeyError:
+            return []
+
+    def cluster_index_of(self, location_str, container_prefix):
+        """ the subscript of the cluster which has container_prefix in swift_of() """
+        try:
+            return self.table.cluster_index[location_str or ''].get(container_prefix)
+        except KeyError:
+            return None
 
     def _parse_location_str(self, location_str):
 
@@ -126,6 +200,7 @@ class Location(object):
         - 識別子とサーバーリストファイルの組は、カンマで区切って複数指定する
         - サーバリストは、swiftのURL（スキーム・ホスト名・ポート番号）を1行ごとに記述したもの
         - 更に、swift URLの後にカンマで連結してそのswift URLに対するWebCacheサーバを指定できる（省略可）
+        - WebCacheサーバはカンマで連結して複数指定でき、オブジェクトはコンシステントハッシュで振り分けられる
         - 識別子が空文字列の場合には、デフォルト動作の指定となる
     
         :param location_str: a string like 'local:/etc/dispatcher/server0.txt, both:(cont_prefx0)/etc/dispatcher/server1.txt (cont_prefx0)/etc/dispatcher/server1.txt'
@@ -136,15 +211,21 @@ class Location(object):
                                          'webcache': {'http://192.168.0.2:8080': None, 'http://192.168.0.3:8080': None}},
                         location_name3(both): {'swift': [['http://192.168.0.4:8080'], ['http://192.168.10.5:8080', 'http://192.168.10.6:8080']],
                                          'webcache': {'http://192.168.0.4:8080': None, 'http://192.168.10.5:8080': None, 'http://192.168.10.6:8080: None'}}}
+        :return files: server list files
         :return file_age: the newest mtime of server list files
+        :return webcaches: {location_name: {swift URL: [WebCache URLs]}}, 'webcache'
+                           of the location dict has the first WebCache of each.
         """
         location = {}
+        webcaches = {}
         file_age = None
+        file_list = []
         try:
             for loc in location_str.split(','):
                 loc_prefix, files = loc.split(':')
                 location[loc_prefix.strip()] = {'swift': [], 'webcache': {}, 'container_prefix': {}}
                 webcache_svrs = {}
+                webcaches[loc_prefix.strip()] = {}
                 container_prefix = {}
                 for f in files.split(None):
                     prefix = None
@@ -153,6 +234,7 @@ class Location(object):
                         prefix = f_str[0].split('(')[1]
                         f = f_str[1]
                     tmp_file_age = os.stat(f).st_mtime
+                    file_list.append(f)
                     if file_age:
                         if file_age < tmp_file_age:
                             file_age = tmp_file_age
@@ -164,17 +246,17 @@ class Location(object):
                             if line.startswith('#'):
                                 continue
                             svr_ls = line.split(',')
-                            if len(svr_ls) == 2:
-                                webcache = svr_ls[1].strip()
+                            caches = [c.strip() for c in svr_ls[1:] if c.strip()]
+                            for webcache in caches:
                                 if not re.match('^http.?://.+', webcache):
                                     raise ValueError('no url string.')
-                            else:
-                                webcache = None
+                            webcache = caches[0] if caches else None
                             swift = svr_ls[0].strip()
                             if not re.match('^http.?://.+', swift):
                                 raise ValueError('no url string.')
                             parsed = urlparse(swift)
                             webcache_svrs[swift] = webcache
+                            webcaches[loc_prefix.strip()][swift] = caches
                             container_prefix[parsed.scheme + '://' + parsed.netloc] = prefix
                             swift_ls.append(swift)
                         swift_ls = self._sock_connect_faster(swift_ls)
@@ -187,23 +269,15 @@ class Location(object):
             raise ValueError('server list file is missing: %s' % err)
         except Exception, err:
             raise ValueError('something happened: %s' % err)
-        return location, file_age
+        return location, file_list, file_age, webcaches
 
 
     def check_file_age(self, location_str):
-        """ """
+        """ the newest mtime of server list files """
         file_age = None
-        for loc in location_str.split(','):
-            loc_prefix, files = loc.split(':')
-            for f in files.split(None):
-                if f.startswith('('):
-                    f_str = f.split(')')
-                    f = f_str[1]
-                tmp_file_age = os.stat(f).st_mtime
-            if file_age:
-                if file_age < tmp_file_age:
-                    file_age = tmp_file_age
-            else:
+        for f in self.table.files:
+            tmp_file_age = os.stat(f).st_mtime
+            if file_age < tmp_file_age:
                 file_age = tmp_file_age
         return file_age
 
@@ -0,0 +1,79 @@
+# coding=utf-8
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRU(object):
+    """
+    a dict which keeps its keys in the order of use, the least recently
+    used first, in a doubly linked list of [prev, next, key, value] links.
+    get() and setting a key make it the most recently used, [] does not.
+    """
+    def __init__(self):
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __getitem__(self, key):
+        return self.links[key][VALUE]
+
+    def __setitem__(self, key, value):
+        link = self.links.get(key)
+        if link:
+            link[VALUE] = value
+            self._unlink(link)
+        else:
+            link = self.links[key] = [None, None, key, value]
+        self._append(link)
+
+    def get(self, key, default=None):
+        """ the value of key, which becomes the most recently used """
+        link = self.links.get(key)
+        if not link:
+            return default
+        self._unlink(link)
+        self._append(link)
+        return link[VALUE]
+
+    def pop(self, key, default=None):
+        link = self.links.pop(key, None)
+        if not link:
+            return default
+        self._unlink(link)
+        return link[VALUE]
+
+    def oldest(self):
+        """ the least recently used key, None if empty """
+        return self.root[NEXT][KEY]
+
+    def popitem(self):
+        """ remove and return (key, value) of the least recently used key """
+        if not self.links:
+            raise KeyError('popitem(): LRU is empty')
+        key = self.oldest()
+        return key, self.pop(key)
+
+    def iterkeys(self):
+        link = self.root[NEXT]
+        while link is not self.root:
+            yield link[KEY]
+            link = link[NEXT]
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def _append(self, link):
+        last = self.root[PREV]
+        link[PREV], link[NEXT] = last, self.root
+        last[NEXT] = self.root[PREV] = link
+
+    def _unlink(self, link):
+        link[PREV][NEXT], link[NEXT][PREV] = link[NEXT], link[PREV]
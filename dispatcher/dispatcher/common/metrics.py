@@ -0,0 +1,89 @@
+# coding=utf-8
+from eventlet.green import socket
+import re
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WIDTH_BUCKETS = (1, 2, 3, 4, 8, 16)
+
+
+class Metrics(object):
+    """
+    in-process counters and histograms of the dispatcher,
+    optionally sent to statsd as well.
+
+    each metric has a name and labels, a tuple of (label, value) pairs,
+    e.g. ('relay_first_byte', (('location', 'both'), ('backend', 'http://...'))).
+
+    :param statsd_host: send each update to this statsd server (UDP).
+    """
+    def __init__(self, statsd_host=None, statsd_port=8125, statsd_prefix='dispatcher'):
+        self.counters = {}
+        self.histograms = {}
+        self.statsd_addr = (statsd_host, int(statsd_port)) if statsd_host else None
+        self.statsd_prefix = statsd_prefix
+        self.statsd_sock = None
+
+    def incr(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+        if self.statsd_addr:
+            self._statsd('%s:%d|c' % (self._statsd_name(name, labels), value))
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        """ add a sample to a histogram, latencies are in seconds """
+        key = (name, labels)
+        hist = self.histograms.get(key)
+        if not hist:
+            hist = self.histograms.setdefault(key, {'buckets': buckets,
+                                                    'counts': [0] * (len(buckets) + 1),
+                                                    'count': 0, 'sum': 0})
+        i = 0
+        for bound in hist['buckets']:
+            if value <= bound:
+                break
+            i += 1
+        hist['counts'][i] += 1
+        hist['count'] += 1
+        hist['sum'] += value
+        if self.statsd_addr:
+            if buckets is LATENCY_BUCKETS:
+                self._statsd('%s:%d|ms' % (self._statsd_name(name, labels), value * 1000))
+            else:
+                self._statsd('%s:%s|h' % (self._statsd_name(name, labels), value))
+
+    def snapshot(self):
+        """
+        all metrics as a dict for json,
+        {'counters': {name: {labels: value}}, 'histograms': {name: {labels: {...}}}}
+        """
+        snap = {'counters': {}, 'histograms': {}}
+        for (name, labels), value in self.counters.items():
+            snap['counters'].setdefault(name, {})[self._labels_str(labels)] = value
+        for (name, labels), hist in self.histograms.items():
+            buckets = dict([(str(bound), count)
+                            for bound, count in zip(hist['buckets'], hist['counts'])])
+            buckets['+Inf'] = hist['counts'][-1]
+            snap['histograms'].setdefault(name, {})[self._labels_str(labels)] = \
+                {'count': hist['count'], 'sum': hist['sum'], 'buckets': buckets}
+        return snap
+
+    def _labels_str(self, labels):
+        return ','.join(['%s=%s' % (k, v) for k, v in labels])
+
+    def _statsd_name(self, name, labels):
+        parts = [self.statsd_prefix, name] + \
+            [re.sub('[^A-Za-z0-9_-]', '_', str(v) or 'default') for _junk, v in labels]
+        return '.'.join(parts)
+
+    def _statsd(self, line):
+        try:
+            if not self.statsd_sock:
+                self.statsd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.statsd_sock.sendto(line, self.statsd_addr)
+        except (socket.error, socket.gaierror):
+            pass
+
+
+def status_class(status):
+    """ '2xx' for 200, ... """
+    return '%dxx' % (int(status) / 100)
@@ -3,8 +3,11 @@ from urlparse import urlparse, urlunparse
 from eventlet.green.httplib import HTTPConnection, HTTPResponse, HTTPSConnection
 from webob import Request, Response
 from swift.common.utils import get_logger
+from webob.exc import HTTPException, HTTPServiceUnavailable, HTTPUnauthorized, status_map
 from eventlet.timeout import Timeout
 from swift.common.exceptions import ConnectionTimeout
+from dispatcher.common.fanout import FanOut
+from dispatcher.common.tokencache import token_cache_from_conf, earliest_expires
 import os
 import sys
 
@@ -23,6 +26,19 @@ keystone_other_url = http://192.0.2.200:5001
 dispatcher_base_url = http://192.0.2.1:10000
 region_name = RegionOne
 
+or, for any number of keystones (in the order of the clusters of the location):
+
+keystone_urls = http://192.0.2.100:5001 http://192.0.2.200:5001 http://192.0.2.300:5001
+# seconds to connect to a keystone, and for its whole response
+keystone_conn_timeout = 1
+keystone_timeout = 10
+# cache merged access documents of confirmed merged tokens, for ttl seconds at
+# most and not after a token expires; memcache servers are optional
+merged_token_cache = no
+merged_token_cache_ttl = 300
+merged_token_cache_max_entries = 10000
+merged_token_memcache_servers = 127.0.0.1:11211
+
 """
 
 class KeystoneMerge(object):
@@ -34,8 +50,15 @@ class KeystoneMerge(object):
         self.logger = get_logger(conf, log_route='keystone_merge')
         self.keystone_relay_path = conf.get('keystone_relay_path','/both/v2.0')
         self.keystone_relay_token_paths = conf.get('keystone_relay_token_paths').split()
-        self.keystone_one_url = conf.get('keystone_one_url')
-        self.keystone_other_url = conf.get('keystone_other_url')
+        self.keystone_urls = conf.get('keystone_urls', '').split() or \
+            [conf.get('keystone_one_url'), conf.get('keystone_other_url')]
+        self.keystone_one_url = self.keystone_urls[0]
+        self.keystone_conn_timeout = float(conf.get('keystone_conn_timeout', 1))
+        self.keystone_timeout = float(conf.get('keystone_timeout', 10))
+        # each keystone has its own deadline, the fan-out one is a safety net.
+        self.fanout = FanOut(timeout=self.keystone_conn_timeout + self.keystone_timeout,
+                             partial=True, logger=self.logger)
+        self.token_cache = token_cache_from_conf(conf, self.logger)
         self.dispatcher_base_url = conf.get('dispatcher_base_url')
         self.region_name = conf.get('region_name', 'RegionOne')
         self.merge_str = '__@@__'
@@ -52,7 +75,10 @@ class KeystoneMerge(object):
             return self.app(env, start_response)
         if self.is_keystone_auth_token_req(req):
             self.logger.info('return auth response that merged one and other')
-            mbody, mheaders = self.relay_keystone_auth_req(req, real_path)             
+            try:
+                mbody, mheaders = self.relay_keystone_auth_req(req, real_path)
+            except HTTPException, err:
+                return err(env, start_response)
             #print 'mbody in keystone_merge: %s' % mbody
             if mbody:
                 merged_resp = Response(request=req, 
@@ -116,54 +142,85 @@ class KeystoneMerge(object):
 
     def relay_keystone_auth_req(self, req, path):
         """ 
-        relay auth request by Creds to each keystone, and merge response. 
+        relay auth request by Creds to each keystone concurrently, and merge response. 
+        a merged token needs the token of every keystone, the dispatcher relays
+        each of them to its cluster.
+        :raise HTTPException: when a keystone did not authenticate the request.
         """
         request = json.loads(req.body)
         creds = request['auth'] if request.has_key('auth') else request
-        resps = []
-        #print 'request body in keystone_merge: %s' % creds
-        #if req.headers.has_key('x-auth-token'):
-        #    print 'request header: %s' %  req.headers.get('x-auth-token')
+        auth_headers = []
+        if req.headers.has_key('x-auth-token'):
+            auth_headers = req.headers.get('x-auth-token').split(self.merge_str)
+        cache_key = None
         if creds.has_key('token') and path.rstrip('/') == '/v2.0/tokens':
-            #print 'eppn request 0: '
             # for recomfirming auth token
             merged_token = creds['token']['id']
             if merged_token.find(self.merge_str) == -1:
                 return None, None
+            if self.token_cache:
+                cache_key = self.token_cache.key(path.rstrip('/'), merged_token,
+                                                 json.dumps(creds.get('tenantId')),
+                                                 json.dumps(creds.get('tenantName')))
+                cached = self.token_cache.get(cache_key)
+                if cached:
+                    mbody, mheaders = json.loads(cached)
+                    return mbody, dict([(str(h), str(v)) for h, v in mheaders.iteritems()])
             requests = self._merged_request_token_split(request)
-
-            auth_headers = [] 
-            if req.headers.has_key('x-auth-token'):
-               auth_headers = req.headers.get('x-auth-token').split(self.merge_str)
-            for url,request in zip([self.keystone_one_url, self.keystone_other_url], requests):
-                #print request
-                #print url
-                #print path
-                #print req.headers
-                try:
-                    auth_header = auth_headers.pop()
-                    req.headers['x-auth-token'] = auth_header
-                except IndexError, e:
-                    pass
-                resp = self._request_to_keystone('POST', url, path.rstrip('/') + '/', 
-                                                 req.headers, json.dumps(request))
-                resps.append(resp)
+            if len(requests) != len(self.keystone_urls) or \
+                    not all([r['auth']['token']['id'] for r in requests]):
+                raise HTTPUnauthorized(body='The merged token has no token of some keystone')
+            bodies = [json.dumps(r) for r in requests]
+            path = path.rstrip('/') + '/'
         else:
-            #print 'eppn request 1: %s' % url
-            if req.headers.has_key('x-auth-token'):
-                auth_headers = req.headers.get('x-auth-token').split(self.merge_str)
-                #print 'auth_tokens: %s' % auth_headers
-            try:
-                auth_header = auth_headers.pop()
-                req.headers['x-auth-token'] = auth_header
-            except IndexError, e:
-                pass
-            #print req.headers
-            resps = [self._request_to_keystone('POST', url, path, req.headers, req.body) for url in [self.keystone_one_url, self.keystone_other_url]]
-        #for resp in resps:
-        #    print 'resp.status: %s %s' % (resp.status, resp.url)
-        bodies = self._get_bodies(resps)
-        return self._access_info_merge(bodies), self._merge_headers(resps)
+            bodies = [req.body] * len(self.keystone_urls)
+        calls = []
+        for i, (url, body) in enumerate(zip(self.keystone_urls, bodies)):
+            headers = dict([(h.lower(), v) for h, v in req.headers.iteritems()])
+            if auth_headers:
+                # each keystone gets its own token of a merged x-auth-token.
+                if len(auth_headers) == len(self.keystone_urls):
+                    headers['x-auth-token'] = auth_headers[i]
+                else:
+                    headers['x-auth-token'] = auth_headers[-1]
+            calls.append((i, (url, path, headers, body)))
+        results = [None] * len(self.keystone_urls)
+        for (i, _junk), result in zip(calls, self.fanout.run(self._auth_keystone,
+                                                             [args for _junk, args in calls])):
+            results[i] = result
+        for url, result in zip(self.keystone_urls, results):
+            if result and result[0] != 200:
+                self.logger.info('keystone %s returned %s' % (url, result[0]))
+        bodies = list(self._get_bodies(results))
+        if None in bodies:
+            raise self._auth_error(results)
+        mbody, mheaders = self._access_info_merge(bodies), self._merge_headers(results)
+        if cache_key:
+            self.token_cache.set(cache_key, json.dumps([mbody, mheaders]),
+                                 earliest_expires(bodies))
+        return mbody, mheaders
+
+    def _auth_keystone(self, url, path, headers, body):
+        """
+        POST an auth request to a keystone, within its deadline.
+        :return: (status, headers, body), or None if it failed.
+        """
+        try:
+            with Timeout(self.keystone_timeout):
+                resp = self._request_to_keystone('POST', url, path, headers, body)
+                return resp.status, resp.getheaders(), resp.read()
+        except (Exception, Timeout), err:
+            self.logger.warn('auth request to keystone %s failed: %s' % (url, err))
+            return None
+
+    def _auth_error(self, results):
+        """ the error of the first keystone which answered one, or 503 """
+        for result in results:
+            if result and result[0] != 200 and result[0] in status_map:
+                headers = [(h, v) for h, v in result[1]
+                           if h not in ('content-length', 'date', 'transfer-encoding', 'connection')]
+                return status_map[result[0]](body=result[2], headers=headers)
+        return HTTPServiceUnavailable(body='a keystone did not respond')
 
     def _merged_request_token_split(self, request):
         requests = []
@@ -198,10 +255,13 @@ class KeystoneMerge(object):
                            'serviceCatalog': [swift_catalog], 
                            'user': users[0]}}
 
-    def _get_bodies(self, resps):
-        for resp in resps:
-            if resp.status == 200:
-                yield json.loads(resp.read())
+    def _get_bodies(self, results):
+        """ the access info of each (status, headers, body), None if it failed """
+        for result in results:
+            if result and result[0] == 200:
+                yield json.loads(result[2])
+            else:
+                yield None
 
     def _token_merge(self, tokens):
         expires = None
@@ -246,10 +306,10 @@ class KeystoneMerge(object):
             return paths[0]
         return None
 
-    def _merge_headers(self, resps):
+    def _merge_headers(self, results):
         mheaders = {}
         headers = []
-        for hs in [r.getheaders() for r in resps]:
+        for hs in [r[1] for r in results if r and r[0] == 200]:
             headers = headers + hs
         for h, v in headers:
             if h != 'content-length' and h != 'date':
@@ -276,13 +336,13 @@ class KeystoneMerge(object):
         parsed = urlparse(url)
         connector = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection 
         host, port = self._split_netloc(parsed)
-        with ConnectionTimeout(300):
+        with ConnectionTimeout(self.keystone_conn_timeout):
             conn = connector(host, port)
-            headers['Content-Length'] = len(body)
+            headers['content-length'] = len(body)
             #print '%s %s %s %s' % (method, path, body, headers)
             conn.request(method, path, body, headers)
-            with Timeout(300):
-                return conn.getresponse()
+        with Timeout(self.keystone_timeout):
+            return conn.getresponse()
 
 
 def filter_factory(global_conf, **local_conf):
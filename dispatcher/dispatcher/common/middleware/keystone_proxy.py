@@ -8,14 +8,19 @@ from webob.exc import HTTPException, HTTPAccepted, HTTPBadRequest, \
     HTTPMovedPermanently, HTTPNoContent, HTTPNotFound, \
     HTTPServiceUnavailable, HTTPUnauthorized, HTTPGatewayTimeout, \
     HTTPBadGateway,  HTTPRequestEntityTooLarge, HTTPServerError, HTTPPreconditionFailed
-from swift.common.utils import get_logger
+from swift.common.utils import get_logger, TRUE_VALUES
 from eventlet import TimeoutError
 from eventlet.timeout import Timeout
 from swift.common.exceptions import ConnectionTimeout
 from dispatcher.common.location import Location
+from dispatcher.common.fanout import FanOut
+from dispatcher.common.connpool import ConnectionPool
+from dispatcher.common.health import BackendHealth
+from dispatcher.common.tokencache import token_cache_from_conf, earliest_expires
 import os
 import sys
 import re
+import time
 
 """
 Setting
@@ -34,6 +39,20 @@ keystone_auth_port = 5000
 keystone_admin_port = 35357
 conn_timeout = 0.5
 timeout = 300
+relay_rule_reload_interval = 5
+# keep-alive connections to each keystone node (0: disable pooling)
+conn_pool_max_per_host = 32
+conn_pool_idle_timeout = 30
+# try the nodes of a site in the order of their EWMA latency and error rate
+health_ranking = yes
+health_ewma_alpha = 0.3
+health_error_penalty = 10
+# cache merged responses of merged token confirmations (POST .../tokens) of
+# merged locations, for ttl seconds at most and not after a token expires
+merged_token_cache = no
+merged_token_cache_ttl = 300
+merged_token_cache_max_entries = 10000
+merged_token_memcache_servers = 127.0.0.1:11211
 
 
 URL Pattern
@@ -49,6 +68,30 @@ URL Pattern
  curl -v -H 'Content-Type: application/json' -X POST -d '{"auth":{"token": {"id": "8bac4be7-2473-45a1-9fda-06976c57b518"}}}' http://172.30.112.168:10000/ks/auth/v2.0/tokens
 """
 
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-connection')
+
+
+class KeystoneResponse(object):
+    """ a response of a keystone node read whole, as HTTPResponse has it """
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return self.headers
+
+    def getheader(self, name, default=None):
+        for header, value in self.headers:
+            if header == name.lower():
+                return value
+        return default
+
+    def read(self):
+        return self.body
+
+
 class KeystoneProxy(object):
     """ """
     def __init__(self, app, conf):
@@ -74,8 +117,20 @@ class KeystoneProxy(object):
         self.timeout = int(conf.get('timeout', 300))
         self.req_version_str = 'v[12]\.0'
         self.merge_str = '__@@__'
+        self.fanout = FanOut(logger=self.logger)
+        conn_pool_max_per_host = int(conf.get('conn_pool_max_per_host', 32))
+        self.conn_pool = ConnectionPool(max_per_host=conn_pool_max_per_host,
+                                        idle_timeout=float(conf.get('conn_pool_idle_timeout', 30)),
+                                        acquire_timeout=float(conf.get('conn_pool_acquire_timeout', 10))) \
+                                        if conn_pool_max_per_host > 0 else None
+        self.health_ranking = conf.get('health_ranking', 'yes').lower() in TRUE_VALUES
+        self.health = BackendHealth(alpha=float(conf.get('health_ewma_alpha', 0.3)),
+                                    error_penalty=float(conf.get('health_error_penalty', 10)),
+                                    logger=self.logger)
+        self.token_cache = token_cache_from_conf(conf, self.logger)
         try:
-            self.loc = Location(self.relay_rule)
+            self.loc = Location(self.relay_rule,
+                                reload_interval=float(conf.get('relay_rule_reload_interval', 5)))
         except:
             raise ValueError, 'KeyStone Proxy relay rule is invalid.'
 
@@ -83,7 +138,6 @@ class KeystoneProxy(object):
         """
         """
         req = Request(env)
-        self.loc.reload()
         if self.loc.age == 0:
             self.logger.warn('dispatcher relay rule is invalid, using old rules now.')
         if not self.is_keystone_proxy_path(req):
@@ -95,7 +149,18 @@ class KeystoneProxy(object):
         ks_port = self.keystone_auth_port \
             if api_type == self.keystone_proxy_auth_path \
             else self.keystone_admin_port
-        (succ_resps, fail_resps) = self.request_to_ks(req, self.loc.swift_of(loc_prefix), ks_port)
+        cache_key = None
+        if self.token_cache and self.loc.is_merged(loc_prefix):
+            cache_key = self.merged_token_cache_key(req, loc_prefix, api_type)
+            cached = cache_key and self.token_cache.get(cache_key)
+            if cached:
+                body, header = json.loads(cached)
+                res = Response(status='200 OK')
+                res.headerlist = [(str(n), str(v)) for n, v in header]
+                res.body = body.encode('utf-8')
+                return res(env, start_response)
+        servers = self.loc.swift_of(loc_prefix)
+        (succ_resps, fail_resps) = self.request_to_ks(req, servers, ks_port)
         if len(succ_resps) == 0:
             resp = fail_resps[0]
             if isinstance(resp, HTTPException):
@@ -107,6 +172,8 @@ class KeystoneProxy(object):
                 (body, header) = self.ks_merge_response(succ_resps, loc_prefix)
             except Exception, err:
                 return HTTPServerError(body=err)(env, start_response)
+            if cache_key and len(succ_resps) == len(servers):
+                self.cache_merged_token(cache_key, succ_resps, body, header)
             res = Response(status='200 OK')
             res.headerlist = header
             res.body = body
@@ -115,6 +182,26 @@ class KeystoneProxy(object):
         start_response('%s %s' % (resp.status, resp.reason),  resp.getheaders())
         return resp.read()
 
+    def merged_token_cache_key(self, req, loc_prefix, api_type):
+        """ the cache key of a confirmation of a merged token, None for other requests """
+        if req.method != 'POST' or not req.body:
+            return None
+        try:
+            token = json.loads(req.body)['auth']['token']['id']
+        except (KeyError, TypeError, ValueError):
+            return None
+        if token.find(self.merge_str) < 0:
+            return None
+        return self.token_cache.key(loc_prefix, api_type, req.path, req.body)
+
+    def cache_merged_token(self, cache_key, resps, body, header):
+        """ cache the merged response until the earliest token expires """
+        try:
+            accesses = [json.loads(resp.read()) for resp in resps]
+        except ValueError:
+            return
+        self.token_cache.set(cache_key, json.dumps([body, header]), earliest_expires(accesses))
+
     def is_keystone_proxy_path(self, req):
         """ 
         check a path which keystone_proxy controls.
@@ -138,40 +225,101 @@ class KeystoneProxy(object):
 
     def request_to_ks(self, req, servers, port):
         """ Routing multiple keystone servers.
+            The sites are requested concurrently, the nodes of a site
+            one after another until one succeeds.
         """
         succ_resps = []
         fail_resps = []
         auth_tokens = self._split_auth_token(req, servers)
         bodies = self._split_body(req, servers)
-        for site, token, body in zip(servers, auth_tokens, bodies):
-            for node in site:
-                parsed = urlparse(self._combinate_ks_url(node, port, req))
-                connector = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection 
-                try:
-                    with ConnectionTimeout(self.conn_timeout):
-                        (host, port) = parsed.netloc.split(':')
-                        headers = req.headers
-                        if req.headers.has_key('Host'):
-                            headers['Host'] = host + ':' + str(port)
-                        if token:
-                            headers['X-Auth-Token'] = token
-                        if req.headers.has_key('Content-Length'):
-                            del headers['Content-Length']
-                        conn = connector(host, port)
-                        conn.request(req.method, parsed.path, body, headers)
-                        with Timeout(self.timeout):
-                            resp = conn.getresponse()
-                            if resp.status >= 200 and resp.status <= 300:
-                                succ_resps.append(resp)
-                                break
-                            else:
-                                fail_resps.append(resp)
-                except ValueError, err:
-                    fail_resps.append(HTTPPreconditionFailed(request=req))
-                except (Exception, TimeoutError), err:
-                    fail_resps.append(HTTPServiceUnavailable(request=req))
+        results = self.fanout.run(self.request_to_site,
+                                  [(req, site, port, token, body)
+                                   for site, token, body in zip(servers, auth_tokens, bodies)])
+        for result in results:
+            if result is None:
+                fail_resps.append(HTTPServiceUnavailable(request=req))
+                continue
+            succ_resp, site_fail_resps = result
+            if succ_resp:
+                succ_resps.append(succ_resp)
+            fail_resps.extend(site_fail_resps)
         return succ_resps, fail_resps
 
+    def request_to_site(self, req, site, port, token, body):
+        """ Try the nodes of a site, the best ranked first.
+            :return: (the succeeded response or None, the failed responses)
+        """
+        fail_resps = []
+        if self.health_ranking:
+            site = self.health.rank(site)
+        for node in site:
+            start = time.time()
+            try:
+                resp = self._request_to_node(req, node, port, token, body)
+            except ValueError, err:
+                fail_resps.append(HTTPPreconditionFailed(request=req))
+                continue
+            except (Exception, TimeoutError), err:
+                self.logger.warn('keystone %s failed: %s' % (node, err))
+                self.health.record(node, time.time() - start, error=True)
+                fail_resps.append(HTTPServiceUnavailable(request=req))
+                continue
+            self.health.record(node, time.time() - start, error=resp.status >= 500)
+            if resp.status >= 200 and resp.status <= 300:
+                return resp, fail_resps
+            fail_resps.append(resp)
+        return None, fail_resps
+
+    def _request_to_node(self, req, node, port, token, body):
+        """ Relay req to a keystone node on a pooled connection,
+            and read the whole response.
+        """
+        parsed = urlparse(self._combinate_ks_url(node, port, req))
+        connector = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection
+        (host, port) = parsed.netloc.split(':')
+        headers = dict([(h, v) for h, v in req.headers.iteritems()
+                        if h.lower() not in HOP_BY_HOP_HEADERS])
+        if headers.has_key('Host'):
+            headers['Host'] = host + ':' + str(port)
+        if token:
+            headers['X-Auth-Token'] = token
+        if headers.has_key('Content-Length'):
+            del headers['Content-Length']
+        for attempt in range(2):
+            conn = None
+            http_resp = None
+            try:
+                with ConnectionTimeout(self.conn_timeout):
+                    if self.conn_pool:
+                        conn = self.conn_pool.get((parsed.scheme, host, port),
+                                                  lambda: connector(host, port))
+                    else:
+                        conn = connector(host, port)
+                    conn.request(req.method, parsed.path, body, headers)
+                with Timeout(self.timeout):
+                    http_resp = conn.getresponse()
+                    resp = KeystoneResponse(http_resp.status, http_resp.reason,
+                                            http_resp.getheaders(), http_resp.read())
+                break
+            except BaseException, err:
+                # also a Timeout or the GreenletExit of a killed fan-out,
+                # which must not keep the pool slot.
+                reused = getattr(conn, 'pool_reused', False)
+                if conn and self.conn_pool:
+                    self.conn_pool.discard(conn)
+                if reused and http_resp is None and isinstance(err, Exception) \
+                        and attempt == 0:
+                    # the keystone may close an idle keep-alive connection at any time.
+                    self.logger.debug('retry keystone %s on a new connection: %s' % (node, err))
+                    continue
+                raise
+        if self.conn_pool:
+            if http_resp.will_close:
+                self.conn_pool.discard(conn)
+            else:
+                self.conn_pool.put(conn)
+        return resp
+
     def ks_merge_response(self, resps, loc_prefix):
         """ Merge JSON and HTTP headers from multiple KS servers.
         """
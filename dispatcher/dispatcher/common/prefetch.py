@@ -0,0 +1,120 @@
+# coding=utf-8
+from eventlet import spawn, Queue
+
+
+def plan_segments(segments, start, stop):
+    """
+    map the byte range [start, stop) of a manifest object onto its segments.
+
+    :param segments: [(name, size)] of the segments in order.
+    :return list: [(name, first byte, last byte, size)] of the segments to read.
+    """
+    plan = []
+    offset = 0
+    for name, size in segments:
+        if offset >= stop:
+            break
+        if size and offset + size > start:
+            plan.append((name, max(start - offset, 0), min(stop - offset, size) - 1, size))
+        offset += size
+    return plan
+
+
+class SegmentFetch(object):
+    """ a segment fetched into a bounded queue by a green thread """
+    def __init__(self, segment, queue, thread):
+        self.segment = segment
+        self.queue = queue
+        self.thread = thread
+        self.consumed = 0
+        self.retried = False
+
+
+class PrefetchIter(object):
+    """
+    the body of a manifest object, read from its segments in order while
+    the next ones are fetched ahead of the client.
+
+    up to count segments are fetched at once, each into a queue of
+    queue_size chunks, so at most count * queue_size chunks are buffered.
+    a segment fetched ahead may wait long for the client and be cut by
+    the backend; it is fetched again from where the client is, once.
+
+    :param plan: the segments to read, from plan_segments().
+    :param fetch: a callable(name, first, last, size) returning an iterable
+                  of the bytes first..last of the segment.
+    :param count: the number of segments fetched at once.
+    """
+    def __init__(self, plan, fetch, count=4, queue_size=16):
+        self.plan = plan
+        self.fetch = fetch
+        self.count = max(1, count)
+        self.queue_size = queue_size
+        self.fetches = []
+        self.next_seg = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self.closed:
+            self._start()
+            if not self.fetches:
+                break
+            current = self.fetches[0]
+            chunk = current.queue.get()
+            if chunk is None:
+                self.fetches.pop(0)
+                continue
+            if isinstance(chunk, Exception):
+                name, first, last, size = current.segment
+                if current.retried or first + current.consumed > last:
+                    self.close()
+                    raise chunk
+                self.fetches[0] = self._spawn((name, first + current.consumed, last, size))
+                self.fetches[0].retried = True
+                continue
+            current.consumed += len(chunk)
+            return chunk
+        self.closed = True
+        raise StopIteration
+
+    def close(self):
+        self.closed = True
+        for each in self.fetches:
+            each.thread.kill()
+        self.fetches = []
+
+    def _start(self):
+        while len(self.fetches) < self.count and self.next_seg < len(self.plan):
+            self.fetches.append(self._spawn(self.plan[self.next_seg]))
+            self.next_seg += 1
+
+    def _spawn(self, segment):
+        queue = Queue(self.queue_size)
+        return SegmentFetch(segment, queue, spawn(self._fetch, segment, queue))
+
+    def _fetch(self, segment, queue):
+        """ put the chunks of segment to queue, then None or the error """
+        name, first, last, size = segment
+        body = None
+        end = None
+        try:
+            body = self.fetch(name, first, last, size)
+            length = last - first + 1
+            got = 0
+            for chunk in body:
+                got += len(chunk)
+                if got > length:
+                    break
+                if chunk:
+                    queue.put(chunk)
+            if got != length:
+                raise IOError('segment %s: got %d bytes of %d' % (name, got, length))
+        except Exception, err:
+            end = err
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        queue.put(end)
@@ -0,0 +1,161 @@
+# coding=utf-8
+from webob import Response
+from dispatcher.common.lru import LRU
+import time
+
+# requests with these headers are relayed as they are.
+UNCACHEABLE_HEADERS = ('range', 'if-match', 'if-none-match', 'if-modified-since',
+                       'if-unmodified-since', 'x-newest')
+
+
+class CacheEntry(object):
+    """ a cached 200 response """
+    def __init__(self, status, headerlist, body, etag, expires):
+        self.status = status
+        self.headerlist = headerlist
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self.size = len(body) + sum([len(h) + len(v) for h, v in headerlist])
+
+    def fresh(self):
+        return time.time() < self.expires
+
+
+class ResponseCache(object):
+    """
+    an LRU cache of small GET responses of swift: objects, and container
+    listings of anonymous (public) requests. an entry is keyed by the
+    cluster, the path, the query, the auth token and the accept header.
+
+    an expired entry with an etag is revalidated by If-None-Match. writes
+    through the dispatcher invalidate the object and its container listing
+    (a container write invalidates everything in the container); entries
+    cached by other dispatchers or workers only expire.
+
+    :param max_bytes: the byte budget of all entries.
+    :param max_entry_size: responses with larger bodies are not cached.
+    :param ttl: seconds an entry is served without revalidation.
+    """
+    def __init__(self, max_bytes=67108864, max_entry_size=65536, ttl=10, metrics=None):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.ttl = ttl
+        self.metrics = metrics
+        self.entries = LRU()
+        self.paths = {}  # (cluster, path) -> keys of the path
+        self.bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'revalidated': 0,
+                         'evictions': 0, 'invalidations': 0}
+
+    def key(self, req, cluster, path_str_ls, query):
+        """ :return: the key of a cacheable request, otherwise None """
+        if req.method != 'GET':
+            return None
+        for header in UNCACHEABLE_HEADERS:
+            if header in req.headers:
+                return None
+        token = req.headers.get('x-auth-token') or req.headers.get('x-storage-token')
+        container_path, object_path = split_path(path_str_ls)
+        if object_path:
+            path = object_path
+        elif container_path and not token:
+            path = container_path
+        else:
+            return None
+        return (cluster, path, query, token, req.headers.get('accept'))
+
+    def get(self, key):
+        """ :return: the entry of key (fresh or not) or None """
+        entry = self.entries.get(key)
+        if not entry:
+            self._count('misses')
+        return entry
+
+    def hit(self, entry):
+        """ :return: a response of a fresh entry """
+        self._count('hits')
+        return self._response(entry)
+
+    def revalidated(self, key, entry):
+        """ :return: a response of an entry swift answered 304 for """
+        entry.expires = time.time() + self.ttl
+        self._count('revalidated')
+        return self._response(entry)
+
+    def store(self, key, resp):
+        """
+        cache resp if it is a small 200 response.
+        :return: a response to give to the client instead of resp.
+        """
+        self._remove(key)
+        if resp.status_int != 200 or resp.content_length is None or \
+                resp.content_length > self.max_entry_size or \
+                'x-object-manifest' in resp.headers:
+            return resp
+        entry = CacheEntry(resp.status, list(resp.headerlist), resp.body,
+                           resp.headers.get('etag'), time.time() + self.ttl)
+        if entry.size <= self.max_bytes:
+            self.entries[key] = entry
+            self.paths.setdefault(key[:2], set()).add(key)
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                self._remove(self.entries.oldest())
+                self._count('evictions')
+        return self._response(entry)
+
+    def invalidate(self, cluster, path_str_ls):
+        """ drop the entries a write to the path makes stale """
+        container_path, object_path = split_path(path_str_ls)
+        if not container_path:
+            return
+        if object_path:
+            paths = [(cluster, object_path), (cluster, container_path)]
+        else:
+            paths = [p for p in self.paths.iterkeys()
+                     if p[0] == cluster and (p[1] == container_path or
+                                             p[1].startswith(container_path + '/'))]
+        for path in paths:
+            for key in list(self.paths.get(path, ())):
+                self._remove(key)
+                self._count('invalidations')
+
+    def snapshot(self):
+        snapshot = dict(self.counters)
+        lookups = self.counters['hits'] + self.counters['revalidated'] + self.counters['misses']
+        snapshot.update({'entries': len(self.entries), 'bytes': self.bytes,
+                         'hit_ratio': float(self.counters['hits'] + self.counters['revalidated']) /
+                         lookups if lookups else 0})
+        return snapshot
+
+    def _response(self, entry):
+        # app_iter is given to the constructor, which keeps content-length.
+        return Response(status=entry.status, headerlist=list(entry.headerlist),
+                        app_iter=[entry.body])
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.bytes -= entry.size
+            keys = self.paths.get(key[:2])
+            keys.discard(key)
+            if not keys:
+                del self.paths[key[:2]]
+
+    def _count(self, name):
+        self.counters[name] += 1
+        if self.metrics:
+            self.metrics.incr('cache_%s' % name)
+
+
+def split_path(path_str_ls):
+    """
+    :param path_str_ls: the real path split by '/', e.g. ['v1.0', 'AUTH_test', 'cont', 'obj']
+    :return: (container path, object path), each None if the path has none.
+    """
+    if len(path_str_ls) < 3 or not path_str_ls[2]:
+        return None, None
+    container_path = '/' + '/'.join(path_str_ls[:3])
+    if len(path_str_ls) > 3 and ''.join(path_str_ls[3:]):
+        return container_path, '/' + '/'.join(path_str_ls)
+    return container_path, None
@@ -0,0 +1,132 @@
+# coding=utf-8
+from __future__ import with_statement
+from webob import Response
+from webob.exc import HTTPGatewayTimeout, HTTPRequestTimeout
+from eventlet import Queue
+from eventlet.queue import Full
+from swift.common.utils import ContextPool
+from swift.common.exceptions import ChunkReadTimeout
+import time
+
+PUT_INTERVAL = 1
+
+
+class SegmentInput(object):
+    """
+    the wsgi.input of a segment PUT, read from a bounded queue which the
+    Segmenter fills with the chunks of the client body until None.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.done = False
+
+    def read(self, size=-1):
+        if self.done:
+            return ''
+        chunk = self.queue.get()
+        if chunk is None:
+            self.done = True
+            return ''
+        return chunk
+
+
+class Segmenter(object):
+    """
+    split a request body of a known length into segments of seg_size bytes
+    on the fly, and upload up to concurrency segments at once.
+
+    the body is read once, in order. a segment is handed to its upload
+    through a queue of queue_size chunks, so the next segments are read
+    while the earlier ones are still written and committed by swift, and
+    at most concurrency * queue_size chunks are buffered.
+
+    :param seg_size: the max size of a segment.
+    :param concurrency: the max number of segments uploaded at once.
+    :param chunk_size: bytes read from the client at a time.
+    :param timeout: seconds to wait for the client or a segment upload.
+    """
+    def __init__(self, seg_size, concurrency=4, queue_size=16, chunk_size=65536, timeout=60):
+        self.seg_size = seg_size
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def count(self, total):
+        """ the number of segments of a body of total bytes """
+        return max(1, (total + self.seg_size - 1) / self.seg_size)
+
+    def run(self, read, total, upload, request=None):
+        """
+        :param read: a callable like wsgi.input.read.
+        :param total: the length of the body.
+        :param upload: a callable(seg, size, input) which PUTs a segment with
+                       its size from input and returns a webob Response.
+        :return list: the responses of the segments in order. it ends with the
+                      first failed one, the other uploads are killed then.
+        """
+        resps = []
+        with ContextPool(self.concurrency) as pool:
+            uploads = []
+            for seg in xrange(self.count(total)):
+                if self._failed(uploads):
+                    break
+                size = min(self.seg_size, total - seg * self.seg_size)
+                queue = Queue(self.queue_size)
+                # blocks while concurrency segments are uploaded.
+                uploads.append(pool.spawn(upload, seg, size, SegmentInput(queue)))
+                error = self._feed(read, size, queue, uploads[-1], request)
+                if error:
+                    uploads[-1].kill()
+                    uploads[-1] = error
+                    break
+            for each in uploads:
+                resp = each if isinstance(each, Response) else each.wait()
+                resps.append(resp)
+                if resp.status_int // 100 != 2:
+                    break
+        return resps
+
+    def _feed(self, read, size, queue, upload, request):
+        """ :return: an error response if the segment could not be fed """
+        left = size
+        while left > 0:
+            try:
+                with ChunkReadTimeout(self.timeout):
+                    chunk = read(min(self.chunk_size, left))
+            except ChunkReadTimeout:
+                chunk = ''
+            if not chunk:
+                return HTTPRequestTimeout(request=request)
+            left -= len(chunk)
+            if not self._put(queue, chunk, upload):
+                break
+        else:
+            if self._put(queue, None, upload):
+                return None
+        if upload.dead:
+            # the upload gave up, its response tells why.
+            return None
+        return HTTPGatewayTimeout(request=request)
+
+    def _put(self, queue, item, upload):
+        """
+        put item to the queue of upload, checking every PUT_INTERVAL
+        seconds that the upload is still running.
+        :return: True if it was put.
+        """
+        deadline = time.time() + self.timeout
+        while not upload.dead:
+            try:
+                queue.put(item, timeout=max(min(PUT_INTERVAL, deadline - time.time()), 0))
+                return True
+            except Full:
+                if time.time() >= deadline:
+                    return False
+        return False
+
+    def _failed(self, uploads):
+        for each in uploads:
+            if each.dead and each.wait().status_int // 100 != 2:
+                return True
+        return False
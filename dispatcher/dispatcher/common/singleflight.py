@@ -0,0 +1,202 @@
+# coding=utf-8
+from webob import Response
+from webob.exc import HTTPException
+from collections import deque
+from eventlet import spawn_n, Timeout
+from eventlet.event import Event
+
+
+class TeeIter(object):
+    """
+    the body of a shared response for one subscriber, read from its
+    buffer filled by the pump of the flight. the pump always ends or
+    drops a tee, so a read does not need a timeout.
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.chunks = deque()
+        self.closed = False
+        self.dropped = False
+        self.ended = False
+        self.end = None
+        self.readable = None  # Event of the reader waiting for a chunk
+        self.room = None  # Event of the pump waiting for a read
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.closed:
+            raise StopIteration
+        while not self.chunks:
+            if self.dropped:
+                self.closed = True
+                raise IOError('dropped, too slow to read')
+            if self.ended:
+                self.closed = True
+                if self.end:
+                    raise self.end
+                raise StopIteration
+            self.readable = Event()
+            self.readable.wait()
+        chunk = self.chunks.popleft()
+        self.wake_pump()
+        return chunk
+
+    def close(self):
+        self.closed = True
+        self.wake_pump()
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        self.wake_reader()
+
+    def finish(self, end=None):
+        """ :param end: an exception to raise after the chunks, if any """
+        self.ended = True
+        self.end = end
+        self.wake_reader()
+
+    def drop(self):
+        self.dropped = True
+        self.wake_reader()
+
+    def wake_reader(self):
+        if self.readable and not self.readable.ready():
+            self.readable.send()
+
+    def wake_pump(self):
+        if self.room and not self.room.ready():
+            self.room.send()
+
+
+class Flight(object):
+    """ a running call and the callers waiting for its response """
+    def __init__(self):
+        self.followers = 0
+        self.event = Event()
+
+
+class SingleFlight(object):
+    """
+    share one call among concurrent identical requests.
+
+    the first caller of a key runs the call, the callers of the same key
+    which come while it runs wait for its response and get a copy of it.
+    a streamed body is read once and teed to every subscriber. the body is
+    read as fast as the fastest subscriber takes it, up to queue_size
+    chunks ahead; a subscriber more than queue_size chunks behind the
+    fastest one is dropped so that it does not stall the others, and all
+    of them are dropped when none takes a chunk within timeout seconds.
+
+    :param queue_size: the max number of chunks buffered ahead of the
+                       fastest subscriber.
+    :param timeout: seconds to wait for the fastest subscriber.
+    """
+    def __init__(self, queue_size=16, timeout=60, logger=None, metrics=None):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.logger = logger
+        self.metrics = metrics
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        :param func: a callable returning a webob Response.
+        :return: the response of func(), or a copy of it for a follower.
+        """
+        flight = self.flights.get(key)
+        if flight:
+            flight.followers += 1
+            self.coalesced += 1
+            if self.metrics:
+                self.metrics.incr('coalesced_requests')
+            return flight.event.wait().pop()
+        flight = self.flights[key] = Flight()
+        self.leaders += 1
+        try:
+            resp = func()
+        except Exception, err:
+            del self.flights[key]
+            if flight.followers:
+                flight.event.send(exc=err)
+            raise
+        # no one can join once the response is here.
+        del self.flights[key]
+        if not flight.followers:
+            return resp
+        copies = self.share(resp, flight.followers + 1)
+        flight.event.send(copies[1:])
+        return copies[0]
+
+    def share(self, resp, count):
+        """ :return list: count independent copies of resp """
+        if isinstance(resp, HTTPException):
+            return [resp] + [resp.__class__(detail=resp.detail) for i in range(count - 1)]
+        if isinstance(resp.app_iter, (list, tuple)):
+            body = ''.join(resp.app_iter)
+            return [self.copy(resp, [body]) for i in range(count)]
+        tees = [TeeIter(self.timeout) for i in range(count)]
+        spawn_n(self.pump, resp.app_iter, tees)
+        return [self.copy(resp, tee) for tee in tees]
+
+    def copy(self, resp, app_iter):
+        # app_iter is given to the constructor, which keeps content-length.
+        return Response(status=resp.status, headerlist=list(resp.headerlist),
+                        app_iter=app_iter)
+
+    def pump(self, source, tees):
+        """ read source once and feed each chunk to every open subscriber """
+        end = None
+        try:
+            for chunk in source:
+                tees = self.wait_room(tees)
+                if not tees:
+                    break
+                for tee in tees:
+                    tee.feed(chunk)
+                fastest = min([len(tee.chunks) for tee in tees])
+                for tee in tees:
+                    if len(tee.chunks) - fastest > self.queue_size:
+                        self.drop(tee, 'fell %d chunks behind' % self.queue_size)
+        except Exception, err:
+            end = err
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+        for tee in tees:
+            if not tee.closed and not tee.dropped:
+                tee.finish(end)
+
+    def wait_room(self, tees):
+        """
+        wait until the fastest open subscriber has less than queue_size
+        chunks buffered, no more than timeout seconds.
+        :return: the open subscribers.
+        """
+        while True:
+            tees = [tee for tee in tees if not tee.closed and not tee.dropped]
+            if not tees or min([len(tee.chunks) for tee in tees]) < self.queue_size:
+                return tees
+            room = Event()
+            for tee in tees:
+                tee.room = room
+            with Timeout(self.timeout, False):
+                room.wait()
+            for tee in tees:
+                tee.room = None
+            if not room.ready():
+                for tee in tees:
+                    self.drop(tee, 'read nothing for %ss' % self.timeout)
+                return []
+
+    def drop(self, tee, reason):
+        tee.drop()
+        if self.logger:
+            self.logger.warn('single-flight: dropped a subscriber which %s' % reason)
+
+    def snapshot(self):
+        return {'leaders': self.leaders, 'coalesced': self.coalesced,
+                'running': len(self.flights)}
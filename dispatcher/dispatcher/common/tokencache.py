@@ -0,0 +1,127 @@
+# coding=utf-8
+from hashlib import md5
+from swift.common.utils import TRUE_VALUES
+from dispatcher.common.lru import LRU
+import calendar
+import time
+
+
+def parse_expires(expires):
+    """
+    the epoch time of a keystone token 'expires', e.g.
+    '2012-01-09T19:11:27.058939'. keystone writes its local time
+    (datetime.now()) without a zone, a trailing 'Z' means UTC.
+    :return: None if it can't be parsed.
+    """
+    try:
+        parsed = time.strptime(expires.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+    if expires.endswith('Z'):
+        return calendar.timegm(parsed)
+    return time.mktime(parsed)
+
+
+def earliest_expires(accesses):
+    """ the earliest token expiry (epoch) of access documents, None if unknown """
+    expires = [parse_expires(a.get('access', {}).get('token', {}).get('expires'))
+               for a in accesses]
+    if not expires or None in expires:
+        return None
+    return min(expires)
+
+
+class TokenCache(object):
+    """
+    merged access documents (or any json value) of merged tokens, in an
+    in-process LRU and, if given, memcache shared by the workers and the
+    dispatchers.
+
+    an entry lives ttl seconds at most, and never longer than the earliest
+    expiry of the tokens merged in it.
+
+    :param memcache: a swift MemcacheRing, or None for the in-process tier only.
+    """
+    def __init__(self, ttl=300, max_entries=10000, memcache=None, prefix='merged_token',
+                 logger=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memcache = memcache
+        self.prefix = prefix
+        self.logger = logger
+        self.entries = LRU()
+        self.counters = {'hits': 0, 'memcache_hits': 0, 'misses': 0, 'stores': 0}
+
+    def key(self, *parts):
+        """ a memcache safe key of the parts (merged tokens are long) """
+        return '%s/%s' % (self.prefix, md5('\n'.join(parts)).hexdigest())
+
+    def get(self, key):
+        """ :return: the value of key, None if it is not cached """
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry and now < entry[1]:
+            self.counters['hits'] += 1
+            return entry[0]
+        if entry:
+            self.entries.pop(key)
+        if self.memcache:
+            try:
+                entry = self.memcache.get(key)
+            except Exception, err:
+                entry = None
+                if self.logger:
+                    self.logger.warn('memcache get of %s failed: %s' % (key, err))
+            if entry and now < entry[1]:
+                self._store_local(key, entry[0], entry[1])
+                self.counters['memcache_hits'] += 1
+                return entry[0]
+        self.counters['misses'] += 1
+        return None
+
+    def set(self, key, value, expires=None):
+        """
+        cache value, a json serializable one.
+        :param expires: the epoch time the merged tokens expire, if known.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        if expires is not None:
+            expires_at = min(expires_at, expires)
+        if expires_at <= now:
+            return
+        self._store_local(key, value, expires_at)
+        self.counters['stores'] += 1
+        if self.memcache:
+            try:
+                self.memcache.set(key, [value, expires_at], timeout=int(expires_at - now) + 1)
+            except Exception, err:
+                if self.logger:
+                    self.logger.warn('memcache set of %s failed: %s' % (key, err))
+
+    def snapshot(self):
+        snapshot = dict(self.counters)
+        snapshot['entries'] = len(self.entries)
+        return snapshot
+
+    def _store_local(self, key, value, expires_at):
+        self.entries[key] = (value, expires_at)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem()
+
+
+def token_cache_from_conf(conf, logger=None):
+    """
+    the TokenCache of the merged_token_cache* options of conf,
+    None unless merged_token_cache is on.
+    """
+    if conf.get('merged_token_cache', 'no').lower() not in TRUE_VALUES:
+        return None
+    memcache = None
+    servers = conf.get('merged_token_memcache_servers', '').strip()
+    if servers:
+        from swift.common.memcached import MemcacheRing
+        memcache = MemcacheRing([s.strip() for s in servers.split(',') if s.strip()])
+    return TokenCache(ttl=float(conf.get('merged_token_cache_ttl', 300)),
+                      max_entries=int(conf.get('merged_token_cache_max_entries', 10000)),
+                      memcache=memcache, logger=logger)
@@ -0,0 +1,255 @@
+# coding=utf-8
+"""
+a pre-fork WSGI server for the dispatcher.
+
+the master binds the listening socket once and forks 'workers' processes.
+each worker loads the app and accepts on the shared socket.
+a worker that dies is restarted.
+
+on SIGHUP the master starts a new generation of workers with the current
+configuration. then it asks the old workers to stop accepting, and they
+exit when their requests are done, so no connection is dropped.
+
+a worker that dies within MIN_UPTIME seconds of its start is restarted
+after a delay. the delay doubles on each such death, up to MAX_BACKOFF
+seconds, so a broken app does not cause a fork loop.
+
+SIGTERM stops everything at once.
+'workers = 0' serves in the master process without forking.
+"""
+from __future__ import with_statement
+import errno
+import os
+import signal
+import socket
+import time
+
+import eventlet
+from eventlet import greenio, wsgi, GreenPool, Timeout
+from eventlet.event import Event
+from eventlet.green.select import select
+from paste.deploy import appconfig, loadapp
+from swift.common.utils import capture_stdio, drop_privileges, get_logger
+from swift.common.wsgi import get_socket
+
+MIN_UPTIME = 5
+MAX_BACKOFF = 60
+
+
+class NullLogger(object):
+    """ eventlet.wsgi access log, the dispatcher logs by itself """
+    def write(self, *args):
+        pass
+
+
+class Listener(object):
+    """
+    the listening socket given to eventlet.wsgi.server.
+
+    once a byte arrives on stop_fd, accept() blocks for good: the worker
+    stops accepting, but the server does not exit, which would close the
+    connections it is serving.
+    """
+    def __init__(self, sock, stop_fd):
+        self.sock = sock
+        self.stop_fd = stop_fd
+        self.stopped = Event()
+
+    def accept(self):
+        while True:
+            readable = select([self.sock, self.stop_fd], [], [])[0]
+            if self.stop_fd in readable:
+                break
+            try:
+                client, addr = self.sock.fd.accept()
+            except socket.error, err:
+                # another worker took it.
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                raise
+            return greenio.GreenSocket(client), addr
+        self.stopped.send()
+        Event().wait()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def serve(sock, conf_file, log_name, logger, stop_fd=None, graceful_timeout=None):
+    """
+    load the app and serve it on sock. with stop_fd, stop accepting when a
+    byte arrives on it (or it is closed), and return when the running
+    requests are done or graceful_timeout seconds passed.
+    """
+    wsgi.HttpProtocol.default_request_version = 'HTTP/1.0'
+    eventlet.hubs.use_hub('poll')
+    eventlet.patcher.monkey_patch(all=False, socket=True)
+    app = loadapp('config:%s' % conf_file, global_conf={'log_name': log_name})
+    pool = GreenPool(size=1024)
+    if stop_fd is None:
+        wsgi.server(sock, app, NullLogger(), custom_pool=pool)
+        return
+    listener = Listener(sock, stop_fd)
+    eventlet.spawn_n(wsgi.server, listener, app, NullLogger(), custom_pool=pool)
+    listener.stopped.wait()
+    logger.notice('Worker %d stops accepting, %d requests running' %
+                  (os.getpid(), pool.running()))
+    with Timeout(graceful_timeout, False):
+        pool.waitall()
+
+
+def run_wsgi(conf_file, app_section, *args, **kwargs):
+    """
+    run the app of app_section in conf_file, the same interface as
+    swift.common.wsgi.run_wsgi().
+    """
+    conf = appconfig('config:%s' % conf_file, name=app_section)
+    log_name = conf.get('log_name', app_section)
+    logger = get_logger(conf, log_name,
+                        log_to_console=kwargs.pop('verbose', False), log_route='wsgi')
+    sock = get_socket(conf, default_port=kwargs.get('default_port', 8080))
+    drop_privileges(conf.get('user', 'swift'))
+    capture_stdio(logger)
+    master = Master(sock, conf_file, app_section, log_name, logger,
+                    graceful_timeout=float(conf.get('graceful_timeout', 300)) or None)
+    master.run(int(conf.get('workers', '1')))
+
+
+class Master(object):
+    """ forks, restarts and reloads the workers """
+    def __init__(self, sock, conf_file, app_section, log_name, logger,
+                 graceful_timeout=None):
+        self.sock = sock
+        self.conf_file = conf_file
+        self.app_section = app_section
+        self.log_name = log_name
+        self.logger = logger
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}  # pid -> write end of its stop pipe
+        self.started = {}  # pid -> the time it was forked
+        self.backoff = 0
+        self.spawn_after = 0
+        self.retiring = set()
+        self.running = True
+        self.reloading = False
+
+    def run(self, worker_count):
+        if worker_count == 0:
+            serve(self.sock, self.conf_file, self.log_name, self.logger)
+            return
+        signal.signal(signal.SIGTERM, self.on_term)
+        signal.signal(signal.SIGHUP, self.on_hup)
+        while self.running:
+            if self.reloading:
+                self.reloading = False
+                worker_count = self.reload(worker_count)
+            while self.running and len(self.workers) < worker_count:
+                delay = self.spawn_after - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                    continue
+                self.spawn()
+            try:
+                pid, status = os.wait()
+            except OSError, err:
+                if err.errno == errno.ECHILD:
+                    time.sleep(1)
+                elif err.errno != errno.EINTR:
+                    raise
+                continue
+            except KeyboardInterrupt:
+                break
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                self.logger.notice('Old worker %s exited' % pid)
+            elif pid in self.workers:
+                self.reap(pid, status)
+        greenio.shutdown_safe(self.sock)
+        self.sock.close()
+        self.logger.notice('Exited')
+
+    def spawn(self):
+        """
+        fork a worker. the worker also stops when the master dies and the
+        stop pipe is closed.
+        """
+        stop_r, stop_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(stop_w)
+            for fd in self.workers.values():
+                os.close(fd)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                serve(self.sock, self.conf_file, self.log_name, self.logger,
+                      stop_fd=stop_r, graceful_timeout=self.graceful_timeout)
+                self.logger.notice('Worker %d exiting normally' % os.getpid())
+            finally:
+                os._exit(0)
+        os.close(stop_r)
+        self.workers[pid] = stop_w
+        self.started[pid] = time.time()
+        self.logger.notice('Started worker %s' % pid)
+
+    def reap(self, pid, status):
+        """
+        forget a dead worker. if it died right after it started, the next
+        one is spawned after the backoff, doubled each time.
+        """
+        os.close(self.workers.pop(pid))
+        uptime = time.time() - self.started.pop(pid, 0)
+        if uptime < MIN_UPTIME:
+            self.backoff = min(max(self.backoff * 2, 1), MAX_BACKOFF)
+            self.spawn_after = time.time() + self.backoff
+            self.logger.error('Removed worker %s (status %s) %.1f seconds after its start, '
+                              'next one in %d seconds' % (pid, status, uptime, self.backoff))
+        else:
+            self.backoff = 0
+            self.logger.error('Removed worker %s (status %s)' % (pid, status))
+
+    def retire(self, pid):
+        """ let a worker stop accepting and exit after its requests """
+        stop_w = self.workers.pop(pid)
+        self.started.pop(pid, None)
+        try:
+            os.write(stop_w, 'x')
+        except OSError:
+            pass
+        os.close(stop_w)
+        self.retiring.add(pid)
+
+    def reload(self, worker_count):
+        """
+        start a new generation of workers, which load the current
+        configuration, then retire the old ones.
+
+        :return: the new worker count
+        """
+        try:
+            conf = appconfig('config:%s' % self.conf_file, name=self.app_section)
+            new_count = max(1, int(conf.get('workers', '1')))
+        except Exception, err:
+            self.logger.error('Reload failed, keeping the workers: %s' % err)
+            return worker_count
+        old = self.workers.keys()
+        for i in range(new_count):
+            self.spawn()
+        for pid in old:
+            self.retire(pid)
+        self.logger.notice('Reloaded: %d workers replaced by %d' % (len(old), new_count))
+        return new_count
+
+    def on_hup(self, *args):
+        self.logger.notice('SIGHUP received, reloading workers')
+        self.reloading = True
+
+    def on_term(self, *args):
+        self.logger.notice('SIGTERM received')
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.running = False
+        for pid in self.workers.keys() + list(self.retiring):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
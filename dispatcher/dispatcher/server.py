@@ -10,25 +10,47 @@ from webob.exc import HTTPException, HTTPAccepted, HTTPBadRequest, \
     HTTPMovedPermanently, HTTPNoContent, HTTPNotFound, \
     HTTPServiceUnavailable, HTTPUnauthorized, HTTPGatewayTimeout, \
     HTTPBadGateway,  HTTPRequestEntityTooLarge, HTTPServerError, HTTPPreconditionFailed
-from eventlet import GreenPile, Queue, sleep, TimeoutError
+from eventlet import GreenPile, Queue, spawn, TimeoutError
+from eventlet.queue import Empty
 from eventlet.timeout import Timeout
-from swift.common.utils import get_logger, ContextPool
+from swift.common.utils import get_logger, ContextPool, TRUE_VALUES
 from swift.common.exceptions import ConnectionTimeout, ChunkReadTimeout, ChunkWriteTimeout
 from swift.common.constraints import CONTAINER_LISTING_LIMIT, MAX_ACCOUNT_NAME_LENGTH, \
     MAX_CONTAINER_NAME_LENGTH, MAX_FILE_SIZE
-from swift.common.bufferedhttp import http_connect_raw, BufferedHTTPConnection, BufferedHTTPResponse
+from swift.common.bufferedhttp import http_connect_raw, BufferedHTTPConnection
 from swift.proxy.server import update_headers
+from eventlet.green.httplib import HTTPSConnection
 from dispatcher.common.location import Location
+from dispatcher.common.fanout import FanOut
+from dispatcher.common.connpool import ConnectionPool
+from dispatcher.common.health import BackendHealth
+from dispatcher.common.breaker import CircuitBreaker
+from dispatcher.common.hedge import HedgePolicy
+from dispatcher.common.metrics import Metrics, status_class
+from dispatcher.common.singleflight import SingleFlight
+from dispatcher.common.respcache import ResponseCache
+from dispatcher.common.segment import Segmenter
+from dispatcher.common.prefetch import PrefetchIter, plan_segments
+from dispatcher.common.admission import Admission, AdmittedIter, parse_pairs
+from dispatcher.common.accountcache import AccountCache
+from dispatcher.common.listing import cluster_query, merge_listings, parse_listing, \
+    serialize_listing
 import os
+import socket
 import sys
 import time
-from cStringIO import StringIO
+from random import random
 from uuid import uuid4
-from xml.dom.minidom import getDOMImplementation, parseString
+
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-connection')
+# concurrent GETs and HEADs share one relay only if these headers are the same.
+COALESCE_HEADERS = ('x-auth-token', 'x-storage-token', 'range', 'if-match', 'if-none-match',
+                    'if-modified-since', 'if-unmodified-since', 'accept', 'x-newest')
 
 class RelayRequest(object):
     """ """
-    def __init__(self, conf, req, url, proxy=None, conn_timeout=None, node_timeout=None, chunk_size=65536):
+    def __init__(self, conf, req, url, proxy=None, conn_timeout=None, node_timeout=None, chunk_size=65536,
+                 pool=None):
         self.req = req
         self.method = req.method
         self.url = url
@@ -38,7 +60,11 @@ class RelayRequest(object):
         self.conn_timeout = conn_timeout if conn_timeout else 0.5
         self.client_timeout = 60
         self.node_timeout = node_timeout if node_timeout else 60
-        self.retry_times_get_response_from_swift = 10
+        self.pool = pool
+        self.conn = None
+        self.started = None
+        self.connect_time = None
+        self.labels = ()
         self.logger = get_logger(conf, log_route='dispatcher.RelayRequest')
 
     def _proxy_request_check(self, path):
@@ -51,6 +77,10 @@ class RelayRequest(object):
         else:
             return False
 
+    def uses_proxy(self):
+        """ whether the request goes through the webcache """
+        return self._proxy_request_check(urlparse(self.url).path)
+
     def split_netloc(self, parsed_url):
         if parsed_url.netloc.find(':') > 0:
             host, port = parsed_url.netloc.split(':')
@@ -66,12 +96,64 @@ class RelayRequest(object):
                 return None, None
         return host, port
 
+    def _http_connect(self, host, port, method, path, headers, query_string, ssl=False):
+        """
+        http_connect_raw() on a keep-alive connection from the pool.
+        """
+        start = time.time()
+        conn = self._http_connect_pooled(host, port, method, path, headers, query_string, ssl)
+        self.connect_time = time.time() - start
+        return conn
+
+    def _http_connect_pooled(self, host, port, method, path, headers, query_string, ssl):
+        if not self.pool:
+            self.conn = http_connect_raw(host, port, method, path,
+                                         headers=headers, query_string=query_string,
+                                         ssl=ssl)
+            return self.conn
+        def new_connection():
+            if ssl:
+                return HTTPSConnection('%s:%s' % (host, port))
+            return BufferedHTTPConnection('%s:%s' % (host, port))
+        scheme = 'https' if ssl else 'http'
+        self.conn = conn = self.pool.get((scheme, host, port, self.proxy), new_connection)
+        if query_string:
+            path += '?' + query_string
+        conn.path = path
+        names = [h.lower() for h in headers.iterkeys()]
+        conn.putrequest(method, path, skip_host='host' in names,
+                        skip_accept_encoding='accept-encoding' in names)
+        for header, value in headers.iteritems():
+            if header.lower() not in HOP_BY_HOP_HEADERS:
+                conn.putheader(header, value)
+        conn.endheaders()
+        return conn
+
+    def release(self, resp=None, reuse=True):
+        """
+        give back the connection to the pool when resp has been read completely,
+        otherwise close it.
+        """
+        conn, self.conn = self.conn, None
+        if not conn or not self.pool:
+            return
+        if reuse and resp is not None and resp.isclosed() and not resp.will_close:
+            self.pool.put(conn)
+        else:
+            self.pool.discard(conn)
+
     def _connect_put_node(self, host, port, method, path, headers, query_string, ssl=False):
         try:
             with ConnectionTimeout(self.conn_timeout):
-                conn = http_connect_raw(host, port, method, path, 
-                                        headers=headers, query_string=query_string,
-                                        ssl=ssl)
+                conn = self._http_connect(host, port, method, path,
+                                          headers=headers, query_string=query_string,
+                                          ssl=ssl)
+                try:
+                    # the chunk framing and the chunk are written separately,
+                    # Nagle's algorithm must not hold back the second write.
+                    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                except (AttributeError, socket.error):
+                    pass
                 if headers.has_key('content-length') and int(headers['content-length']) == 0:
                     return conn
             with Timeout(self.node_timeout):
@@ -86,14 +168,20 @@ class RelayRequest(object):
             return None
 
     def _send_file(self, conn, path):
-        """Method for a file PUT coro"""
+        """
+        Method for a file PUT coro.
+        sends (framing, chunk) from conn.queue until None.
+        """
         while True:
-            chunk = conn.queue.get()
+            item = conn.queue.get()
+            if item is None:
+                return
             if not conn.failed:
                 try:
                     with ChunkWriteTimeout(self.node_timeout):
-                        conn.send(chunk)
-                        self.logger.debug('Sending...')
+                        for data in item:
+                            if data:
+                                conn.send(data)
                 except (Exception, ChunkWriteTimeout):
                     conn.failed = True
                     self.logger.debug('Trying to write to %s' % path)
@@ -103,6 +191,19 @@ class RelayRequest(object):
         """
         :return httplib.HTTP(S)Connection in success, and webob.exc.HTTPException in failure
         """
+        self.started = time.time()
+        try:
+            result = self._relay()
+        except BaseException:
+            # killed (GreenletExit, a deadline Timeout) while holding a pool slot
+            self.release(reuse=False)
+            raise
+        if result is None or isinstance(result, HTTPException):
+            self.release(reuse=False)
+        return result
+
+    def _relay(self):
+        """ """
         if self.headers.has_key('content-length'):
             if int(self.headers['content-length']) >= MAX_FILE_SIZE:
                 return HTTPRequestEntityTooLarge(request=self.req)
@@ -122,15 +223,18 @@ class RelayRequest(object):
         self.headers['host'] = '%s:%s' % (host, port)
 
         if self.method == 'PUT' and len(parsed.path.split('/')) >= 5:
-            if self.headers.has_key('content-length') and int(self.headers['content-length']) != 0:
+            chunked = self.req.headers.get('transfer-encoding')
+            if chunked or \
+                    self.headers.has_key('content-length') and int(self.headers['content-length']) != 0:
                 if not self.headers.has_key('expect'):
                     self.headers['expect'] = '100-continue'
-            chunked = self.req.headers.get('transfer-encoding')
-            if isinstance(self.req.environ['wsgi.input'], str):
+            # a file-like wsgi.input is read by chunk_size, it may not be an iterator
+            # (e.g. eventlet.wsgi.Input). the dispatcher passes iterators of chunks.
+            if hasattr(self.req.environ['wsgi.input'], 'read'):
                 reader = self.req.environ['wsgi.input'].read
                 data_source = iter(lambda: reader(self.chunk_size), '')
             else:
-                data_source = self.req.environ['wsgi.input']
+                data_source = iter(self.req.environ['wsgi.input'])
             bytes_transferred = 0
             try:
                 conn = self._connect_put_node(host, port, self.method, path, 
@@ -141,14 +245,12 @@ class RelayRequest(object):
                 with ContextPool(1) as pool:
                     conn.failed = False
                     conn.queue = Queue(10)
-                    pool.spawn(self._send_file, conn, path)
+                    sender = pool.spawn(self._send_file, conn, path)
                     while True:
                         with ChunkReadTimeout(self.client_timeout):
                             try:
                                 chunk = next(data_source)
                             except StopIteration:
-                                if chunked:
-                                    conn.queue.put('0\r\n\r\n')
                                 break
                             except TypeError, err:
                                 self.logger.info('Chunk Read Error: %s' % err)
@@ -156,33 +258,26 @@ class RelayRequest(object):
                             except Exception, err:
                                 self.logger.info('Chunk Read Error: %s' % err)
                                 return HTTPServerError(request=self.req)
+                        if not chunk:
+                            # an empty chunk would end a chunked body.
+                            continue
+                        # the chunk is sent as is, after a size line which also
+                        # terminates the previous chunk.
+                        framing = '%s%x\r\n' % ('\r\n' if bytes_transferred else '', len(chunk)) \
+                            if chunked else ''
                         bytes_transferred += len(chunk)
                         if bytes_transferred > MAX_FILE_SIZE:
                             return HTTPRequestEntityTooLarge(request=self.req)
-                        if not conn.failed:
-                            conn.queue.put('%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
-                    while True:
-                        if conn.queue.empty():
+                        conn.queue.put((framing, chunk))
+                        if conn.failed:
+                            # the backend may have sent an error response already.
                             break
-                        else:
-                            sleep(0.1)
-                    if conn.queue.unfinished_tasks:
-                        conn.queue.join()
-                # In heavy condition, getresponse() may fails, so it causes 'timed out' in eventlet.greenio.
-                # Checking a result of response and retrying prevent it. But is this reason of the error realCly?
-                resp = None
+                    if chunked and not conn.failed:
+                        conn.queue.put(('\r\n0\r\n\r\n' if bytes_transferred else '0\r\n\r\n', ''))
+                    conn.queue.put(None)
+                    sender.wait()
                 with Timeout(self.node_timeout):
-                    for i in range(self.retry_times_get_response_from_swift):
-                        self.logger.debug('Retry counter: %s' % i)
-                        try:
-                            resp = conn.getresponse()
-                        except Exception, err:
-                            self.logger.info('get response of PUT Error: %s' % err)
-                        if isinstance(resp, BufferedHTTPResponse):
-                            break
-                        else:
-                            sleep(0.1)
-                return resp
+                    return conn.getresponse()
             except ChunkReadTimeout, err:
                 self.logger.info("ChunkReadTimeout: %s" % err)
                 return HTTPRequestTimeout(request=self.req)
@@ -190,16 +285,67 @@ class RelayRequest(object):
                 self.logger.info("Error: %s" % err)
                 return HTTPGatewayTimeout(request=self.req)
         else:
-            try:
-                with ConnectionTimeout(self.conn_timeout):
-                    conn = http_connect_raw(host, port, self.method, path, 
-                                            headers=self.headers, query_string=parsed.query,
-                                            ssl=ssl)
-                with Timeout(self.node_timeout):
-                    return conn.getresponse()
-            except (Exception, TimeoutError), err:
-                self.logger.debug("get response of GET or misc Error: %s" % err)
-                return HTTPGatewayTimeout(request=self.req)
+            for attempt in range(2):
+                try:
+                    with ConnectionTimeout(self.conn_timeout):
+                        conn = self._http_connect(host, port, self.method, path,
+                                                  headers=self.headers, query_string=parsed.query,
+                                                  ssl=ssl)
+                    with Timeout(self.node_timeout):
+                        return conn.getresponse()
+                except (Exception, TimeoutError), err:
+                    reused = getattr(self.conn, 'pool_reused', False)
+                    self.release(reuse=False)
+                    if reused and not isinstance(err, Timeout) and attempt == 0:
+                        # the backend may close an idle keep-alive connection at any time.
+                        self.logger.debug("retry on a new connection: %s" % err)
+                        continue
+                    self.logger.debug("get response of GET or misc Error: %s" % err)
+                    return HTTPGatewayTimeout(request=self.req)
+
+class RelayResponseIter(object):
+    """
+    iterate a relayed response body, then give back its connection.
+
+    :param callback: called with the bytes transferred when the body ends
+                     or the iterator is closed.
+    """
+    def __init__(self, relay, result, chunk_size, timeout, callback=None):
+        self.relay = relay
+        self.result = result
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.bytes_transferred = 0
+        self.callback = callback
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            with ChunkReadTimeout(self.timeout):
+                chunk = self.result.read(self.chunk_size)
+        except (Exception, TimeoutError):
+            self.close()
+            raise
+        if not chunk:
+            self.relay.release(self.result)
+            self._done()
+            raise StopIteration
+        self.bytes_transferred += len(chunk)
+        return chunk
+
+    def close(self):
+        self.relay.release(self.result, reuse=False)
+        self._done()
+
+    def _done(self):
+        callback, self.callback = self.callback, None
+        if callback:
+            callback(self.bytes_transferred)
+
+    def __del__(self):
+        self.close()
 
 class Dispatcher(object):
     """ """
@@ -219,15 +365,92 @@ class Dispatcher(object):
         self.req_auth_str = 'auth'
         self.merged_combinator_str = '__@@__'
         self.swift_store_large_chunk_size = int(conf.get('swift_store_large_chunk_size', MAX_FILE_SIZE))
+        self.copy_segment_concurrency = int(conf.get('copy_segment_concurrency', 4))
+        # a segment must pass the MAX_FILE_SIZE check of RelayRequest.
+        self.segmenter = Segmenter(
+            seg_size=min(int(conf.get('auto_segment_size', 1073741824)), MAX_FILE_SIZE - 1),
+            concurrency=int(conf.get('auto_segment_concurrency', self.copy_segment_concurrency)),
+            queue_size=int(conf.get('auto_segment_queue_size', 16)),
+            chunk_size=self.client_chunk_size,
+            timeout=self.client_timeout) \
+            if conf.get('auto_segment', 'no').lower() in TRUE_VALUES else None
+        self.prefetch_segments = int(conf.get('prefetch_segment_count', 4)) \
+            if conf.get('prefetch_segments', 'no').lower() in TRUE_VALUES else 0
+        self.prefetch_queue_size = int(conf.get('prefetch_queue_size', 16))
+        conn_pool_max_per_host = int(conf.get('conn_pool_max_per_host', 32))
+        self.conn_pool = ConnectionPool(max_per_host=conn_pool_max_per_host,
+                                        idle_timeout=float(conf.get('conn_pool_idle_timeout', 30)),
+                                        acquire_timeout=float(conf.get('conn_pool_acquire_timeout', 10))) \
+                                        if conn_pool_max_per_host > 0 else None
+        self.metrics = Metrics(statsd_host=conf.get('statsd_host'),
+                               statsd_port=conf.get('statsd_port', 8125),
+                               statsd_prefix=conf.get('statsd_prefix', 'dispatcher'))
+        self.log_sample_rate = float(conf.get('log_sample_rate', 1))
+        self.fanout = FanOut(concurrency=int(conf.get('merge_concurrency', 0)),
+                             timeout=float(conf.get('merge_timeout', 0)),
+                             partial=conf.get('merge_partial_results', 'no').lower() in TRUE_VALUES,
+                             logger=self.logger, metrics=self.metrics)
         try:
-            self.loc = Location(self.relay_rule)
+            self.loc = Location(self.relay_rule,
+                                reload_interval=float(conf.get('relay_rule_reload_interval', 5)))
         except:
             raise ValueError, 'dispatcher relay rule is invalid.'
+        self.health = BackendHealth(alpha=float(conf.get('health_ewma_alpha', 0.3)),
+                                    error_penalty=float(conf.get('health_error_penalty',
+                                                                 self.node_timeout)),
+                                    probe_timeout=self.conn_timeout,
+                                    logger=self.logger) \
+                                    if conf.get('health_ranking', 'yes').lower() in TRUE_VALUES \
+                                    else None
+        health_check_interval = float(conf.get('health_check_interval', 10))
+        if self.health and health_check_interval > 0:
+            self.health.start_prober(self.loc.swift_servers, health_check_interval)
+        self.breaker = CircuitBreaker(error_threshold=int(conf.get('breaker_error_threshold', 5)),
+                                      cooldown=float(conf.get('breaker_cooldown', 30)),
+                                      logger=self.logger)
+        self.hedge = HedgePolicy(percentile=float(conf.get('hedge_percentile', 95)),
+                                 budget=float(conf.get('hedge_budget', 0.05)),
+                                 default_delay=float(conf.get('hedge_default_delay',
+                                                              self.conn_timeout))) \
+                                 if conf.get('hedge_requests', 'no').lower() in TRUE_VALUES \
+                                 else None
+        self.single_flight = SingleFlight(queue_size=int(conf.get('coalesce_queue_size', 16)),
+                                          timeout=self.client_timeout,
+                                          logger=self.logger, metrics=self.metrics) \
+                                          if conf.get('coalesce_requests', 'no').lower() in TRUE_VALUES \
+                                          else None
+        self.response_cache = ResponseCache(
+            max_bytes=int(conf.get('response_cache_max_bytes', 67108864)),
+            max_entry_size=int(conf.get('response_cache_max_entry_size', 65536)),
+            ttl=float(conf.get('response_cache_ttl', 10)),
+            metrics=self.metrics) \
+            if conf.get('response_cache', 'no').lower() in TRUE_VALUES else None
+        self.account_cache = AccountCache(
+            ttl=float(conf.get('account_cache_ttl', 10)),
+            stale_ttl=float(conf.get('account_cache_stale_ttl', 60)),
+            max_entries=int(conf.get('account_cache_max_entries', 10000)),
+            logger=self.logger, metrics=self.metrics) \
+            if conf.get('account_cache', 'no').lower() in TRUE_VALUES else None
+        self.admission = Admission(
+            location_limit=int(conf.get('admission_location_limit', 256)),
+            location_limits=parse_pairs(conf.get('admission_location_limits'), int),
+            account_limit=int(conf.get('admission_account_limit', 64)),
+            queue_size=int(conf.get('admission_queue_size', 512)),
+            timeout=float(conf.get('admission_queue_timeout', 10)),
+            weights=parse_pairs(conf.get('admission_weights')),
+            bulk_size=int(conf.get('admission_bulk_size', 1048576)),
+            metrics=self.metrics) \
+            if conf.get('admission_control', 'no').lower() in TRUE_VALUES else None
+        self.admission_retry_after = int(conf.get('admission_retry_after', 1))
+        self.status_path = conf.get('status_path', '').rstrip('/')
 
     def __call__(self, env, start_response):
         """ """
         req = Request(env)
-        self.loc.reload()
+        if self.status_path and req.path == self.status_path:
+            resp = self.status_resp(req)
+            start_response(resp.status, resp.headerlist)
+            return resp.body
         if self.loc.age == 0:
             self.logger.warn('dispatcher relay rule is invalid, using old rules now.')
         loc_prefix = self.location_check(req)
@@ -235,6 +458,31 @@ class Dispatcher(object):
             resp = HTTPNotFound(request=req)
             start_response(resp.status, resp.headerlist)
             return resp.body
+        if not self.admission:
+            return self.dispatch(req, loc_prefix, start_response)
+        path_str_ls = self._get_real_path(req)
+        account = path_str_ls[1] if len(path_str_ls) > 1 else \
+            req.headers.get('x-auth-token') or req.headers.get('x-storage-token') or ''
+        ticket = self.admission.admit(loc_prefix or '', account,
+                                      self.admission.classify(req, path_str_ls))
+        if not ticket:
+            resp = HTTPServiceUnavailable(request=req)
+            resp.headers['retry-after'] = str(self.admission_retry_after)
+            start_response(resp.status, resp.headerlist)
+            return resp.body
+        try:
+            body = self.dispatch(req, loc_prefix, start_response)
+        except:
+            ticket.release()
+            raise
+        if isinstance(body, str):
+            ticket.release()
+            return body
+        return AdmittedIter(body, ticket)
+
+    def dispatch(self, req, loc_prefix, start_response):
+        """ relay req in the mode of the location, :return: the response body """
+        self.metrics.incr('requests', (('location', loc_prefix or ''), ('method', req.method)))
         if self.loc.is_merged(loc_prefix):
             self.logger.debug('enter merge mode')
             if req.method == 'COPY':
@@ -249,6 +497,8 @@ class Dispatcher(object):
             self.logger.debug('enter normal mode')
             resp = self.dispatch_in_normal(req, loc_prefix)
         resp.headers['x-colony-dispatcher'] = 'dispatcher processed'
+        self.metrics.incr('responses', (('location', loc_prefix or ''),
+                                        ('status', status_class(resp.status_int))))
         start_response(resp.status, resp.headerlist)
         if req.method in ('PUT', 'POST'):
             return resp.body
@@ -256,6 +506,26 @@ class Dispatcher(object):
             if resp.app_iter is not None \
             else resp.body
 
+    def status_resp(self, req):
+        """ metrics, backend health and the current ranking of each cluster, as json """
+        if req.method not in ('GET', 'HEAD'):
+            return HTTPMethodNotAllowed(request=req)
+        status = {'metrics': self.metrics.snapshot(),
+                  'conn_pool': self.conn_pool.stats() if self.conn_pool else {},
+                  'health': {}, 'ranking': {}, 'breaker': self.breaker.snapshot(),
+                  'hedge': self.hedge.snapshot() if self.hedge else {},
+                  'single_flight': self.single_flight.snapshot() if self.single_flight else {},
+                  'response_cache': self.response_cache.snapshot() if self.response_cache else {},
+                  'account_cache': self.account_cache.snapshot() if self.account_cache else {},
+                  'admission': self.admission.snapshot() if self.admission else {}}
+        if self.health:
+            status['health'] = self.health.snapshot()
+            for location in self.loc.locations.iterkeys():
+                status['ranking'][location] = [self.health.rank(cluster)
+                                               for cluster in self.loc.swift_of(location)]
+        return Response(request=req, body=json.dumps(status),
+                        content_type='application/json')
+
     def dispatch_in_normal(self, req, location):
         """ request dispatcher in normal mode """
         resp = self.relay_req(req, req.url, 
@@ -276,10 +546,14 @@ class Dispatcher(object):
         if not self._auth_check(req):
             self.logger.debug('get_merged_auth')
             return self.get_merged_auth_resp(req, location)
+        each_tokens = self._get_each_tokens(req)
+        if each_tokens and (len(each_tokens) != len(self.loc.swift_of(location)) or
+                            '' in each_tokens):
+            # a cluster would get the whole merged token and refuse it.
+            return HTTPUnauthorized(request=req,
+                                    body='The merged token has no token of some cluster, '
+                                    'authenticate again')
 
-        parsed = urlparse(req.url)
-        query = parse_qs(parsed.query)
-        marker = query['marker'][0] if query.has_key('marker') else None
         account, cont_prefix, container, obj = self._get_merged_path(req)
 
         if account and cont_prefix and container and obj \
@@ -303,9 +577,6 @@ class Dispatcher(object):
             return self.get_merged_container_and_object_resp(req, location, cont_prefix, container)
         if account and container:
             return HTTPNotFound(request=req)
-        if account and marker:
-            self.logger.debug('get_merged_containers_with_marker')
-            return self.get_merged_containers_with_marker_resp(req, location, marker)
         if account:
             self.logger.debug('get_merged_containers')
             return self.get_merged_containers_resp(req, location)
@@ -314,12 +585,15 @@ class Dispatcher(object):
 
     def get_merged_auth_resp(self, req, location):
         """ """
-        resps = []
-        for swift in self.loc.swift_of(location):
-            resps.append(self.relay_req(req, req.url, 
-                                        self._get_real_path(req),
-                                        swift,
-                                        self.loc.webcache_of(location)))
+        resps = self.fanout.run(self._relay_req_copy,
+                                [(req, req.url,
+                                  self._get_real_path(req),
+                                  swift,
+                                  self.loc.webcache_of(location))
+                                 for swift in self.loc.swift_of(location)])
+        # every cluster is needed to make a merged token.
+        if None in resps:
+            return HTTPGatewayTimeout(request=req)
         error_resp = self.check_error_resp(resps)
         if error_resp:
             return error_resp
@@ -333,74 +607,95 @@ class Dispatcher(object):
         return resp
 
     def get_merged_containers_resp(self, req, location):
-        """ """
+        """ a merged account HEAD from the account cache, or merged_containers_resp() """
+        each_tokens = self._get_each_tokens(req)
+        if not self.account_cache or req.method != 'HEAD' or not each_tokens:
+            return self.merged_containers_resp(req, location)
+        env = req.environ.copy()
+        return self.account_cache.get((location, self._get_real_path(req)[1], tuple(each_tokens)),
+                                      lambda: self.merged_containers_resp(Request(env.copy()),
+                                                                          location))
+
+    def merged_containers_resp(self, req, location):
+        """
+        merge the container listings of every cluster in a location.
+        limit, marker, end_marker and prefix are applied to the merged namespace,
+        so that a listing continues from a container prefix to the next one.
+        """
         each_tokens = self._get_each_tokens(req)
         if not each_tokens:
             return HTTPUnauthorized(request=req)
-        cont_prefix_ls = []
         real_path = '/' + '/'.join(self._get_real_path(req))
         each_swift_cluster = self.loc.swift_of(location)
         query = parse_qs(urlparse(req.url).query)
-        each_urls = [self._combinate_url(req, s[0],  real_path, query) for s in each_swift_cluster]
+        marker = query.pop('marker', [None])[0]
+        end_marker = query.pop('end_marker', [None])[0]
+        list_prefix = query.pop('prefix', [None])[0]
+        try:
+            limit = int(query.pop('limit', [CONTAINER_LISTING_LIMIT])[0])
+            if limit < 0:
+                raise ValueError
+        except ValueError:
+            return HTTPPreconditionFailed(request=req,
+                                          body='Value of limit must be a positive integer')
+        limit = min(limit, CONTAINER_LISTING_LIMIT)
+        relay_args = []
+        each_urls = []
+        each_listed = []
+        for each_token, each_swift_svrs in zip(each_tokens, each_swift_cluster):
+            cont_prefix = self.loc.container_prefix_of(location, each_swift_svrs[0])
+            each_query = cluster_query(cont_prefix, self.combinater_char,
+                                       marker, end_marker, list_prefix)
+            method = req.method
+            if each_query is None:
+                # no container of this cluster is in the range,
+                # but the account stats of this cluster are still merged.
+                method = 'HEAD'
+                each_query = {}
+            each_query.update(query)
+            each_query['limit'] = limit
+            each_url = self._combinate_url(req, each_swift_svrs[0], real_path, each_query)
+            relay_args.append((req, each_url,
+                               self._get_real_path(req),
+                               each_swift_svrs,
+                               self.loc.webcache_of(location),
+                               each_token, method))
+            each_urls.append(each_url)
+            each_listed.append(method == 'GET')
+        each_resps = self.fanout.run(self._relay_req_copy, relay_args)
         resps = []
-        for each_url, each_token, each_swift_svrs in zip(each_urls, each_tokens, each_swift_cluster):
-            req.headers['x-auth-token'] = each_token
-            resp = self.relay_req(req, each_url,
-                                  self._get_real_path(req),
-                                  each_swift_svrs, 
-                                  self.loc.webcache_of(location))
-            resps.append((each_url, resp))
-        error_resp = self.check_error_resp([r for u, r in resps])
+        for each_url, resp, listed in zip(each_urls, each_resps, each_listed):
+            if resp is None or resp.status_int == HTTPGatewayTimeout.code:
+                if not self.fanout.partial:
+                    return resp or HTTPGatewayTimeout(request=req)
+                self.logger.warn('drop timed out cluster %s from merged listing' % each_url)
+                continue
+            resps.append((each_url, resp, listed))
+        if not resps:
+            return HTTPGatewayTimeout(request=req)
+        error_resp = self.check_error_resp([r for u, r, l in resps])
         if error_resp:
             return error_resp
-        ok_resps = []
-        ok_cont_prefix = []
-        for url, resp in resps:
-            if resp.status_int >= 200 and resp.status_int <= 299:
-                ok_resps.append(resp)
-                ok_cont_prefix.append(self.loc.container_prefix_of(location, url))
-        m_body = ''
-        m_headers = self._merge_headers(ok_resps, location)
-        if req.method == 'GET':
-            if self._has_header('content-type', ok_resps):
-                content_type = [v for k,v in m_headers if k == 'content-type'][0]
-                m_body = self._merge_container_lists(content_type, 
-                                                    [r.body for r in ok_resps], 
-                                                    ok_cont_prefix)
-        resp = Response(status='200 OK')
-        resp.headerlist = m_headers
-        resp.body = m_body
-        return resp
-
-    def get_merged_containers_with_marker_resp(self, req, location, marker):
-        """ """
-        if marker.find(self.combinater_char) == -1:
-            return HTTPNotFound(request=req)
-        marker_prefix = self._get_container_prefix(marker)
-        if not self.loc.servers_by_container_prefix_of(location, marker_prefix):
-            return HTTPNotFound(request=req)
-        real_marker = marker.split(marker_prefix + ':')[1]
-        swift_svrs = self.loc.servers_by_container_prefix_of(location, marker_prefix)
-        swift_server_subscript = self._get_servers_subscript_by_prefix(location, marker_prefix)
-        each_tokens = self._get_each_tokens(req)
-        query = parse_qs(urlparse(req.url).query)
-        query['marker'] = real_marker
-        real_path = '/' + '/'.join(self._get_real_path(req))
-        url = self._combinate_url(req, swift_svrs[0], real_path, query)
-        req.headers['x-auth-token'] = each_tokens[swift_server_subscript]
-        resp = self.relay_req(req, url,
-                              self._get_real_path(req),
-                              swift_svrs,
-                              self.loc.webcache_of(location))
-        m_headers = self._merge_headers([resp], location)
-        m_body = ''
-        if req.method == 'GET':
-            if self._has_header('content-type', [resp]):
-                content_type = [v for k,v in m_headers if k == 'content-type'][0]
-                m_body = self._merge_container_lists(content_type, [resp.body], [marker_prefix])
+        ok_resps = [r for u, r, l in resps]
+        listed_resps = [(self.loc.container_prefix_of(location, u), r)
+                        for u, r, l in resps if l]
+        m_headers = [(h, v) for h, v in self._merge_headers(ok_resps, location)
+                     if h.lower() != 'content-length']
         resp = Response(status='200 OK')
-        resp.headerlist = m_headers
-        resp.body = m_body
+        if req.method == 'GET' and listed_resps:
+            content_type = listed_resps[0][1].headers.get('content-type', 'text/plain')
+            m_headers = [(h, v) for h, v in m_headers if h.lower() != 'content-type']
+            m_headers.append(('content-type', content_type))
+            info = {}
+            streams = [(cont_prefix, parse_listing(content_type, r.app_iter, info))
+                       for cont_prefix, r in listed_resps]
+            resp.headerlist = m_headers
+            resp.app_iter = serialize_listing(content_type,
+                                              merge_listings(streams, self.combinater_char, limit),
+                                              info)
+        else:
+            resp.headerlist = m_headers
+            resp.body = ''
         return resp
 
     def get_merged_container_and_object_resp(self, req, location, cont_prefix, container):
@@ -447,7 +742,8 @@ class Dispatcher(object):
     def copy_across_accounts_resp(self, req, location, cp_cont_prefix, cp_cont, cp_obj,
                                   cont_prefix, container, obj):
         """
-        TODO: use resp.app_iter rather than resp.body.
+        copy an object across accounts by streaming the body of the source GET
+        into the destination PUT, so that the memory per copy stays constant.
         """
         # GET object from account A
         each_tokens = self._get_each_tokens(req)
@@ -484,43 +780,56 @@ class Dispatcher(object):
         """
         if large object, split object and upload them.
         (swift 1.4.3 api: Direct API Management of Large Objects)
+        each segment is copied by a ranged GET streamed into a PUT,
+        by copy_segment_concurrency workers at once.
         """
-        max_segment = obj_size / self.swift_store_large_chunk_size + 1
+        if hasattr(from_resp.app_iter, 'close'):
+            from_resp.app_iter.close()
         cur = str(time.time())
-        body = StringIO(from_resp.body)
         seg_cont = '%s_segments' % container
-        cont_resp = self._create_container(to_req, location, 
+        cont_resp = self._create_container(Request(req.environ.copy()), location,
                                            cont_prefix, each_tokens, 
                                            from_real_path_ls[1], seg_cont)
         if cont_resp.status_int != 201 and cont_resp.status_int != 202:
             return cont_resp
-        chunk_top = 0
-        chunk_bottm = 0
-        for seg in range(max_segment):
+        seg_size = self.swift_store_large_chunk_size
+
+        def copy_segment(seg):
             """ 
             <name>/<timestamp>/<size>/<segment> 
             server_modified-20111115.py/1321338039.34/79368/00000075
             """
+            first_byte = seg * seg_size
+            last_byte = min(first_byte + seg_size, obj_size) - 1
+            seg_from_req = Request(from_req.environ.copy())
+            seg_from_req.headers['range'] = 'bytes=%d-%d' % (first_byte, last_byte)
+            seg_from_resp = self.relay_req(seg_from_req, from_url,
+                                           from_real_path_ls,
+                                           from_swift_svrs,
+                                           self.loc.webcache_of(location))
+            if seg_from_resp.status_int != 206:
+                if hasattr(seg_from_resp.app_iter, 'close'):
+                    seg_from_resp.app_iter.close()
+                return self.check_error_resp([seg_from_resp]) or \
+                    HTTPServiceUnavailable(request=req)
+            # obj is quoted already, as in the manifest below.
             split_obj = '%s/%s/%s/%08d' % (obj, cur, obj_size, seg)
-            split_obj_name = quote(split_obj)
-            chunk = body.read(self.swift_store_large_chunk_size)
-            if obj_size >= chunk_top:
-                chunk_bottom += self.swift_store_large_chunk_size
-            # else:
-            #     break
-            to_resp = self._create_put_req(to_req, location, 
-                                           cont_prefix, each_tokens, 
-                                           from_real_path_ls[1], seg_cont, 
-                                           split_obj_name, None,
-                                           # from_resp.app_iter[chunk_top:chunk_bottom],
-                                           chunk,
-                                           len(chunk))
-            if to_resp.status_int != 201:
-                body.close() 
-                return self.check_error_resp([to_resp])
-            chunk_top += self.swift_store_large_chunk_size
+            return self._create_put_req(Request(to_req.environ.copy()), location,
+                                        cont_prefix, each_tokens, 
+                                        from_real_path_ls[1], seg_cont, 
+                                        split_obj, None,
+                                        seg_from_resp,
+                                        last_byte - first_byte + 1)
+
+        with ContextPool(self.copy_segment_concurrency) as pool:
+            pile = GreenPile(pool)
+            for seg in range((obj_size + seg_size - 1) / seg_size):
+                pile.spawn(copy_segment, seg)
+            for to_resp in pile:
+                if to_resp.status_int != 201:
+                    # leaving the pool kills the other segment copies.
+                    return self.check_error_resp([to_resp])
         # upload object manifest
-        body.close() 
         to_req.headers['x-object-manifest'] = '%s/%s/%s/%s/' % (seg_cont, obj, cur, obj_size)
         return self._create_put_req(to_req, location, 
                                     cont_prefix, each_tokens, 
@@ -528,6 +837,140 @@ class Dispatcher(object):
                                     '',
                                     0)
 
+    def segmented_put_resp(self, req, req_url, path_str_ls, relay_servers, webcaches):
+        """
+        upload a PUT too large for swift as segments of <container>_segments
+        and a manifest, with the naming of copy_across_accounts_resp().
+        """
+        ver, account, container = path_str_ls[:3]
+        obj = '/'.join(path_str_ls[3:])
+        seg_cont = '%s_segments' % container
+        total = req.content_length
+        cur = str(time.time())
+
+        def sub_req(method):
+            return self._sub_req(req, method, ('etag', 'transfer-encoding', 'x-object-manifest'))
+
+        def relay(sub, path_ls):
+            return self._relay_sub_req(sub, req_url, path_ls, relay_servers, webcaches)
+
+        cont_req = sub_req('PUT')
+        cont_req.body = ''
+        cont_resp = relay(cont_req, [ver, account, seg_cont])
+        if cont_resp.status_int != 201 and cont_resp.status_int != 202:
+            return cont_resp
+
+        def seg_path(seg):
+            return [ver, account, seg_cont] + path_str_ls[3:] + [cur, str(total), '%08d' % seg]
+
+        started = []
+
+        def upload(seg, size, seg_input):
+            started.append(seg)
+            seg_req = sub_req('PUT')
+            seg_req.environ['wsgi.input'] = seg_input
+            seg_req.headers['content-length'] = str(size)
+            return relay(seg_req, seg_path(seg))
+
+        def delete(seg):
+            seg_req = sub_req('DELETE')
+            seg_req.body = ''
+            resp = relay(seg_req, seg_path(seg))
+            if hasattr(resp.app_iter, 'close'):
+                resp.app_iter.close()
+            return resp.status_int
+
+        self.logger.info('Segmenting %s (%d bytes) into %d segments of %s' %
+                         (req.path, total, self.segmenter.count(total), seg_cont))
+        resps = self.segmenter.run(req.environ['wsgi.input'].read, total, upload, request=req)
+        if resps[-1].status_int != 201:
+            # the segments written so far are of no use without the manifest.
+            with ContextPool(self.copy_segment_concurrency) as pool:
+                statuses = list(pool.imap(delete, started))
+            orphans = ['/'.join(seg_path(seg)) for seg, status in zip(started, statuses)
+                       if status // 100 != 2 and status != 404]
+            self.logger.warn('Segmented upload of %s failed (%s), deleted its %d segments%s' %
+                             (req.path, resps[-1].status, len(started) - len(orphans),
+                              ', left %s' % ' '.join(orphans) if orphans else ''))
+            return resps[-1]
+        self.metrics.incr('segmented_uploads')
+        manifest_req = sub_req('PUT')
+        manifest_req.body = ''
+        # quoted like the segment paths, as swift unquotes the manifest.
+        manifest_req.headers['x-object-manifest'] = '%s/%s/%s/%s/' % (seg_cont, obj, cur, total)
+        return self.relay_req(manifest_req, req_url, path_str_ls, relay_servers, webcaches)
+
+    def prefetched_manifest_resp(self, req, req_url, path_str_ls, relay_servers, webcaches, resp):
+        """
+        the body of a manifest object (DLO) read from its segments, the next
+        prefetch_segments of them fetched at once ahead of the client.
+        a byte range of the request is mapped onto the segments.
+
+        :param resp: the response of the GET of the manifest object, given
+                     back as it is if the segments are not listed or the
+                     request has several ranges.
+        """
+        ver, account = path_str_ls[:2]
+        seg_cont, prefix = [unquote(p) for p in
+                            resp.headers['x-object-manifest'].split('/', 1)]
+        drop = ('range', 'if-range', 'if-match', 'if-none-match',
+                'if-modified-since', 'if-unmodified-since')
+
+        def relay(sub, path_ls, query=''):
+            return self._relay_sub_req(sub, req_url, path_ls, relay_servers, webcaches, query)
+
+        segments = []
+        marker = ''
+        while True:
+            list_req = self._sub_req(req, 'GET', drop)
+            list_resp = relay(list_req, [ver, account, quote(seg_cont)],
+                              'format=json&prefix=%s&marker=%s' % (quote(prefix), quote(marker)))
+            if list_resp.status_int == 204:
+                break
+            if list_resp.status_int != 200:
+                self.logger.info('Listing segments of %s failed: %s' %
+                                 (req.path, list_resp.status))
+                return resp
+            listing = json.loads(list_resp.body)
+            segments.extend([(seg['name'], int(seg['bytes'])) for seg in listing])
+            if len(listing) < CONTAINER_LISTING_LIMIT:
+                break
+            marker = listing[-1]['name'].encode('utf-8')
+        total = sum([size for name, size in segments])
+        start, stop = 0, total
+        if req.range:
+            byte_range = req.range.range_for_length(total)
+            if not byte_range:
+                return resp
+            start, stop = byte_range
+
+        def fetch(name, first, last, size):
+            seg_req = self._sub_req(req, 'GET', drop)
+            if first > 0 or last < size - 1:
+                seg_req.headers['range'] = 'bytes=%d-%d' % (first, last)
+            seg_resp = relay(seg_req, [ver, account, quote(seg_cont)] +
+                             quote(name.encode('utf-8')).split('/'))
+            if seg_resp.status_int not in (200, 206):
+                if hasattr(seg_resp.app_iter, 'close'):
+                    seg_resp.app_iter.close()
+                raise IOError('segment %s: %s' % (name, seg_resp.status))
+            return seg_resp.app_iter
+
+        if hasattr(resp.app_iter, 'close'):
+            resp.app_iter.close()
+        self.metrics.incr('prefetched_manifests')
+        headers = [(h, v) for h, v in resp.headerlist
+                   if h.lower() not in ('content-length', 'content-range')]
+        prefetched = Response(status=206 if req.range else 200, headerlist=headers)
+        prefetched.app_iter = PrefetchIter(plan_segments(segments, start, stop), fetch,
+                                           count=self.prefetch_segments,
+                                           queue_size=self.prefetch_queue_size)
+        # after app_iter, which resets content_length.
+        prefetched.content_length = stop - start
+        if req.range:
+            prefetched.headers['content-range'] = 'bytes %d-%d/%d' % (start, stop - 1, total)
+        return prefetched
+
     def copy_to_put(self, req):
         """HTTP COPY request handler."""
         try:
@@ -708,18 +1151,7 @@ class Dispatcher(object):
         return auth_token.split(self.merged_combinator_str)
 
     def _get_servers_subscript_by_prefix(self, location, prefix):
-        swift_svrs = self.loc.servers_by_container_prefix_of(location, prefix)
-        i = 0
-        found = None
-        for svrs in self.loc.swift_of(location):
-            for svr in svrs:
-                if svr in swift_svrs:
-                    found = True
-                    break
-            if found:
-                break
-            i += 1
-        return i
+        return self.loc.cluster_index_of(location, prefix)
 
     def _combinate_url(self, req, swift_svr, real_path, query):
         parsed = urlparse(req.url)
@@ -776,6 +1208,22 @@ class Dispatcher(object):
                                  self.loc.webcache_of(location))
         return to_resp
 
+    def _sub_req(self, req, method, drop_headers=()):
+        """ a copy of req for a sub-request of method, without drop_headers """
+        sub = Request(req.environ.copy())
+        sub.method = method
+        for header in drop_headers:
+            if sub.headers.has_key(header):
+                del sub.headers[header]
+        return sub
+
+    def _relay_sub_req(self, sub, req_url, path_str_ls, relay_servers, webcaches, query=''):
+        """ relay_req() of sub to path_str_ls on the servers of req_url """
+        parsed = urlparse(req_url)
+        url = urlunparse((parsed.scheme, parsed.netloc, '/' + '/'.join(path_str_ls),
+                          '', query, ''))
+        return self.relay_req(sub, url, path_str_ls, relay_servers, webcaches)
+
     def _rewrite_object_manifest_header(self, headers, container_prefix):
         rewrited = []
         for h, v in headers:
@@ -826,44 +1274,86 @@ class Dispatcher(object):
         return json.dumps(storage_rewrite)
 
     def _merge_container_lists(self, content_type, bodies, prefixes):
-        """ """
-        if content_type.startswith('text/plain'):
-            merge_body = []
-            for prefix, body in zip(prefixes, bodies):
-                for b in body.split('\n'):
-                    if b != '':
-                        merge_body.append(str(prefix) + self.combinater_char + b)
-            merge_body.sort(cmp)
-            return '\n'.join(merge_body)
-        elif content_type.startswith('application/json'):
-            merge_body = []
-            for prefix, body in zip(prefixes, bodies):
-                tmp_body = json.loads(body)
-                for e in tmp_body:
-                    e['name'] = prefix + self.combinater_char + e['name']
-                    merge_body.append(e)
-            return json.dumps(merge_body)
-        elif content_type.startswith('application/xml'):
-            impl = getDOMImplementation()
-            merge_body = impl.createDocument(None, None, None)
-            acct = merge_body.createElement("account")
-            merge_body.appendChild(acct)
-            for prefix, body in zip(prefixes, bodies):
-                dom = parseString(body)
-                p_emt = dom.getElementsByTagName('account')[0]
-                acct_name = p_emt.getAttribute('name')
-                acct.setAttribute('name', acct_name)
-                for emt in p_emt.getElementsByTagName('container'):
-                    orig_name = emt.getElementsByTagName('name').item(0).childNodes[0].data
-                    new_name = '%s:%s' % (prefix, orig_name)
-                    emt.getElementsByTagName('name').item(0).childNodes[0].data = new_name
-                    acct.appendChild(emt)
-            return merge_body.toxml('UTF-8')
-        else:
-            pass
+        """ merge whole listing bodies of each cluster into a sorted listing body. """
+        info = {}
+        streams = [(prefix, parse_listing(content_type, [body], info))
+                   for prefix, body in zip(prefixes, bodies)]
+        return ''.join(serialize_listing(content_type,
+                                         merge_listings(streams, self.combinater_char),
+                                         info))
+
+    def _relay_req_copy(self, req, req_url, path_str_ls, relay_servers, webcaches,
+                        auth_token=None, method=None):
+        """
+        relay_req() with a copy of req, so that concurrent relays in a fan-out
+        don't share the mutable request headers.
+        """
+        each_req = Request(req.environ.copy())
+        if auth_token:
+            each_req.headers['x-auth-token'] = auth_token
+        if method:
+            each_req.method = method
+        return self.relay_req(each_req, req_url, path_str_ls, relay_servers, webcaches)
 
     # relay request
     def relay_req(self, req, req_url, path_str_ls, relay_servers, webcaches):
+        """
+        relay req. an oversized PUT is uploaded as segments, and the body of
+        a manifest object is read from its segments, if enabled.
+        """
+        # a chunked body of unknown length (content_length None) is relayed as it is.
+        if self.segmenter and req.method == 'PUT' and len(path_str_ls) > 3 and \
+                req.content_length >= MAX_FILE_SIZE and \
+                not req.headers.has_key('x-copy-from') and \
+                not req.headers.has_key('x-object-manifest'):
+            return self.segmented_put_resp(req, req_url, path_str_ls, relay_servers, webcaches)
+        resp = self._cached_relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+        if self.account_cache and req.method in ('PUT', 'POST', 'DELETE') and \
+                len(path_str_ls) > 1:
+            self.account_cache.invalidate(path_str_ls[1])
+        if self.prefetch_segments and req.method == 'GET' and len(path_str_ls) > 3 and \
+                resp.status_int in (200, 206) and resp.headers.has_key('x-object-manifest'):
+            return self.prefetched_manifest_resp(req, req_url, path_str_ls,
+                                                 relay_servers, webcaches, resp)
+        return resp
+
+    def _cached_relay_req(self, req, req_url, path_str_ls, relay_servers, webcaches):
+        """ relay req, or answer it from the response cache. """
+        cache = self.response_cache
+        if not cache:
+            return self._shared_relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+        cluster = tuple(relay_servers)
+        if req.method in ('PUT', 'POST', 'DELETE'):
+            resp = self._shared_relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+            cache.invalidate(cluster, path_str_ls)
+            return resp
+        key = cache.key(req, cluster, path_str_ls, urlparse(req_url).query)
+        if not key:
+            return self._shared_relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+        entry = cache.get(key)
+        if entry and entry.fresh():
+            return cache.hit(entry)
+        if entry and entry.etag:
+            revalidate_req = Request(req.environ.copy())
+            revalidate_req.headers['if-none-match'] = entry.etag
+            resp = self._shared_relay_req(revalidate_req, req_url, path_str_ls,
+                                          relay_servers, webcaches)
+            if resp.status_int == 304:
+                return cache.revalidated(key, entry)
+        else:
+            resp = self._shared_relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+        return cache.store(key, resp)
+
+    def _shared_relay_req(self, req, req_url, path_str_ls, relay_servers, webcaches):
+        """ relay req, or share the relay of a concurrent identical GET or HEAD. """
+        if self.single_flight and req.method in ('GET', 'HEAD'):
+            key = (req.method, req_url, tuple(path_str_ls), tuple(relay_servers)) + \
+                tuple([req.headers.get(h) for h in COALESCE_HEADERS])
+            return self.single_flight.do(key, lambda: self._relay_req(req, req_url, path_str_ls,
+                                                                      relay_servers, webcaches))
+        return self._relay_req(req, req_url, path_str_ls, relay_servers, webcaches)
+
+    def _relay_req(self, req, req_url, path_str_ls, relay_servers, webcaches):
         """ """
         # util
         def get_relay_netloc(relay_server):
@@ -876,8 +1366,20 @@ class Dispatcher(object):
                 relay_addr, relay_port = svr
             return relay_addr, relay_port
 
+        def get_connect_url(relay_server):
+            relay_addr, relay_port = get_relay_netloc(relay_server)
+            return urlunparse((parsed_req_url.scheme, 
+                               relay_addr + ':' + relay_port, 
+                               connect_path,
+                               parsed_req_url.params, 
+                               parsed_req_url.query, 
+                               parsed_req_url.fragment))
+
         relay_id = str(uuid4())
 
+        if self.health:
+            relay_servers = self.health.rank(relay_servers)
+        relay_servers = self.breaker.filter(relay_servers)
         parsed_req_url = urlparse(req_url)
         relay_servers_count = len(relay_servers)
 
@@ -885,18 +1387,22 @@ class Dispatcher(object):
         if parsed_req_url.path.endswith('/'):
             connect_path = connect_path + '/'
 
+        location = self.location_check(req) or ''
+        if self.hedge and req.method in ('GET', 'HEAD') and relay_servers_count > 1:
+            self.hedge.request(location)
+            connect_url, relay, result = \
+                self._hedged_relay(req, relay_id, location,
+                                   [(relay_server, get_connect_url(relay_server),
+                                     self._webcache_of(location, relay_server, webcaches,
+                                                       path_str_ls))
+                                    for relay_server in relay_servers])
+            if isinstance(result, HTTPException):
+                return result
+            return self._relay_response(req, relay_id, req.url, connect_url, relay, result)
+
         for relay_server in relay_servers:
-            relay_addr, relay_port = get_relay_netloc(relay_server)
-            connect_url = urlunparse((parsed_req_url.scheme, 
-                                      relay_addr + ':' + relay_port, 
-                                      connect_path,
-                                      parsed_req_url.params, 
-                                      parsed_req_url.query, 
-                                      parsed_req_url.fragment))
-            if webcaches[relay_server]:
-                proxy = webcaches[relay_server]
-            else:
-                proxy = None
+            connect_url = get_connect_url(relay_server)
+            proxy = self._webcache_of(location, relay_server, webcaches, path_str_ls)
 
             if req.headers.has_key('x-object-manifest'):
                 object_manifest = req.headers['x-object-manifest']
@@ -910,83 +1416,205 @@ class Dispatcher(object):
 
             original_url = req.url
 
-            self.logger.info('Request[%s]: %s %s with headers = %s, Connect to %s (via %s)' % 
-                             (str(relay_id),
-                              req.method, req.url, req.headers, 
-                              connect_url, proxy))
+            self._sampled_log('Request[%s]: %s %s with headers = %s, Connect to %s (via %s)',
+                              relay_id, req.method, req.url, req.headers, connect_url, proxy)
 
-            result = RelayRequest(self.conf, req, connect_url, proxy=proxy, 
-                                  conn_timeout=self.conn_timeout, 
-                                  node_timeout=self.node_timeout,
-                                  chunk_size=self.client_chunk_size)()
+            relay = RelayRequest(self.conf, req, connect_url, proxy=proxy,
+                                 conn_timeout=self.conn_timeout,
+                                 node_timeout=self.node_timeout,
+                                 chunk_size=self.client_chunk_size,
+                                 pool=self.conn_pool)
+            result = self._relay_to(location, relay_server, relay)
 
             if isinstance(result, HTTPException):
                 if relay_servers_count > 1:
                     relay_servers_count -= 1
-                    self.logger.info('Retry Req[%s]: %s %s with headers = %s, Connect to %s (via %s)' % 
-                                     (str(relay_id),
-                                      req.method, req.url, req.headers, 
-                                      connect_url, proxy))
+                    self.metrics.incr('relay_retries', (('location', location),))
+                    self._sampled_log('Retry Req[%s]: %s %s with headers = %s, Connect to %s (via %s)',
+                                      relay_id, req.method, req.url, req.headers, connect_url, proxy)
                     continue
                 else:
                     return result
+            return self._relay_response(req, relay_id, original_url, connect_url, relay, result)
+        return HTTPServiceUnavailable(request=req)
 
-            if result.getheader('location'):
-                location = result.getheader('location')
-                parsed_location = urlparse(location)
-                parsed_connect_url = urlparse(connect_url)
-                if parsed_location.netloc.startswith(parsed_connect_url.netloc):
-                    parsed_orig_url = urlparse(original_url)
-                    loc_prefix = parsed_orig_url.path.split('/')[1]
-                    if parsed_orig_url.path.split('/')[1] != self.req_version_str:
-                        rewrited_path = '/' + loc_prefix + parsed_location.path
-                    else:
-                        rewrited_path = parsed_location.path
-                    rewrited_location = (parsed_orig_url.scheme,
-                                         parsed_orig_url.netloc,
-                                         rewrited_path,
-                                         parsed_location.params,
-                                         parsed_location.query,
-                                         parsed_location.fragment)
-
-            response = Response(status='%s %s' % (result.status, result.reason))
-            response.bytes_transferred = 0
+    def _webcache_of(self, location, relay_server, webcaches, path_str_ls):
+        """
+        the webcache to relay through. when relay_server has several, the one
+        of the object on their consistent hash ring, or the next one on the
+        ring if its breaker is open.
+        """
+        ring = self.loc.webcache_ring_of(location, relay_server)
+        if not ring:
+            return webcaches[relay_server] or None
+        return ring.get('/'.join(path_str_ls[1:]), available=self.breaker.available)
+
+    def _relay_to(self, location, relay_server, relay):
+        """
+        relay() to relay_server, and record its health and breaker state.
+        the breaker of the webcache is used instead when relay goes through one.
+        """
+        relay_start = time.time()
+        breaker_key = relay.proxy if relay.uses_proxy() else relay_server
+        self.breaker.attempt(breaker_key)
+        result = relay()
+        elapsed = time.time() - relay_start
+        relay.labels = (('location', location), ('backend', relay_server))
+        self.metrics.incr('relay_requests', relay.labels +
+                          (('status', 'error' if isinstance(result, HTTPException)
+                            else status_class(result.status)),))
+        if relay.connect_time is not None:
+            self.metrics.observe('relay_connect', relay.connect_time, relay.labels)
+        self.metrics.observe('relay_first_byte', elapsed, relay.labels)
+        latency = elapsed
+        if relay.method not in ('GET', 'HEAD') and relay.connect_time is not None:
+            # relay() of a PUT includes sending the body at the client's pace.
+            latency = relay.connect_time
+        if self.health:
+            self.health.record(relay_server, latency,
+                               error=isinstance(result, HTTPException) or result.status >= 500)
+        if isinstance(result, (HTTPGatewayTimeout, HTTPServiceUnavailable)):
+            # the backend didn't answer, other errors are of the client.
+            self.breaker.failure(breaker_key)
+        elif not isinstance(result, HTTPException):
+            self.breaker.success(breaker_key)
+            if self.hedge and relay.method in ('GET', 'HEAD'):
+                self.hedge.record(location, elapsed)
+        return result
+
+    def _hedged_relay(self, req, relay_id, location, targets):
+        """
+        relay a GET or HEAD to the first target, and also to the next one
+        when no headers arrived within the hedge delay of the location or
+        the running ones failed. the first response wins, the others are
+        cancelled and their connections closed.
+
+        :param targets: a list of (relay_server, connect_url, proxy)
+        :return: (connect_url, relay, result) of the winner,
+                 or of the last failure if every target failed.
+        """
+        done = Queue()
+        running = []
+
+        def launch():
+            i = len(running)
+            relay_server, connect_url, proxy = targets[i]
+            # each attempt has its own headers, RelayRequest rewrites 'host'.
+            relay = RelayRequest(self.conf, Request(req.environ.copy()), connect_url,
+                                 proxy=proxy,
+                                 conn_timeout=self.conn_timeout,
+                                 node_timeout=self.node_timeout,
+                                 chunk_size=self.client_chunk_size,
+                                 pool=self.conn_pool)
+            self._sampled_log('Request[%s]: %s %s with headers = %s, Connect to %s (via %s)%s',
+                              relay_id, req.method, req.url, req.headers,
+                              connect_url, proxy, ' as a hedge' if i else '')
+            gt = spawn(lambda: done.put((i, self._relay_to(location, relay_server, relay))))
+            running.append((gt, relay))
 
-            def response_iter():
+        winner = None
+        result = None
+        hedging = True
+        try:
+            launch()
+            pending = 1
+            while pending:
+                timeout = self.hedge.delay(location) \
+                    if hedging and len(running) < len(targets) else None
                 try:
-                    while True:
-                        with ChunkReadTimeout(self.client_timeout):
-                            chunk = result.read(self.client_chunk_size)
-                        if not chunk:
-                            break
-                        yield chunk
-                        response.bytes_transferred += len(chunk)
-                except GeneratorExit:
-                    pass
-                except (Exception, TimeoutError):
-                    raise
-            response.headerlist = result.getheaders()
+                    i, result = done.get(timeout=timeout)
+                except Empty:
+                    if self.hedge.allow(location):
+                        self.metrics.incr('relay_hedges', (('location', location),))
+                        launch()
+                        pending += 1
+                    else:
+                        hedging = False
+                    continue
+                pending -= 1
+                if not isinstance(result, HTTPException):
+                    winner = i
+                    if i:
+                        self.hedge.won(location)
+                    break
+                if not pending and len(running) < len(targets):
+                    self.metrics.incr('relay_retries', (('location', location),))
+                    self._sampled_log('Retry Req[%s]: %s %s', relay_id, req.method, req.url)
+                    launch()
+                    pending += 1
+        finally:
+            for i, (gt, relay) in enumerate(running):
+                if i != winner:
+                    gt.kill()
+                    relay.release(reuse=False)
+        if winner is None:
+            return targets[len(running) - 1][1], None, result
+        return targets[winner][1], running[winner][1], result
+
+    def _relay_response(self, req, relay_id, original_url, connect_url, relay, result):
+        """ a response to the client from the response of a swift proxy """
+        if result.getheader('location'):
+            location = result.getheader('location')
+            parsed_location = urlparse(location)
+            parsed_connect_url = urlparse(connect_url)
+            if parsed_location.netloc.startswith(parsed_connect_url.netloc):
+                parsed_orig_url = urlparse(original_url)
+                loc_prefix = parsed_orig_url.path.split('/')[1]
+                if parsed_orig_url.path.split('/')[1] != self.req_version_str:
+                    rewrited_path = '/' + loc_prefix + parsed_location.path
+                else:
+                    rewrited_path = parsed_location.path
+                rewrited_location = (parsed_orig_url.scheme,
+                                     parsed_orig_url.netloc,
+                                     rewrited_path,
+                                     parsed_location.params,
+                                     parsed_location.query,
+                                     parsed_location.fragment)
+
+        response = Response(status='%s %s' % (result.status, result.reason))
+        # the framing of the backend response is not the one to the client.
+        headers = [(h, v) for h, v in result.getheaders()
+                   if h.lower() not in HOP_BY_HOP_HEADERS + ('transfer-encoding',)]
+        response.headerlist = headers
+        response.content_length = result.getheader('Content-Length')
+        def finish(bytes_transferred):
+            self.metrics.observe('relay_total', time.time() - relay.started, relay.labels)
+            self.metrics.incr('relay_bytes', relay.labels, bytes_transferred)
+
+        if response.content_length < 4096 or req.method == 'HEAD':
+            response.body = result.read()
+            response.bytes_transferred = len(response.body)
+            relay.release(result)
+            finish(response.bytes_transferred)
+        else:
+            # bytes_transferred of a streamed body is counted by the iterator.
+            response.app_iter = RelayResponseIter(relay, result,
+                                                  self.client_chunk_size,
+                                                  self.client_timeout,
+                                                  callback=finish)
+            response.bytes_transferred = 0
+            update_headers(response, {'accept-ranges': 'bytes'})
             response.content_length = result.getheader('Content-Length')
-            if response.content_length < 4096:
-                response.body = result.read()
-            else:
-                response.app_iter = response_iter()
-                update_headers(response, {'accept-ranges': 'bytes'})
-                response.content_length = result.getheader('Content-Length')
-            update_headers(response, result.getheaders())
-            if req.method == 'HEAD':
-                update_headers(response, {'Content-Length': 
-                                          result.getheader('Content-Length')})
-            if result.getheader('location'):
-                update_headers(response, {'Location': urlunparse(rewrited_location)})
-            response.status = result.status
-
-            self.logger.info('Response[%s]: %s by %s %s %s' % 
-                             (str(relay_id), 
-                              response.status, req.method, req.url, 
-                              response.headers))
+        update_headers(response, headers)
+        if req.method == 'HEAD':
+            update_headers(response, {'Content-Length': 
+                                      result.getheader('Content-Length')})
+        if result.getheader('location'):
+            update_headers(response, {'Location': urlunparse(rewrited_location)})
+        response.status = result.status
+
+        self._sampled_log('Response[%s]: %s by %s %s %s',
+                          relay_id, response.status, req.method, req.url, response.headers)
         return response
 
+    def _sampled_log(self, msg, *args):
+        """
+        log a relay at INFO for log_sample_rate of the calls.
+        the message is formatted only when it is logged.
+        """
+        if self.log_sample_rate >= 1 or random() < self.log_sample_rate:
+            self.logger.info(msg, *args)
+
 def app_factory(global_conf, **local_conf):
     """paste.deploy app factory for creating WSGI proxy apps."""
     conf = global_conf.copy()
@@ -0,0 +1,231 @@
+# coding=utf-8
+"""
+in-process fake swift proxies and keystone for benchmarking the dispatcher.
+
+a fake proxy answers enough of the swift 1.4 API for the dispatcher:
+auth (v1.0), account and container listings, container PUT, and object
+GET/HEAD/PUT (with Range). object bodies are generated, PUT bodies are
+consumed and only their size and md5 are kept.
+"""
+import eventlet
+from eventlet import wsgi, sleep
+from webob import Request, Response
+from webob.exc import HTTPNotFound, HTTPServiceUnavailable, HTTPUnauthorized
+from hashlib import md5
+import simplejson as json
+import random
+import time
+
+
+class NullLog(object):
+    def write(self, *args):
+        pass
+
+
+class FakeSwift(object):
+    """
+    :param name: the cluster name, used for its auth token.
+    :param latency: seconds slept before each response.
+    :param error_rate: the ratio of requests answered by 503.
+    :param containers: the number of containers in the account listing.
+    :param objects: the number of objects in a container listing.
+    :param object_size: the size of a generated object body.
+    """
+    def __init__(self, name, account='AUTH_bench', latency=0, error_rate=0,
+                 containers=100, objects=100, object_size=1024, chunk_size=65536):
+        self.name = name
+        self.account = account
+        self.token = 'tk_%s' % name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.containers = containers
+        self.objects = objects
+        self.object_size = object_size
+        self.chunk_size = chunk_size
+        self.stored = {}
+        self.requests = 0
+
+    def __call__(self, env, start_response):
+        self.requests += 1
+        req = Request(env)
+        if self.latency:
+            sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            resp = HTTPServiceUnavailable(request=req)
+        else:
+            resp = self.handle(req)
+        return resp(env, start_response)
+
+    def handle(self, req):
+        parts = req.path.split('/')[1:]
+        if parts[:2] == ['auth', 'v1.0']:
+            return self.auth(req)
+        if req.headers.get('x-auth-token') != self.token:
+            return HTTPUnauthorized(request=req)
+        if len(parts) == 2 or len(parts) == 3 and not parts[2]:
+            return self.account_resp(req)
+        if len(parts) == 3 or len(parts) == 4 and not parts[3]:
+            return self.container_resp(req, parts[2])
+        return self.object_resp(req, parts[2], '/'.join(parts[3:]))
+
+    def auth(self, req):
+        url = '%s/v1.0/%s' % (req.host_url, self.account)
+        resp = Response(request=req, content_type='application/json',
+                        body=json.dumps({'storage': {'default': 'local', 'local': url}}))
+        resp.headers['x-storage-url'] = url
+        resp.headers['x-auth-token'] = self.token
+        resp.headers['x-storage-token'] = self.token
+        return resp
+
+    def listing_resp(self, req, root, element, entries):
+        marker = req.GET.get('marker')
+        end_marker = req.GET.get('end_marker')
+        prefix = req.GET.get('prefix')
+        limit = int(req.GET.get('limit', 10000))
+        selected = []
+        for entry in entries:
+            if marker and entry['name'] <= marker:
+                continue
+            if end_marker and entry['name'] >= end_marker:
+                break
+            if prefix and not entry['name'].startswith(prefix):
+                continue
+            selected.append(entry)
+            if len(selected) >= limit:
+                break
+        fmt = req.GET.get('format')
+        if fmt == 'json':
+            body = json.dumps(selected)
+            content_type = 'application/json'
+        elif fmt == 'xml':
+            body = '<?xml version="1.0" encoding="UTF-8"?>\n<%s name="%s">%s</%s>' % \
+                (root, self.account,
+                 ''.join(['<%s>%s</%s>' % (element,
+                                           ''.join(['<%s>%s</%s>' % (k, v, k)
+                                                    for k, v in sorted(e.items())]),
+                                           element) for e in selected]),
+                 root)
+            content_type = 'application/xml'
+        else:
+            body = '\n'.join([e['name'] for e in selected]) + ('\n' if selected else '')
+            content_type = 'text/plain'
+        if not selected:
+            return Response(request=req, status=204, content_type=content_type)
+        return Response(request=req, body=body, content_type=content_type,
+                        charset='utf-8')
+
+    def account_resp(self, req):
+        entries = [{'name': 'cont%06d' % i, 'count': self.objects,
+                    'bytes': self.objects * self.object_size}
+                   for i in range(self.containers)]
+        if req.method == 'HEAD':
+            resp = Response(request=req, status=204)
+        else:
+            resp = self.listing_resp(req, 'account', 'container', entries)
+        resp.headers['x-account-container-count'] = str(self.containers)
+        resp.headers['x-account-object-count'] = str(self.containers * self.objects)
+        resp.headers['x-account-bytes-used'] = str(self.containers * self.objects *
+                                                   self.object_size)
+        return resp
+
+    def container_resp(self, req, container):
+        if req.method in ('PUT', 'POST'):
+            return Response(request=req, status=201)
+        if req.method == 'DELETE':
+            return Response(request=req, status=204)
+        entries = [{'name': 'obj%06d' % i, 'hash': 'd41d8cd98f00b204e9800998ecf8427e',
+                    'bytes': self.object_size, 'content_type': 'application/octet-stream',
+                    'last_modified': '2012-01-01T00:00:00.000000'}
+                   for i in range(self.objects)]
+        if req.method == 'HEAD':
+            return Response(request=req, status=204)
+        return self.listing_resp(req, 'container', 'object', entries)
+
+    def object_resp(self, req, container, obj):
+        key = '%s/%s' % (container, obj)
+        if req.method == 'PUT':
+            hasher = md5()
+            size = 0
+            if 'x-copy-from' not in req.headers:
+                while True:
+                    chunk = req.environ['wsgi.input'].read(self.chunk_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    size += len(chunk)
+            self.stored[key] = size
+            resp = Response(request=req, status=201)
+            resp.etag = hasher.hexdigest()
+            return resp
+        if req.method == 'DELETE':
+            self.stored.pop(key, None)
+            return Response(request=req, status=204)
+        if req.method not in ('GET', 'HEAD'):
+            return Response(request=req, status=202)
+        size = self.stored.get(key, self.object_size)
+        start, end = 0, size - 1
+        status = 200
+        if req.range:
+            ranges = req.range.ranges
+            if ranges:
+                start, stop = ranges[0]
+                end = (stop if stop is not None else size) - 1
+                end = min(end, size - 1)
+                status = 206
+        resp = Response(request=req, status=status,
+                        content_type='application/octet-stream')
+        if req.method == 'GET':
+            resp.app_iter = self.body_iter(end - start + 1)
+        # after app_iter, which resets content_length.
+        resp.content_length = end - start + 1
+        resp.etag = 'bench'
+        resp.headers['last-modified'] = 'Sun, 01 Jan 2012 00:00:00 GMT'
+        if status == 206:
+            resp.headers['content-range'] = 'bytes %d-%d/%d' % (start, end, size)
+        return resp
+
+    def body_iter(self, size):
+        block = 'x' * self.chunk_size
+        while size > 0:
+            chunk = block[:min(size, self.chunk_size)]
+            size -= len(chunk)
+            yield chunk
+
+
+class FakeKeystone(object):
+    """ POST /v2.0/tokens of keystone (diablo) with a swift endpoint """
+    def __init__(self, name, swift_url, region='RegionOne', latency=0):
+        self.name = name
+        self.swift_url = swift_url
+        self.region = region
+        self.latency = latency
+
+    def __call__(self, env, start_response):
+        req = Request(env)
+        if self.latency:
+            sleep(self.latency)
+        if req.method != 'POST' or req.path.rstrip('/') != '/v2.0/tokens':
+            return HTTPNotFound(request=req)(env, start_response)
+        expires = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() + 86400))
+        body = {'access': {
+            'token': {'id': 'ks_%s' % self.name, 'expires': expires,
+                      'tenant': {'id': 'bench', 'name': 'bench'}},
+            'user': {'id': 'bench', 'name': 'bench', 'roles': []},
+            'serviceCatalog': [{'name': 'swift', 'type': 'object-store',
+                                'endpoints': [{'region': self.region,
+                                               'adminURL': self.swift_url,
+                                               'internalURL': self.swift_url,
+                                               'publicURL': self.swift_url}]}]}}
+        return Response(request=req, body=json.dumps(body),
+                        content_type='application/json')(env, start_response)
+
+
+def listen():
+    """ a listening socket on a free port of the loopback """
+    return eventlet.listen(('127.0.0.1', 0), backlog=1024)
+
+
+def serve(sock, app):
+    """ serve app on sock in a green thread """
+    return eventlet.spawn(wsgi.server, sock, app, log=NullLog(),
+                          max_size=10000, minimum_chunk_size=65536)
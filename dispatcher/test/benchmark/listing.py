@@ -0,0 +1,149 @@
+# coding=utf-8
+"""
+micro benchmark of the merged account listings, without the network.
+
+account listings of --containers containers from each of --clusters
+clusters are merged in plain text, json and xml, by the streaming
+parser / k-way merge / serializers of dispatcher.common.listing and by
+the former implementation (one document per cluster, re-serialized
+whole, xml by minidom), which is kept here as the reference. each
+format reports the best of --repeat runs and the peak memory allocated
+above the bodies (tracked by a run in a forked process).
+
+    cd dispatcher
+    python -m test.benchmark.listing --containers 100000
+"""
+from optparse import OptionParser
+from xml.dom.minidom import getDOMImplementation, parseString
+from xml.sax.saxutils import escape
+import os
+import resource
+import simplejson as json
+import sys
+import time
+
+from dispatcher.common.listing import merge_listings, parse_listing, serialize_listing
+
+FORMATS = (('plain', 'text/plain; charset=utf-8'),
+           ('json', 'application/json; charset=utf-8'),
+           ('xml', 'application/xml; charset=utf-8'))
+
+
+def make_listing(fmt, containers, seed):
+    names = ['cont-%08d-%d' % (i, seed) for i in xrange(containers)]
+    if fmt == 'plain':
+        return '\n'.join(names) + '\n'
+    if fmt == 'json':
+        return json.dumps([{'name': name, 'count': i, 'bytes': i * 1024}
+                           for i, name in enumerate(names)])
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<account name="AUTH_test">' + \
+        ''.join(['<container><name>%s</name><count>%d</count><bytes>%d</bytes></container>' %
+                 (escape(name), i, i * 1024) for i, name in enumerate(names)]) + '</account>'
+
+
+def reference_merge(content_type, bodies, prefixes, combinater_char=':'):
+    """ the merge of the dispatcher before the streaming listings """
+    if content_type.startswith('text/plain'):
+        merge_body = []
+        for prefix, body in zip(prefixes, bodies):
+            for b in body.split('\n'):
+                if b != '':
+                    merge_body.append(str(prefix) + combinater_char + b)
+        merge_body.sort(cmp)
+        return '\n'.join(merge_body)
+    elif content_type.startswith('application/json'):
+        merge_body = []
+        for prefix, body in zip(prefixes, bodies):
+            tmp_body = json.loads(body)
+            for e in tmp_body:
+                e['name'] = prefix + combinater_char + e['name']
+                merge_body.append(e)
+        return json.dumps(merge_body)
+    impl = getDOMImplementation()
+    merge_body = impl.createDocument(None, None, None)
+    acct = merge_body.createElement("account")
+    merge_body.appendChild(acct)
+    for prefix, body in zip(prefixes, bodies):
+        dom = parseString(body)
+        p_emt = dom.getElementsByTagName('account')[0]
+        acct.setAttribute('name', p_emt.getAttribute('name'))
+        for emt in p_emt.getElementsByTagName('container'):
+            orig_name = emt.getElementsByTagName('name').item(0).childNodes[0].data
+            emt.getElementsByTagName('name').item(0).childNodes[0].data = \
+                '%s%s%s' % (prefix, combinater_char, orig_name)
+            acct.appendChild(emt)
+    return merge_body.toxml('UTF-8')
+
+
+def streaming_merge(content_type, bodies, prefixes, combinater_char=':'):
+    """ the merge of dispatcher.common.listing, the body consumed chunk by chunk """
+    info = {}
+    streams = [(prefix, parse_listing(content_type, [body], info))
+               for prefix, body in zip(prefixes, bodies)]
+    length = 0
+    for chunk in serialize_listing(content_type, merge_listings(streams, combinater_char),
+                                   info):
+        length += len(chunk)
+    return length
+
+
+def timed(func, repeat):
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_kb(func):
+    """ the peak RSS grown by func(), run in a child process """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        func()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, str(after - before))
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 64)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result or 0)
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--containers', type='int', default=20000,
+                      help='containers in the account listing of each cluster')
+    parser.add_option('--clusters', type='int', default=2)
+    parser.add_option('-r', '--repeat', type='int', default=3)
+    parser.add_option('-f', '--formats', default=','.join([f for f, _junk in FORMATS]))
+    parser.add_option('--no-reference', dest='reference', action='store_false',
+                      default=True, help='skip the former implementation')
+    options, args = parser.parse_args(argv)
+    formats = [f.strip() for f in options.formats.split(',') if f.strip()]
+    prefixes = [chr(ord('a') + i) for i in range(options.clusters)]
+
+    implementations = [('streaming', streaming_merge)]
+    if options.reference:
+        implementations.append(('reference', reference_merge))
+    for fmt, content_type in FORMATS:
+        if fmt not in formats:
+            continue
+        bodies = [make_listing(fmt, options.containers, i) for i in range(options.clusters)]
+        for name, merge in implementations:
+            func = lambda: merge(content_type, bodies, prefixes)
+            seconds = timed(func, options.repeat)
+            print '%-5s %-10s %8d entries %9.1f ms %10.0f entries/s  peak +%d KB' % \
+                (fmt, name, options.containers * options.clusters, seconds * 1000,
+                 options.containers * options.clusters / seconds, peak_kb(func))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
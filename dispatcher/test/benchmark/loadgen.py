@@ -0,0 +1,119 @@
+# coding=utf-8
+"""
+a concurrent HTTP load generator on green threads.
+"""
+from eventlet import GreenPool
+from eventlet.green.httplib import HTTPConnection
+import time
+
+
+class LoadResult(object):
+    """ latencies (seconds) and errors of a load run """
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+        self.started = None
+        self.elapsed = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+    def summary(self):
+        requests = len(self.latencies) + self.errors
+        return {'requests': requests,
+                'errors': self.errors,
+                'concurrency': self.concurrency,
+                'rps': len(self.latencies) / self.elapsed if self.elapsed else 0,
+                'mbps': self.bytes / self.elapsed / 1048576 if self.elapsed else 0,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': max(self.latencies) if self.latencies else 0}
+
+
+def body_iter(size, chunk_size=65536):
+    """ a generated request body of size bytes """
+    block = 'y' * chunk_size
+    while size > 0:
+        chunk = block[:min(size, chunk_size)]
+        size -= len(chunk)
+        yield chunk
+
+
+def request(host, port, method, path, headers=None, body=None, body_size=None,
+            expect=(200, 201, 202, 204, 206)):
+    """
+    send a request and read the whole response.
+
+    :param body_size: stream a generated body of this size instead of body.
+    :return: (ok, bytes transferred)
+    """
+    conn = HTTPConnection(host, port)
+    headers = dict(headers or {})
+    try:
+        if body_size is not None:
+            headers['Content-Length'] = str(body_size)
+            conn.putrequest(method, path, skip_accept_encoding=True)
+            for k, v in headers.iteritems():
+                conn.putheader(k, v)
+            conn.endheaders()
+            for chunk in body_iter(body_size):
+                conn.send(chunk)
+            sent = body_size
+        else:
+            conn.request(method, path, body, headers)
+            sent = len(body or '')
+        resp = conn.getresponse()
+        received = 0
+        while True:
+            chunk = resp.read(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        return resp.status in expect, sent + received
+    finally:
+        conn.close()
+
+
+def run_load(name, make_request, concurrency=10, requests=None, duration=None):
+    """
+    call make_request() from concurrency green threads until the number of
+    requests is done or duration seconds passed.
+
+    :param make_request: a callable returning (ok, bytes), e.g. a partial of request().
+    """
+    result = LoadResult(name, concurrency)
+    deadline = time.time() + duration if duration else None
+    counter = [0]
+
+    def worker():
+        while True:
+            if requests is not None and counter[0] >= requests:
+                return
+            if deadline and time.time() >= deadline:
+                return
+            counter[0] += 1
+            start = time.time()
+            try:
+                ok, transferred = make_request()
+            except Exception:
+                ok, transferred = False, 0
+            if ok:
+                result.latencies.append(time.time() - start)
+                result.bytes += transferred
+            else:
+                result.errors += 1
+
+    pool = GreenPool(concurrency)
+    result.started = time.time()
+    for i in range(concurrency):
+        pool.spawn_n(worker)
+    pool.waitall()
+    result.elapsed = time.time() - result.started
+    return result
@@ -0,0 +1,281 @@
+# coding=utf-8
+"""
+benchmark of the dispatcher with local fake swift clusters.
+
+two fake clusters ('a' and 'b', --proxies fake proxies each) and two fake
+keystones run in a forked process. the dispatcher, behind keystone_merge,
+runs in this process with relay_rule
+
+    :<a>, both:(a)<a> (b)<b>
+
+and is driven over HTTP by a concurrent load generator, scenario by
+scenario. each scenario reports throughput and latency percentiles, and
+the peak RSS of this process (dispatcher and load generator) is reported
+at the end.
+
+    cd dispatcher
+    python -m test.benchmark.runner --save-baseline /tmp/baseline.json
+    (change the dispatcher)
+    python -m test.benchmark.runner --compare /tmp/baseline.json
+
+a comparison run exits with 1 if a scenario is slower (throughput or p99)
+than the baseline by more than --tolerance, or has more errors.
+dispatcher options can be given by -o, e.g. -o merge_concurrency=2.
+"""
+import eventlet
+eventlet.patcher.monkey_patch(all=False, socket=True)
+from eventlet import hubs
+from functools import partial
+from optparse import OptionParser
+import os
+import resource
+import shutil
+import signal
+import simplejson as json
+import sys
+import tempfile
+
+from test.benchmark.fakeswift import FakeSwift, FakeKeystone, listen, serve
+from test.benchmark.loadgen import request, run_load
+
+SCENARIOS = ('normal_head', 'normal_get', 'normal_put_large', 'normal_get_large',
+             'merge_auth', 'merge_head_account', 'merge_listing', 'merge_listing_xml',
+             'merge_get', 'merge_copy', 'keystone_merge_auth')
+
+
+class Bench(object):
+    """ the fake clusters, the dispatcher under test and the scenarios """
+    def __init__(self, options):
+        self.options = options
+        self.tmpdir = tempfile.mkdtemp(prefix='dispatcher-bench-')
+        self.child = None
+
+    def start_backends(self):
+        """ start the fake clusters and keystones, in a child process unless --no-fork """
+        o = self.options
+        apps = []
+        cluster_files = {}
+        for name in ('a', 'b'):
+            swift = FakeSwift(name, latency=o.latency, error_rate=o.error_rate,
+                              containers=o.containers, objects=o.objects,
+                              object_size=o.object_size)
+            urls = []
+            for i in range(o.proxies):
+                sock = listen()
+                apps.append((sock, swift))
+                urls.append('http://127.0.0.1:%d' % sock.getsockname()[1])
+            path = os.path.join(self.tmpdir, '%s.txt' % name)
+            f = open(path, 'w')
+            f.write('\n'.join(urls) + '\n')
+            f.close()
+            cluster_files[name] = path
+            sock = listen()
+            apps.append((sock, FakeKeystone(name, '%s/v1.0/AUTH_bench' % urls[0],
+                                            region='bench', latency=o.latency)))
+            setattr(self, 'keystone_%s_url' % name, 'http://127.0.0.1:%d' % sock.getsockname()[1])
+        self.relay_rule = ':%s, both:(a)%s (b)%s' % (cluster_files['a'],
+                                                      cluster_files['a'], cluster_files['b'])
+        if o.fork:
+            pid = os.fork()
+            if pid == 0:
+                # the epoll of the parent's hub must not be shared.
+                hubs.use_hub()
+                for sock, app in apps:
+                    serve(sock, app)
+                try:
+                    while True:
+                        eventlet.sleep(3600)
+                finally:
+                    os._exit(0)
+            self.child = pid
+            for sock, app in apps:
+                sock.close()
+        else:
+            for sock, app in apps:
+                serve(sock, app)
+
+    def start_dispatcher(self):
+        from dispatcher.server import Dispatcher
+        from dispatcher.common.middleware.keystone_merge import KeystoneMerge
+        sock = listen()
+        self.port = sock.getsockname()[1]
+        conf = {'relay_rule': self.relay_rule,
+                'dispatcher_base_addr': '127.0.0.1',
+                'bind_port': str(self.port),
+                'log_level': 'WARNING'}
+        for opt in self.options.conf:
+            key, value = opt.split('=', 1)
+            conf[key.strip()] = value.strip()
+        km_conf = dict(conf)
+        km_conf.update({'keystone_relay_path': '/both/v2.0',
+                        'keystone_relay_token_paths': '/both/v2.0/tokens',
+                        'keystone_one_url': self.keystone_a_url,
+                        'keystone_other_url': self.keystone_b_url,
+                        'dispatcher_base_url': 'http://127.0.0.1:%d' % self.port,
+                        'region_name': 'bench'})
+        self.app = KeystoneMerge(Dispatcher(conf), km_conf)
+        serve(sock, self.app)
+
+    def stop(self):
+        if self.child:
+            os.kill(self.child, signal.SIGTERM)
+            os.waitpid(self.child, 0)
+            self.child = None
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def req(self, method, path, headers=None, **kwargs):
+        return partial(request, '127.0.0.1', self.port, method, path, headers, **kwargs)
+
+    def prepare(self):
+        """ get the tokens, make the large object """
+        self.token = 'tk_a'
+        self.merged_token = 'tk_a__@@__tk_b'
+        ok, _junk = self.req('GET', '/both/auth/v1.0',
+                             {'X-Auth-User': 'bench', 'X-Auth-Key': 'bench'})()
+        if not ok:
+            raise Exception('merged auth failed, is the dispatcher working?')
+
+    def scenario(self, name):
+        """ a make_request callable of the scenario """
+        o = self.options
+        token = {'X-Auth-Token': self.token}
+        merged = {'X-Auth-Token': self.merged_token}
+        if name == 'normal_head':
+            return self.req('HEAD', '/v1.0/AUTH_bench/cont000000/obj000000', token)
+        if name == 'normal_get':
+            return self.req('GET', '/v1.0/AUTH_bench/cont000000/obj000000', token)
+        if name == 'normal_put_large':
+            return self.req('PUT', '/v1.0/AUTH_bench/cont000000/large', token,
+                            body_size=o.large_size)
+        if name == 'normal_get_large':
+            return self.req('GET', '/v1.0/AUTH_bench/cont000000/large', token)
+        if name == 'merge_auth':
+            return self.req('GET', '/both/auth/v1.0',
+                            {'X-Auth-User': 'bench', 'X-Auth-Key': 'bench'})
+        if name == 'merge_head_account':
+            return self.req('HEAD', '/both/v1.0/AUTH_bench', merged)
+        if name == 'merge_listing':
+            return self.req('GET', '/both/v1.0/AUTH_bench?format=json', merged)
+        if name == 'merge_listing_xml':
+            return self.req('GET', '/both/v1.0/AUTH_bench?format=xml', merged)
+        if name == 'merge_get':
+            return self.req('GET', '/both/v1.0/AUTH_bench/a:cont000000/obj000000', merged)
+        if name == 'merge_copy':
+            headers = dict(merged)
+            headers['X-Copy-From'] = '/a:cont000000/obj000000'
+            return self.req('PUT', '/both/v1.0/AUTH_bench/b:cont000001/copy', headers,
+                            body='')
+        if name == 'keystone_merge_auth':
+            body = json.dumps({'auth': {'passwordCredentials': {'username': 'bench',
+                                                                'password': 'bench'},
+                                        'tenantName': 'bench'}})
+            return self.req('POST', '/both/v2.0/tokens',
+                            {'Content-Type': 'application/json'}, body=body)
+        raise ValueError('unknown scenario: %s' % name)
+
+    def run(self):
+        o = self.options
+        results = {}
+        for name in o.scenarios:
+            make_request = self.scenario(name)
+            requests = o.requests
+            if name.endswith('_large'):
+                requests = max(1, o.requests / 10)
+            result = run_load(name, make_request, concurrency=o.concurrency,
+                              requests=None if o.duration else requests,
+                              duration=o.duration)
+            results[name] = result.summary()
+            print_result(name, results[name])
+        return {'scenarios': results,
+                'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def print_result(name, r):
+    print '%-22s %6d req %4d err %9.1f req/s %8.1f MB/s  p50 %7.1f  p90 %7.1f  p99 %7.1f ms' % \
+        (name, r['requests'], r['errors'], r['rps'], r['mbps'],
+         r['p50'] * 1000, r['p90'] * 1000, r['p99'] * 1000)
+
+
+def compare(results, baseline, tolerance):
+    """ :return list: the regressions found """
+    regressions = []
+    for name, r in results['scenarios'].iteritems():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        if r['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append('%s: throughput %.1f < %.1f req/s' % (name, r['rps'], base['rps']))
+        # 1ms of slack for scenarios which take no time.
+        if r['p99'] > base['p99'] * (1 + tolerance) + 0.001:
+            regressions.append('%s: p99 %.1f > %.1f ms' %
+                               (name, r['p99'] * 1000, base['p99'] * 1000))
+        if r['errors'] > base['errors']:
+            regressions.append('%s: %d errors > %d' % (name, r['errors'], base['errors']))
+    if results['peak_rss_kb'] > baseline['peak_rss_kb'] * (1 + tolerance):
+        regressions.append('peak RSS %d > %d KB' % (results['peak_rss_kb'],
+                                                    baseline['peak_rss_kb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--concurrency', type='int', default=10)
+    parser.add_option('-n', '--requests', type='int', default=200,
+                      help='requests per scenario (a tenth for *_large)')
+    parser.add_option('-d', '--duration', type='float', default=None,
+                      help='seconds per scenario instead of --requests')
+    parser.add_option('-s', '--scenarios', default=','.join(SCENARIOS))
+    parser.add_option('--proxies', type='int', default=2, help='fake proxies per cluster')
+    parser.add_option('--latency', type='float', default=0,
+                      help='seconds added to each fake swift/keystone response')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='ratio of 503 from fake proxies')
+    parser.add_option('--containers', type='int', default=1000,
+                      help='containers in the account listing of each cluster')
+    parser.add_option('--objects', type='int', default=100)
+    parser.add_option('--object-size', type='int', default=4096)
+    parser.add_option('--large-size', type='int', default=64 * 1048576)
+    parser.add_option('-o', dest='conf', action='append', default=[],
+                      help='dispatcher option, key=value')
+    parser.add_option('--no-fork', dest='fork', action='store_false', default=True,
+                      help='run the fake clusters in this process')
+    parser.add_option('--save-baseline', metavar='FILE')
+    parser.add_option('--compare', metavar='FILE')
+    parser.add_option('--tolerance', type='float', default=0.2)
+    options, args = parser.parse_args(argv)
+    options.scenarios = [s.strip() for s in options.scenarios.split(',') if s.strip()]
+    for name in options.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario: %s' % name)
+
+    bench = Bench(options)
+    try:
+        bench.start_backends()
+        bench.start_dispatcher()
+        bench.prepare()
+        results = bench.run()
+    finally:
+        bench.stop()
+    print 'peak RSS %d KB' % results['peak_rss_kb']
+    results['options'] = dict([(k, v) for k, v in vars(options).items()
+                               if k not in ('save_baseline', 'compare')])
+
+    if options.save_baseline:
+        f = open(options.save_baseline, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            print 'REGRESSION %s' % regression
+        if regressions:
+            return 1
+        print 'no regression against %s' % options.compare
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import time
+import eventlet
+from webob import Response
+from webob.exc import HTTPUnauthorized
+from dispatcher.common.accountcache import AccountCache
+
+
+class TestAccountCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = AccountCache(ttl=10, stale_ttl=60, max_entries=3)
+        self.fetches = 0
+        self.key = ('merge', 'AUTH_test', ('tk_a', 'tk_b'))
+
+    def tearDown(self):
+        pass
+
+    def fetch(self, count='3', delay=0):
+        def func():
+            self.fetches += 1
+            if delay:
+                eventlet.sleep(delay)
+            resp = Response(status=204)
+            resp.headers['x-account-container-count'] = count
+            return resp
+        return func
+
+    def expire(self, key, seconds):
+        self.cache.entries[key].expires = time.time() - seconds
+
+    def test_hit(self):
+        resp = self.cache.get(self.key, self.fetch())
+        self.assertEqual(resp.headers['x-account-container-count'], '3')
+        resp = self.cache.get(self.key, self.fetch('5'))
+        self.assertEqual(resp.status_int, 204)
+        self.assertEqual(resp.headers['x-account-container-count'], '3')
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.cache.snapshot()['hits'], 1)
+
+    def test_tokens(self):
+        self.cache.get(self.key, self.fetch())
+        self.cache.get(('merge', 'AUTH_test', ('tk_c', 'tk_b')), self.fetch())
+        self.assertEqual(self.fetches, 2)
+
+    def test_stale_while_revalidate(self):
+        self.cache.get(self.key, self.fetch())
+        self.expire(self.key, 1)
+        resp = self.cache.get(self.key, self.fetch('5', delay=0.01))
+        self.assertEqual(resp.headers['x-account-container-count'], '3')
+        # one refresh at a time.
+        self.cache.get(self.key, self.fetch('5', delay=0.01))
+        eventlet.sleep(0.05)
+        self.assertEqual(self.fetches, 2)
+        resp = self.cache.get(self.key, self.fetch('7'))
+        self.assertEqual(resp.headers['x-account-container-count'], '5')
+        self.assertEqual(self.cache.snapshot()['stale_hits'], 2)
+
+    def test_too_stale(self):
+        self.cache.get(self.key, self.fetch())
+        self.expire(self.key, 61)
+        resp = self.cache.get(self.key, self.fetch('5'))
+        self.assertEqual(resp.headers['x-account-container-count'], '5')
+
+    def test_invalidate(self):
+        self.cache.get(self.key, self.fetch())
+        self.cache.get(('other', 'AUTH_test', ('tk_a',)), self.fetch())
+        self.cache.get(('merge', 'AUTH_other', ('tk_a',)), self.fetch())
+        self.cache.invalidate('AUTH_test')
+        self.assertEqual(self.cache.entries.keys(), [('merge', 'AUTH_other', ('tk_a',))])
+        self.assertEqual(self.cache.generations, {})
+
+    def test_write_while_fetching(self):
+        fetching = eventlet.spawn(self.cache.get, self.key, self.fetch(delay=0.01))
+        eventlet.sleep(0)
+        self.cache.invalidate('AUTH_test')
+        self.assertEqual(fetching.wait().headers['x-account-container-count'], '3')
+        self.assertEqual(len(self.cache.entries), 0)
+        self.assertEqual(self.cache.generations, {})
+        self.cache.get(self.key, self.fetch())
+        self.assertEqual(len(self.cache.entries), 1)
+
+    def test_error_not_cached(self):
+        self.cache.get(self.key, lambda: HTTPUnauthorized())
+        self.assertEqual(len(self.cache.entries), 0)
+
+    def test_lru(self):
+        for i in range(4):
+            self.cache.get(('merge', 'AUTH_%d' % i, ()), self.fetch())
+        self.assertEqual([k[1] for k in self.cache.entries.keys()],
+                         ['AUTH_1', 'AUTH_2', 'AUTH_3'])
+        self.assertEqual(sorted(self.cache.accounts.keys()), ['AUTH_1', 'AUTH_2', 'AUTH_3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
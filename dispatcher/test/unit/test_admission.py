@@ -0,0 +1,123 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import eventlet
+from webob import Request
+from dispatcher.common.admission import Admission, AdmittedIter, parse_pairs, \
+    LISTING, OBJECT, BULK
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.admission = Admission(location_limit=2, account_limit=0, queue_size=100,
+                                   timeout=1, weights={LISTING: 3, OBJECT: 1, BULK: 1})
+        self.order = []
+
+    def tearDown(self):
+        pass
+
+    def request(self, cls, account='a', hold=0.01, location='loc'):
+        ticket = self.admission.admit(location, account, cls)
+        if ticket:
+            self.order.append(cls)
+            eventlet.sleep(hold)
+            ticket.release()
+        return ticket
+
+    def test_parse_pairs(self):
+        self.assertEqual(parse_pairs('listing:4, bulk : 1'), {'listing': 4.0, 'bulk': 1.0})
+        self.assertEqual(parse_pairs('merge:64', int), {'merge': 64})
+        self.assertEqual(parse_pairs(None), {})
+
+    def test_classify(self):
+        classify = self.admission.classify
+        self.assertEqual(classify(Request.blank('/v1.0/a/c'), ['v1.0', 'a', 'c']), LISTING)
+        req = Request.blank('/v1.0/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'content-length': '10'})
+        self.assertEqual(classify(req, ['v1.0', 'a', 'c', 'o']), OBJECT)
+        req.headers['content-length'] = '2000000'
+        self.assertEqual(classify(req, ['v1.0', 'a', 'c', 'o']), BULK)
+        del req.headers['content-length']
+        self.assertEqual(classify(req, ['v1.0', 'a', 'c', 'o']), BULK)
+        self.assertEqual(classify(Request.blank('/v1.0/a/c/o'), ['v1.0', 'a', 'c', 'o']), OBJECT)
+
+    def test_limit(self):
+        pool = eventlet.GreenPool()
+        running = []
+
+        def req():
+            ticket = self.admission.admit('loc', 'a', OBJECT)
+            running.append(self.admission.queues['loc'].running)
+            eventlet.sleep(0.01)
+            ticket.release()
+        for i in range(6):
+            pool.spawn(req)
+        pool.waitall()
+        self.assertEqual(max(running), 2)
+        self.assertEqual(self.admission.queues['loc'].running, 0)
+        self.assertEqual(self.admission.snapshot()['admitted'], 6)
+
+    def test_weighted(self):
+        pool = eventlet.GreenPool()
+        blocker = self.admission.admit('loc', 'a', OBJECT)
+        blocker2 = self.admission.admit('loc', 'a', OBJECT)
+        for i in range(8):
+            pool.spawn(self.request, BULK)
+            pool.spawn(self.request, LISTING)
+        eventlet.sleep(0)
+        blocker.release()
+        blocker2.release()
+        pool.waitall()
+        # the listings get 3 of 4 slots while both classes wait.
+        self.assertEqual(self.order[:8].count(LISTING), 6)
+        self.assertEqual(len(self.order), 16)
+
+    def test_account_limit(self):
+        self.admission.account_limit = 1
+        pool = eventlet.GreenPool()
+        for i in range(3):
+            pool.spawn(self.request, OBJECT, 'a', 0.05)
+        pool.spawn(self.request, OBJECT, 'b', 0.05)
+        eventlet.sleep(0.01)
+        queue = self.admission.queues['loc']
+        self.assertEqual(queue.accounts, {'a': 1, 'b': 1})
+        pool.waitall()
+        self.assertEqual(queue.accounts, {})
+
+    def test_queue_full(self):
+        self.admission.queue_size = 1
+        tickets = [self.admission.admit('loc', 'a', OBJECT) for i in range(2)]
+        waiting = eventlet.spawn(self.admission.admit, 'loc', 'a', OBJECT)
+        eventlet.sleep(0)
+        self.assertEqual(self.admission.admit('loc', 'a', OBJECT), None)
+        self.assertEqual(self.admission.snapshot()['queue_full'], 1)
+        tickets[0].release()
+        self.assertTrue(waiting.wait())
+
+    def test_timeout(self):
+        self.admission.timeout = 0.01
+        tickets = [self.admission.admit('loc', 'a', OBJECT) for i in range(2)]
+        self.assertEqual(self.admission.admit('loc', 'a', LISTING), None)
+        snapshot = self.admission.snapshot()
+        self.assertEqual(snapshot['timeout'], 1)
+        self.assertEqual(snapshot['locations']['loc']['waiting'][LISTING], 0)
+
+    def test_locations(self):
+        self.admission.location_limits = {'merge': 1}
+        self.assertTrue(self.admission.admit('merge', 'a', OBJECT))
+        self.admission.timeout = 0.01
+        self.assertEqual(self.admission.admit('merge', 'a', OBJECT), None)
+        self.assertTrue(self.admission.admit('', 'a', OBJECT))
+
+    def test_release_once(self):
+        ticket = self.admission.admit('loc', 'a', OBJECT)
+        body = AdmittedIter(['a', 'b'], ticket)
+        self.assertEqual(list(body), ['a', 'b'])
+        body.close()
+        self.assertTrue(ticket.released)
+        self.assertEqual(self.admission.queues['loc'].running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+import time
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(error_threshold=2, cooldown=0.1)
+        self.servers = ['http://a:8080', 'http://b:8080']
+
+    def tearDown(self):
+        pass
+
+    def test_open_after_threshold(self):
+        self.breaker.failure('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), CLOSED)
+        self.breaker.success('http://a:8080')
+        self.breaker.failure('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), CLOSED)
+        self.breaker.failure('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), OPEN)
+        self.assertEqual(self.breaker.filter(self.servers), ['http://b:8080'])
+
+    def test_all_open(self):
+        for server in self.servers * 2:
+            self.breaker.failure(server)
+        self.assertEqual(self.breaker.filter(self.servers), self.servers)
+
+    def test_half_open(self):
+        self.breaker.failure('http://a:8080')
+        self.breaker.failure('http://a:8080')
+        time.sleep(0.1)
+        self.assertEqual(self.breaker.filter(self.servers), self.servers)
+        self.breaker.attempt('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), HALF_OPEN)
+        # one trial at a time
+        self.assertEqual(self.breaker.filter(self.servers), ['http://b:8080'])
+        self.breaker.failure('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), OPEN)
+        time.sleep(0.1)
+        self.breaker.attempt('http://a:8080')
+        self.breaker.success('http://a:8080')
+        self.assertEqual(self.breaker.state('http://a:8080'), CLOSED)
+        self.assertEqual(self.breaker.snapshot()['http://a:8080']['ejections'], 2)
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(error_threshold=0)
+        for i in range(10):
+            breaker.failure('http://a:8080')
+        self.assertEqual(breaker.state('http://a:8080'), CLOSED)
+        self.assertEqual(breaker.filter(self.servers), self.servers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.connpool import ConnectionPool, PoolTimeout
+from eventlet import spawn, sleep
+import socket
+import time
+
+
+class DummyConn(object):
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_per_host=2, idle_timeout=10)
+        self.key = ('http', '127.0.0.1', '8080', None)
+
+    def tearDown(self):
+        pass
+
+    def test_reuse(self):
+        conn = self.pool.get(self.key, DummyConn)
+        self.assertFalse(conn.pool_reused)
+        self.pool.put(conn)
+        self.assertEqual(self.pool.get(self.key, DummyConn), conn)
+        self.assertTrue(conn.pool_reused)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_other_key(self):
+        conn = self.pool.get(self.key, DummyConn)
+        self.pool.put(conn)
+        other = self.pool.get(('https', '127.0.0.1', '8080', None), DummyConn)
+        self.assertNotEqual(other, conn)
+
+    def test_stale(self):
+        conn = self.pool.get(self.key, DummyConn)
+        self.pool.put(conn)
+        conn.peer.close()
+        new_conn = self.pool.get(self.key, DummyConn)
+        self.assertNotEqual(new_conn, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.stats()['stale'], 1)
+
+    def test_idle_timeout(self):
+        conn = self.pool.get(self.key, DummyConn)
+        self.pool.put(conn)
+        conn.pool_last_used = time.time() - 11
+        self.assertNotEqual(self.pool.get(self.key, DummyConn), conn)
+        self.assertEqual(self.pool.stats()['expired'], 1)
+
+    def test_discard(self):
+        conn = self.pool.get(self.key, DummyConn)
+        self.pool.discard(conn)
+        self.assertTrue(conn.closed)
+        self.pool.put(conn)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_max_per_host(self):
+        conns = [self.pool.get(self.key, DummyConn) for i in range(2)]
+        got = []
+        gt = spawn(lambda: got.append(self.pool.get(self.key, DummyConn)))
+        sleep(0.01)
+        self.assertEqual(got, [])
+        self.pool.put(conns[0])
+        gt.wait()
+        self.assertEqual(got, [conns[0]])
+
+    def test_acquire_timeout(self):
+        pool = ConnectionPool(max_per_host=1, acquire_timeout=0.05)
+        conn = pool.get(self.key, DummyConn)
+        self.assertRaises(PoolTimeout, pool.get, self.key, DummyConn)
+        self.assertEqual(pool.stats()['acquire_timeouts'], 1)
+        pool.put(conn)
+        self.assertEqual(pool.get(self.key, DummyConn), conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
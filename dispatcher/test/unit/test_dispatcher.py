@@ -213,6 +213,37 @@ class TestController(unittest.TestCase):
         self.assertEqual([['http://192.168.2.1:8080']], 
                          loc.swift_of('remote'))
 
+    def test_LOCATION_cluster_index(self):
+        loc_str = ':test/server0.txt, both:(hoge)test/server2.txt (gere)test/server3.txt'
+        loc = Location(loc_str)
+        self.assertEqual(0, loc.cluster_index_of('both', 'hoge'))
+        self.assertEqual(1, loc.cluster_index_of('both', 'gere'))
+        self.assertEqual(None, loc.cluster_index_of('both', 'nothing'))
+        self.assertEqual(None, loc.cluster_index_of('nothing', 'hoge'))
+        self.assertEqual([], loc.servers_by_container_prefix_of('both', 'nothing'))
+        self.assertEqual(('http://127.0.0.1:18080', 'http://127.0.0.1:8080'),
+                         tuple(sorted(loc.swift_servers())))
+
+    def test_LOCATION_watcher(self):
+        """ server.txt is reloaded by the watcher, not by requests. """
+        loc_str = ':test/server0.txt, remote:test/server4.txt'
+        loc = Location(loc_str, reload_interval=0.1)
+        old_table = loc.table
+        with open('test/server4.txt', 'r') as f:
+            olddata = f.read()
+        try:
+            with open('test/server4.txt', 'w') as f:
+                f.write('http://192.168.2.1:8080')
+            os.utime('test/server4.txt', (old_table.age + 1, old_table.age + 1))
+            self.assertEqual([['http://127.0.0.1:18080']], loc.swift_of('remote'))
+            sleep(0.3)
+            self.assertEqual([['http://192.168.2.1:8080']], loc.swift_of('remote'))
+            self.assertEqual([['http://127.0.0.1:18080']], old_table.locations['remote']['swift'])
+        finally:
+            loc.stop_watcher()
+            with open('test/server4.txt', 'w') as f:
+                f.write(olddata)
+
     def test_LOCATION_invalid_location_file(self):
         loc_str = ':test/server00.txt'
         self.assertRaises(ValueError, Location, loc_str)
@@ -343,6 +374,14 @@ class TestController(unittest.TestCase):
         print proxy1_srv.env
         self.assertEqual(body, res.body)
 
+    def test_REQUEST_merge_partial_token(self):
+        """ a merged token without the token of a cluster is refused. """
+        for token in ('t__@@__', '__@@__v', 't__@@__v__@@__w'):
+            for path in ('/both/v1.0/AUTH_test', '/both/v1.0/AUTH_test/hoge:TEST0/test0.txt'):
+                res = self.app.get(path, headers=dict(X_Auth_Token=token), expect_errors=True)
+                self.assertEqual(res.status, '401 Unauthorized')
+                self.assertTrue('authenticate again' in res.body)
+
     def test_16_REQUEST_merge_GET_object(self):
         """ relay to get object in merge mode. """
         res = self.app.get('/both/v1.0/AUTH_test/hoge:TEST0/test0.txt', headers=dict(X_Auth_Token='t__@@__v'), expect_errors=True)
@@ -5,7 +5,9 @@ try:
 except (ImportError):
     import unittest
 from dispatcher.server import Dispatcher as server
+from dispatcher.common.health import BackendHealth
 from dispatcher.common.location import Location
+from dispatcher.common.segment import Segmenter
 from eventlet import sleep, spawn, TimeoutError, util, wsgi, listen
 from swift.common.utils import normalize_timestamp, NullLogger
 from test import get_config
@@ -225,15 +227,76 @@ class TestController(unittest.TestCase):
                  {'name':'TEST7','count':0,'bytes':0},
                  {'name':'TEST8','count':0,'bytes':0},
                  {'name':'TEST9','count':0,'bytes':0}]
-        json_result = [{'count': 1, 'bytes': 256, 'name': 'hoge:TEST0'}, 
-                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST1'}, 
-                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST2'}, 
-                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST3'}, 
-                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST4'}, 
-                       {'count': 1, 'bytes': 256, 'name': 'gere:TEST5'}, 
+        json_result = [{'count': 1, 'bytes': 256, 'name': 'gere:TEST5'}, 
                        {'count': 0, 'bytes': 0, 'name': 'gere:TEST6'}, 
                        {'count': 0, 'bytes': 0, 'name': 'gere:TEST7'}, 
                        {'count': 0, 'bytes': 0, 'name': 'gere:TEST8'}, 
-                       {'count': 0, 'bytes': 0, 'name': 'gere:TEST9'}]
-        self.assertEqual(self.app.app._merge_container_lists('application/json', [json.dumps(json0), json.dumps(json1)], prefixes),
-                         json.dumps(json_result))
+                       {'count': 0, 'bytes': 0, 'name': 'gere:TEST9'}, 
+                       {'count': 1, 'bytes': 256, 'name': 'hoge:TEST0'}, 
+                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST1'}, 
+                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST2'}, 
+                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST3'}, 
+                       {'count': 0, 'bytes': 0, 'name': 'hoge:TEST4'}]
+        self.assertEqual(json.loads(self.app.app._merge_container_lists('application/json', [json.dumps(json0), json.dumps(json1)], prefixes)),
+                         json_result)
+        xml0 = '<?xml version="1.0" encoding="UTF-8"?>\n<account name="AUTH_test">' + \
+            '<container><name>TEST0</name><count>1</count><bytes>256</bytes></container></account>'
+        xml1 = '<?xml version="1.0" encoding="UTF-8"?>\n<account name="AUTH_test">' + \
+            '<container><name>TEST5</name><count>0</count><bytes>0</bytes></container></account>'
+        self.assertEqual(self.app.app._merge_container_lists('application/xml', [xml0, xml1], prefixes),
+                         '<?xml version="1.0" encoding="UTF-8"?><account name="AUTH_test">' + \
+                             '<container><name>gere:TEST5</name><count>0</count><bytes>0</bytes></container>' + \
+                             '<container><name>hoge:TEST0</name><count>1</count><bytes>256</bytes></container></account>')
+
+    def test_relay_to_health(self):
+        """ _relay_to """
+        class FakeRelay(object):
+            def __init__(self, method, delay):
+                self.method = method
+                self.delay = delay
+                self.proxy = None
+                self.connect_time = 0.01
+                self.status = 201
+
+            def uses_proxy(self):
+                return False
+
+            def __call__(self):
+                sleep(self.delay)
+                return self
+        app = self.app.app
+        app.health = BackendHealth(alpha=0.5)
+        app._relay_to('local', 'http://a:8080', FakeRelay('GET', 0.05))
+        self.assertTrue(app.health.score('http://a:8080') >= 0.05)
+        app._relay_to('local', 'http://a:8080', FakeRelay('PUT', 0.3))
+        self.assertTrue(app.health.score('http://a:8080') < 0.05)
+
+    def test_segmented_put_quoted_name(self):
+        """ segmented_put_resp """
+        app = self.app.app
+        app.segmenter = Segmenter(seg_size=4)
+        puts = []
+
+        def relay_sub_req(sub, req_url, path_ls, relay_servers, webcaches, query=''):
+            while sub.environ['wsgi.input'].read():
+                pass
+            puts.append('/'.join(path_ls))
+            return Response(status='201 Created')
+
+        def relay_req(req, req_url, path_str_ls, relay_servers, webcaches):
+            puts.append(req.headers['x-object-manifest'])
+            return Response(status='201 Created')
+        app._relay_sub_req = relay_sub_req
+        app.relay_req = relay_req
+        req = Request.blank('/v1.0/AUTH_test/TEST0/a%20b.txt',
+                            environ={'REQUEST_METHOD': 'PUT'}, body='0123456789')
+        path_str_ls = ['v1.0', 'AUTH_test', 'TEST0', 'a%20b.txt']
+        resp = app.segmented_put_resp(req, 'http://127.0.0.1:8080', path_str_ls, [], [])
+        self.assertEqual(resp.status_int, 201)
+        manifest = puts[-1]
+        self.assertTrue(manifest.startswith('TEST0_segments/a%20b.txt/'))
+        # puts[0] is the PUT of the segment container.
+        segments = puts[1:-1]
+        self.assertEqual(len(segments), 3)
+        for seg in segments:
+            self.assertTrue(seg.startswith('v1.0/AUTH_test/' + manifest))
@@ -0,0 +1,95 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.fanout import FanOut
+from eventlet import sleep, Timeout
+import time
+
+
+class FakeLogger(object):
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_results_in_order(self):
+        def delayed(value, delay):
+            sleep(delay)
+            return value
+        fanout = FanOut()
+        results = fanout.run(delayed, [('a', 0.2), ('b', 0.0), ('c', 0.1)])
+        self.assertEqual(results, ['a', 'b', 'c'])
+
+    def test_concurrent(self):
+        fanout = FanOut()
+        start = time.time()
+        fanout.run(sleep, [(0.2,), (0.2,), (0.2,)])
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_concurrency_cap(self):
+        running = []
+        peak = []
+        def count(value):
+            running.append(value)
+            peak.append(len(running))
+            sleep(0.05)
+            running.remove(value)
+            return value
+        fanout = FanOut(concurrency=2)
+        self.assertEqual(fanout.run(count, [(i,) for i in range(5)]), range(5))
+        self.assertEqual(max(peak), 2)
+
+    def test_deadline(self):
+        def delayed(value, delay):
+            sleep(delay)
+            return value
+        fanout = FanOut(timeout=0.1)
+        start = time.time()
+        results = fanout.run(delayed, [('fast', 0.0), ('slow', 1.0)])
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(results, ['fast', None])
+
+    def test_deadline_kills_cleanly(self):
+        released = []
+        def hold(value):
+            try:
+                sleep(1.0)
+                return value
+            finally:
+                released.append(value)
+        logger = FakeLogger()
+        fanout = FanOut(timeout=0.05, logger=logger)
+        self.assertEqual(fanout.run(hold, [('a',), ('b',)]), [None, None])
+        self.assertEqual(sorted(released), ['a', 'b'])
+        self.assertEqual(logger.errors, [])
+        self.assertEqual(len(logger.warnings), 1)
+
+    def test_timeout_in_func(self):
+        def expire():
+            raise Timeout()
+        logger = FakeLogger()
+        self.assertEqual(FanOut(logger=logger).run(expire, [()]), [None])
+        self.assertEqual(len(logger.errors), 1)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('fail')
+        self.assertEqual(FanOut().run(fail, [()]), [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import os
+import tempfile
+from dispatcher.common.hashring import HashRing
+from dispatcher.common.location import Location
+
+CACHES = ['http://127.0.0.1:3128', 'http://127.0.0.1:3129', 'http://127.0.0.1:3130']
+
+
+class TestHashRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = HashRing(CACHES)
+        self.keys = ['AUTH_test/cont/obj%d' % i for i in range(3000)]
+
+    def tearDown(self):
+        pass
+
+    def test_distribution(self):
+        counts = {}
+        for key in self.keys:
+            node = self.ring.get(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts.keys()), CACHES)
+        for count in counts.values():
+            self.assertTrue(700 < count < 1300, counts)
+
+    def test_stable(self):
+        smaller = HashRing(CACHES[:2])
+        for key in self.keys:
+            node = self.ring.get(key)
+            if node != CACHES[2]:
+                # only the keys of the removed node move.
+                self.assertEqual(smaller.get(key), node)
+
+    def test_failover(self):
+        key = self.keys[0]
+        nodes = self.ring.nodes_for(key)
+        self.assertEqual(sorted(nodes), CACHES)
+        self.assertEqual(self.ring.get(key), nodes[0])
+        self.assertEqual(self.ring.get(key, available=lambda n: n != nodes[0]), nodes[1])
+        # the neighbour on the ring, the same for every key of the node.
+        self.assertEqual(self.ring.get(key, available=lambda n: False), nodes[0])
+        self.assertEqual(HashRing([]).get(key), None)
+
+    def test_unicode_key(self):
+        self.assertTrue(self.ring.get(u'AUTH_test/cont/\u3042') in CACHES)
+
+
+class TestLocationWebcaches(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, 'http://127.0.0.1:8080, %s\nhttp://127.0.0.1:8081, %s\n' %
+                 (', '.join(CACHES), CACHES[0]))
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_webcache_ring_of(self):
+        loc = Location(':%s' % self.path)
+        self.assertEqual({'http://127.0.0.1:8080': CACHES[0],
+                          'http://127.0.0.1:8081': CACHES[0]}, loc.webcache_of(''))
+        ring = loc.webcache_ring_of('', 'http://127.0.0.1:8080')
+        self.assertEqual(ring.nodes, tuple(CACHES))
+        self.assertEqual(loc.webcache_ring_of('', 'http://127.0.0.1:8081'), None)
+        self.assertEqual(loc.webcache_ring_of('nothing', 'http://127.0.0.1:8080'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
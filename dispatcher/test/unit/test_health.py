@@ -0,0 +1,61 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.health import BackendHealth
+from eventlet.green import socket
+from eventlet import sleep
+
+
+class TestBackendHealth(unittest.TestCase):
+    def setUp(self):
+        self.health = BackendHealth(alpha=0.5, error_penalty=10.0, probe_timeout=0.5)
+
+    def tearDown(self):
+        self.health.stop_prober()
+
+    def test_ewma(self):
+        self.health.record('http://a:8080', 1.0)
+        self.assertEqual(self.health.score('http://a:8080'), 1.0)
+        self.health.record('http://a:8080', 0.0)
+        self.assertEqual(self.health.score('http://a:8080'), 0.5)
+        self.health.record('http://a:8080', 0.5, error=True)
+        stat = self.health.snapshot()['http://a:8080']
+        self.assertEqual(stat['latency'], 0.5)
+        self.assertEqual(stat['error_rate'], 0.5)
+        self.assertEqual(stat['samples'], 3)
+        self.assertEqual(stat['errors'], 1)
+        self.assertEqual(stat['score'], 5.5)
+
+    def test_rank(self):
+        servers = ['http://a:8080', 'http://b:8080', 'http://c:8080']
+        self.assertEqual(self.health.rank(servers), servers)
+        self.health.record('http://a:8080', 0.2)
+        self.health.record('http://b:8080', 0.1)
+        self.assertEqual(self.health.rank(servers),
+                         ['http://c:8080', 'http://b:8080', 'http://a:8080'])
+        self.health.record('http://b:8080', 0.1, error=True)
+        self.health.record('http://c:8080', 0.3)
+        self.assertEqual(self.health.rank(servers),
+                         ['http://a:8080', 'http://c:8080', 'http://b:8080'])
+
+    def test_probe(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        alive = 'http://127.0.0.1:%d' % listener.getsockname()[1]
+        dead_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dead_sock.bind(('127.0.0.1', 0))
+        dead = 'http://127.0.0.1:%d' % dead_sock.getsockname()[1]
+        dead_sock.close()
+        self.health.start_prober(lambda: [dead, alive], 0.05)
+        sleep(0.2)
+        listener.close()
+        snap = self.health.snapshot()
+        self.assertEqual(snap[alive]['errors'], 0)
+        self.assertTrue(snap[dead]['error_rate'] > 0.5)
+        self.assertEqual(self.health.rank([dead, alive]), [alive, dead])
+
+
+if __name__ == '__main__':
+    unittest.main()
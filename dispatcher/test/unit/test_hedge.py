@@ -0,0 +1,51 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.hedge import HedgePolicy
+
+
+class TestHedgePolicy(unittest.TestCase):
+    def setUp(self):
+        self.hedge = HedgePolicy(percentile=90, budget=0.1, default_delay=0.5,
+                                 min_delay=0.01, window=100, min_samples=10)
+
+    def tearDown(self):
+        pass
+
+    def test_delay(self):
+        self.assertEqual(self.hedge.delay('loc'), 0.5)
+        for i in range(9):
+            self.hedge.record('loc', 0.1)
+        self.assertEqual(self.hedge.delay('loc'), 0.5)
+        self.hedge.record('loc', 0.1)
+        self.assertEqual(self.hedge.delay('loc'), 0.1)
+        for i in range(100):
+            self.hedge.record('loc', (i + 1) / 1000.0)
+        self.assertEqual(self.hedge.delay('loc'), 0.091)
+        for i in range(100):
+            self.hedge.record('loc', 0.0)
+        self.assertEqual(self.hedge.delay('loc'), 0.01)
+        self.assertEqual(self.hedge.delay('other'), 0.5)
+
+    def test_budget(self):
+        for i in range(9):
+            self.hedge.request('loc')
+        self.assertFalse(self.hedge.allow('loc'))
+        self.hedge.request('loc')
+        self.assertTrue(self.hedge.allow('loc'))
+        self.assertFalse(self.hedge.allow('loc'))
+        for i in range(10):
+            self.hedge.request('loc')
+        self.assertTrue(self.hedge.allow('loc'))
+        self.assertFalse(self.hedge.allow('other'))
+        self.hedge.won('loc')
+        snap = self.hedge.snapshot()['loc']
+        self.assertEqual(snap['requests'], 20)
+        self.assertEqual(snap['hedges'], 2)
+        self.assertEqual(snap['wins'], 1)
+        self.assertEqual(snap['delay'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
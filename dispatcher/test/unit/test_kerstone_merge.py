@@ -6,11 +6,13 @@ except (ImportError):
     import unittest
 from dispatcher.server import Dispatcher as server
 from dispatcher.common.middleware.keystone_merge import filter_factory
+from dispatcher.common.tokencache import TokenCache
 from eventlet import sleep, spawn, TimeoutError, util, wsgi, listen
 from swift.common.utils import normalize_timestamp, NullLogger
 from webob import Request, Response
 import json
 from urlparse import urlparse
+from copy import deepcopy
 import types
 
 class TmpLogger():
@@ -55,7 +57,7 @@ class DummySrv(object):
     def __call__(self, env, start_response):
         self.env = env
         req = Request(env)
-        if req.path == '/v2.0/tokens':
+        if req.path.rstrip('/') == '/v2.0/tokens':
             body = json.dumps(self.body)
         else:
             body = 'no auth token request'
@@ -233,6 +235,69 @@ class TestController(unittest.TestCase):
                              body=json.dumps({'auth': {'token': {'id': 't'}, 'tenantId': ''}})).get_response(k)
         self.assertEqual(json.loads(resp.body), {'data': 'None'})
 
+    def test_keystone_urls(self):
+        """ keystone_urls, or keystone_one_url and keystone_other_url """
+        self.assertEqual(self.k.keystone_urls, ['http://192.168.2.100:5001',
+                                                'http://192.168.2.200:5001'])
+        conf = {'keystone_relay_token_paths': '/both/v2.0/tokens',
+                'keystone_urls': 'http://192.168.2.100:5001 http://192.168.2.200:5001 http://192.168.2.300:5001'}
+        k = filter_factory(conf)(DummyApp())
+        self.assertEqual(len(k.keystone_urls), 3)
+        self.assertEqual(k.keystone_one_url, 'http://192.168.2.100:5001')
+
+    def test_auth_token_degraded(self):
+        """ relay to keystones, one of them is down """
+        conf = {'keystone_relay_path': '/both/v2.0',
+                'keystone_relay_token_paths': '/both/v2.0/tokens /both/v2.0/token_by',
+                'keystone_urls': 'http://127.0.0.1:5001 http://127.0.0.1:1 http://127.0.0.1:15001',
+                'keystone_timeout': '1',
+                'dispatcher_base_url': 'http://127.0.0.1:10000',
+                'region_name': 'RegionOne'}
+        k = filter_factory(conf)(DummyApp())
+        body = json.dumps({'auth': {'passwordCredentials':
+                                    {'username': 'tester', 'password': 'testing'},
+                                    'tenantId': ''}})
+        # a merged token needs the token of every keystone.
+        resp = Request.blank('/both/v2.0/tokens', method='POST',
+                             headers={'Content-Type': 'application/json'},
+                             body=body).get_response(k)
+        self.assertEqual(resp.status_int, 503)
+        k.keystone_urls = ['http://127.0.0.1:5001', 'http://127.0.0.1:15001']
+        for token in ('t__@@__', '__@@__v', 't__@@__v__@@__w'):
+            resp = Request.blank('/both/v2.0/tokens', method='POST',
+                                 headers={'Content-Type': 'application/json'},
+                                 body=json.dumps({'auth': {'token': {'id': token},
+                                                           'tenantId': ''}})).get_response(k)
+            self.assertEqual(resp.status_int, 401)
+
+    def test_merged_token_cache(self):
+        """ confirming a merged token again is answered from the cache """
+        conf = {'keystone_relay_path': '/both/v2.0',
+                'keystone_relay_token_paths': '/both/v2.0/tokens',
+                'keystone_urls': 'http://127.0.0.1:5001 http://127.0.0.1:15001',
+                'dispatcher_base_url': 'http://127.0.0.1:10000',
+                'region_name': 'RegionOne'}
+        k = filter_factory(conf)(DummyApp())
+        k.token_cache = TokenCache()
+        saved = keystone0_srv.body, keystone1_srv.body
+        try:
+            for srv in (keystone0_srv, keystone1_srv):
+                srv.body = deepcopy(srv.body)
+                srv.body['access']['token']['expires'] = '2099-01-01T00:00:00'
+            body = json.dumps({'auth': {'token': {'id': 't__@@__v'}, 'tenantId': ''}})
+            resp = Request.blank('/both/v2.0/tokens', method='POST',
+                                 headers={'Content-Type': 'application/json'},
+                                 body=body).get_response(k)
+            k.keystone_urls = ['http://127.0.0.1:1', 'http://127.0.0.1:2']
+            cached = Request.blank('/both/v2.0/tokens', method='POST',
+                                   headers={'Content-Type': 'application/json'},
+                                   body=body).get_response(k)
+        finally:
+            keystone0_srv.body, keystone1_srv.body = saved
+        self.assertEqual(cached.status_int, 200)
+        self.assertEqual(json.loads(cached.body), json.loads(resp.body))
+        self.assertEqual(k.token_cache.snapshot()['hits'], 1)
+
 
 # test data
 access_token0 = {'access': 
@@ -0,0 +1,149 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import os
+import tempfile
+import eventlet
+from eventlet import listen, spawn, wsgi
+from webob import Request
+import simplejson as json
+from dispatcher.common.middleware.keystone_proxy import filter_factory
+from dispatcher.common.tokencache import TokenCache
+
+
+class NullLogger(object):
+    def write(self, *args):
+        pass
+
+
+class FakeKeystone(object):
+    """ answers the x-auth-token it got and where, or the token it confirmed """
+    def __init__(self, name, delay=0):
+        self.name = name
+        self.delay = delay
+        self.requests = 0
+
+    def __call__(self, env, start_response):
+        self.requests += 1
+        eventlet.sleep(self.delay)
+        if env['REQUEST_METHOD'] == 'POST':
+            token = json.loads(env['wsgi.input'].read())['auth']['token']['id']
+            body = json.dumps({'access': {'token': {'id': token,
+                                                    'expires': '2099-01-01T00:00:00'},
+                                          'user': {'name': 'tester'},
+                                          'serviceCatalog': []}})
+        else:
+            body = json.dumps({'keystone': self.name, 'token': env.get('HTTP_X_AUTH_TOKEN')})
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def one_request_server(sock, count):
+    """ answers one request on each connection, and closes it on the next one """
+    def handle(client):
+        client.recv(65536)
+        body = '{"keystone": "c"}'
+        client.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                       'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        client.recv(65536)
+        client.close()
+    while True:
+        client, addr = sock.accept()
+        count.append(addr)
+        spawn(handle, client)
+
+
+class TestKeystoneProxy(unittest.TestCase):
+    def setUp(self):
+        sock_a = listen(('127.0.0.2', 0))
+        self.port = sock_a.getsockname()[1]
+        sock_b = listen(('127.0.0.3', self.port))
+        self.keystone_a = FakeKeystone('a', delay=0.1)
+        self.keystone_b = FakeKeystone('b', delay=0.1)
+        self.servers = [spawn(wsgi.server, sock_a, self.keystone_a, NullLogger()),
+                        spawn(wsgi.server, sock_b, self.keystone_b, NullLogger())]
+        self.files = []
+        # nothing listens on 127.0.0.1.
+        file_a = self.server_file('http://127.0.0.1:5000\nhttp://127.0.0.2:5000\n')
+        file_b = self.server_file('http://127.0.0.3:5000\n')
+        conf = {'relay_rule': ':%s, both:(a)%s (b)%s' % (file_a, file_a, file_b),
+                'dispatcher_base_url': 'http://127.0.0.1:10000',
+                'region_name': 'RegionOne',
+                'keystone_auth_port': str(self.port)}
+        self.k = filter_factory(conf)(None)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.kill()
+        for path in self.files:
+            os.unlink(path)
+
+    def server_file(self, content):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, content)
+        os.close(fd)
+        self.files.append(path)
+        return path
+
+    def request(self):
+        req = Request.blank('/ks/both/auth/v2.0/tenants',
+                            headers={'X-Auth-Token': 'ta__@@__tb'})
+        return self.k.request_to_ks(req, self.k.loc.swift_of('both'), self.port)
+
+    def test_request_to_ks(self):
+        started = eventlet.hubs.get_hub().clock()
+        succ_resps, fail_resps = self.request()
+        # the sites are requested at once.
+        self.assertTrue(eventlet.hubs.get_hub().clock() - started < 0.19)
+        self.assertEqual([json.loads(r.read()) for r in succ_resps],
+                         [{'keystone': 'a', 'token': 'ta'}, {'keystone': 'b', 'token': 'tb'}])
+        self.assertTrue([r.status_int for r in fail_resps] in ([], [503]))
+
+    def test_ranking_and_pool(self):
+        # unknown nodes are tried first, so the failed node has been tried.
+        self.request()
+        self.request()
+        self.assertEqual(self.k.health.stats['http://127.0.0.1:5000']['errors'], 1)
+        succ_resps, fail_resps = self.request()
+        # the failed node is tried last, on connections kept alive.
+        self.assertEqual(len(succ_resps), 2)
+        self.assertEqual(fail_resps, [])
+        self.assertEqual(self.k.conn_pool.stats()['hits'], 4)
+        self.assertEqual(self.keystone_a.requests, 3)
+
+    def test_merged_token_cache(self):
+        self.k.token_cache = TokenCache()
+        bodies = []
+        for i in range(2):
+            req = Request.blank('/ks/both/auth/v2.0/tokens', method='POST',
+                                headers={'Content-Type': 'application/json'},
+                                body=json.dumps({'auth': {'token': {'id': 'ta__@@__tb'}}}))
+            resp = req.get_response(self.k)
+            self.assertEqual(resp.status_int, 200)
+            bodies.append(json.loads(resp.body))
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertEqual(bodies[0]['access']['token']['id'], 'ta__@@__tb')
+        self.assertEqual(self.keystone_b.requests, 1)
+        self.assertEqual(self.k.token_cache.snapshot()['hits'], 1)
+    def test_retry_closed_connection(self):
+        sock = listen(('127.0.0.4', self.port))
+        accepted = []
+        self.servers.append(spawn(one_request_server, sock, accepted))
+        file_c = self.server_file('http://127.0.0.4:5000\n')
+        k = filter_factory({'relay_rule': ':%s, one:%s' % (file_c, file_c),
+                            'dispatcher_base_url': 'http://127.0.0.1:10000',
+                            'region_name': 'RegionOne',
+                            'keystone_auth_port': str(self.port)})(None)
+        for i in range(2):
+            req = Request.blank('/ks/one/auth/v2.0/tenants', headers={'X-Auth-Token': 'tc'})
+            succ_resps, fail_resps = k.request_to_ks(req, k.loc.swift_of('one'), self.port)
+            self.assertEqual(len(succ_resps), 1)
+            self.assertEqual(fail_resps, [])
+        self.assertEqual(len(accepted), 2)
+        self.assertEqual(k.conn_pool.stats()['hits'], 1)
+        self.assertEqual(k.health.stats['http://127.0.0.4:5000']['errors'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
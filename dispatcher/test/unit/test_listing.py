@@ -0,0 +1,127 @@
+# coding=utf-8
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.listing import iter_plain, iter_json, iter_xml, \
+    merge_listings, cluster_query, serialize_plain, serialize_json, serialize_xml, \
+    Record, record_of
+import json
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_iter_plain(self):
+        body = 'TEST0\nTEST1\nTEST2\n'
+        self.assertEqual([e.name for e in iter_plain(chunked(body, 3))],
+                         ['TEST0', 'TEST1', 'TEST2'])
+        self.assertEqual(list(iter_plain(['TEST0\nTE', 'ST1'])),
+                         [Record('TEST0'), Record('TEST1')])
+
+    def test_iter_json(self):
+        entries = [{'name': 'TEST0', 'count': 1, 'bytes': 256},
+                   {'name': u'TESTé', 'count': 0, 'bytes': 0}]
+        body = json.dumps(entries)
+        for size in (1, 7, len(body)):
+            self.assertEqual([e.as_dict() for e in iter_json(chunked(body, size))], entries)
+        self.assertEqual(list(iter_json([body])),
+                         [Record('TEST0', 1, 256), Record('TEST\xc3\xa9', 0, 0)])
+        self.assertEqual(list(iter_json(['[]'])), [])
+        self.assertEqual(list(iter_json([''])), [])
+        self.assertRaises(ValueError, list, iter_json(['[{"name": "TE']))
+        # a '}' in a name
+        entries.append({'name': 'TEST}, {', 'count': 0, 'bytes': 0})
+        body = json.dumps(entries)
+        for size in (1, 7, len(body)):
+            self.assertEqual([e.as_dict() for e in iter_json(chunked(body, size))], entries)
+
+    def test_iter_xml(self):
+        body = '<?xml version="1.0" encoding="UTF-8"?>\n<account name="AUTH_test">' + \
+            '<container><name>TEST0</name><count>1</count><bytes>256</bytes></container>' + \
+            '<container><name>a&amp;b</name><count>0</count><bytes>0</bytes></container></account>'
+        info = {}
+        entries = list(iter_xml(chunked(body, 5), info))
+        self.assertEqual(entries, [Record('TEST0', 1, 256), Record('a&b', 0, 0)])
+        self.assertEqual(info, {'root': 'account', 'name': 'AUTH_test'})
+
+    def test_merge_listings(self):
+        streams = [('hoge', iter_plain(['TEST0\nTEST2'])),
+                   ('gere', iter_plain(['TEST1\nTEST3'])),
+                   ('hog', iter_plain(['TEST9']))]
+        self.assertEqual([e.name for e in merge_listings(streams)],
+                         ['gere:TEST1', 'gere:TEST3', 'hog:TEST9', 'hoge:TEST0', 'hoge:TEST2'])
+
+    def test_merge_listings_limit(self):
+        streams = [('hoge', iter_plain(['TEST0\nTEST2'])),
+                   ('gere', iter_plain(['TEST1\nTEST3']))]
+        self.assertEqual([e.name for e in merge_listings(streams, limit=3)],
+                         ['gere:TEST1', 'gere:TEST3', 'hoge:TEST0'])
+
+    def test_cluster_query_marker(self):
+        self.assertEqual(cluster_query('hoge', ':', marker='hoge:TEST2'), {'marker': 'TEST2'})
+        self.assertEqual(cluster_query('gere', ':', marker='hoge:TEST2'), None)
+        self.assertEqual(cluster_query('hogf', ':', marker='hoge:TEST2'), {})
+        self.assertEqual(cluster_query('hoge', ':', marker='gere:TEST2'), {})
+
+    def test_cluster_query_end_marker(self):
+        self.assertEqual(cluster_query('hoge', ':', end_marker='hoge:TEST2'), {'end_marker': 'TEST2'})
+        self.assertEqual(cluster_query('gere', ':', end_marker='hoge:TEST2'), {})
+        self.assertEqual(cluster_query('hogf', ':', end_marker='hoge:TEST2'), None)
+        self.assertEqual(cluster_query('hoge', ':', end_marker='hoge:'), None)
+
+    def test_cluster_query_prefix(self):
+        self.assertEqual(cluster_query('hoge', ':', list_prefix='hoge:TE'), {'prefix': 'TE'})
+        self.assertEqual(cluster_query('hoge', ':', list_prefix='ho'), {})
+        self.assertEqual(cluster_query('gere', ':', list_prefix='ho'), None)
+
+    def test_record_of(self):
+        obj = {'name': 'o', 'hash': 'abc', 'bytes': 3, 'content_type': 'text/plain',
+               'last_modified': '2012-01-01T00:00:00.000000'}
+        record = record_of(obj)
+        self.assertEqual((record.name, record.count, record.bytes, record.subdir),
+                         ('o', None, 3, False))
+        self.assertEqual(record.as_dict(), obj)
+        self.assertEqual(record_of({'subdir': 'dir/'}), Record('dir/', subdir=True))
+        self.assertEqual(record_of({'subdir': 'dir/', 'name': 'dir/'}).as_dict(),
+                         {'subdir': 'dir/'})
+
+    def test_serialize(self):
+        entries = [Record('a:TEST0', 1, 256), Record('b:TEST1', 0, 0)]
+        self.assertEqual(''.join(serialize_plain(entries)), 'a:TEST0\nb:TEST1')
+        self.assertEqual(json.loads(''.join(serialize_json(entries))),
+                         [e.as_dict() for e in entries])
+        self.assertEqual(''.join(serialize_xml(entries, {'root': 'account', 'name': 'AUTH_test'})),
+                         '<?xml version="1.0" encoding="UTF-8"?><account name="AUTH_test">' + \
+                             '<container><name>a:TEST0</name><count>1</count><bytes>256</bytes></container>' + \
+                             '<container><name>b:TEST1</name><count>0</count><bytes>0</bytes></container></account>')
+
+    def test_serialize_objects(self):
+        entries = [Record('a:\xc3\xa9', None, 3, extra=(('hash', 'abc'), ('content_type', 'a&b'))),
+                   Record('a:dir/', subdir=True)]
+        self.assertEqual(json.loads(''.join(serialize_json(entries))),
+                         [{'name': u'a:\xe9', 'hash': 'abc', 'bytes': 3, 'content_type': 'a&b'},
+                          {'subdir': 'a:dir/'}])
+        self.assertEqual(''.join(serialize_xml(entries, {'root': 'container', 'name': 'c'})),
+                         '<?xml version="1.0" encoding="UTF-8"?><container name="c">' + \
+                             '<object><name>a:\xc3\xa9</name><hash>abc</hash><bytes>3</bytes>' + \
+                             '<content_type>a&amp;b</content_type></object>' + \
+                             '<subdir name="a:dir/"><name>a:dir/</name></subdir></container>')
+
+    def test_serialize_batched(self):
+        entries = [Record('%08d' % i, 1, 1) for i in range(20000)]
+        chunks = list(serialize_json(entries))
+        self.assertEqual(len(chunks), 22)
+        self.assertEqual(len(json.loads(''.join(chunks))), 20000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.lru import LRU
+
+
+class TestLRU(unittest.TestCase):
+    def setUp(self):
+        self.lru = LRU()
+        for key in 'abc':
+            self.lru[key] = key.upper()
+
+    def tearDown(self):
+        pass
+
+    def test_order(self):
+        self.assertEqual(self.lru.keys(), ['a', 'b', 'c'])
+        self.assertEqual(self.lru.oldest(), 'a')
+        self.assertEqual(len(self.lru), 3)
+
+    def test_get(self):
+        self.assertEqual(self.lru.get('a'), 'A')
+        self.assertEqual(self.lru.keys(), ['b', 'c', 'a'])
+        self.assertEqual(self.lru['b'], 'B')
+        self.assertEqual(self.lru.keys(), ['b', 'c', 'a'])
+        self.assertEqual(self.lru.get('x', 'none'), 'none')
+
+    def test_set(self):
+        self.lru['b'] = 'BB'
+        self.assertEqual(self.lru.keys(), ['a', 'c', 'b'])
+        self.assertEqual(self.lru['b'], 'BB')
+
+    def test_pop(self):
+        self.assertEqual(self.lru.pop('b'), 'B')
+        self.assertFalse('b' in self.lru)
+        self.assertEqual(self.lru.pop('b'), None)
+        self.assertEqual(self.lru.keys(), ['a', 'c'])
+
+    def test_popitem(self):
+        self.assertEqual(self.lru.popitem(), ('a', 'A'))
+        self.assertEqual(self.lru.popitem(), ('b', 'B'))
+        self.assertEqual(self.lru.popitem(), ('c', 'C'))
+        self.assertEqual(self.lru.oldest(), None)
+        self.assertRaises(KeyError, self.lru.popitem)
+
+
+if __name__ == '__main__':
+    unittest.main()
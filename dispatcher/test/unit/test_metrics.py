@@ -0,0 +1,57 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from dispatcher.common.metrics import Metrics, status_class, WIDTH_BUCKETS
+from eventlet.green import socket
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.labels = (('location', 'both'), ('backend', 'http://127.0.0.1:8080'))
+
+    def tearDown(self):
+        pass
+
+    def test_counters(self):
+        self.metrics.incr('requests', self.labels)
+        self.metrics.incr('requests', self.labels)
+        self.metrics.incr('relay_bytes', self.labels, 100)
+        self.metrics.incr('fanout_missed')
+        counters = self.metrics.snapshot()['counters']
+        self.assertEqual(counters['requests']['location=both,backend=http://127.0.0.1:8080'], 2)
+        self.assertEqual(counters['relay_bytes']['location=both,backend=http://127.0.0.1:8080'], 100)
+        self.assertEqual(counters['fanout_missed'][''], 1)
+
+    def test_histograms(self):
+        for value in (0.001, 0.02, 0.02, 30):
+            self.metrics.observe('relay_total', value, self.labels)
+        self.metrics.observe('fanout_width', 3, buckets=WIDTH_BUCKETS)
+        histograms = self.metrics.snapshot()['histograms']
+        hist = histograms['relay_total']['location=both,backend=http://127.0.0.1:8080']
+        self.assertEqual(hist['count'], 4)
+        self.assertAlmostEqual(hist['sum'], 30.041)
+        self.assertEqual(hist['buckets']['0.005'], 1)
+        self.assertEqual(hist['buckets']['0.025'], 2)
+        self.assertEqual(hist['buckets']['+Inf'], 1)
+        self.assertEqual(histograms['fanout_width']['']['buckets']['3'], 1)
+
+    def test_statsd(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        metrics = Metrics(statsd_host='127.0.0.1', statsd_port=sock.getsockname()[1])
+        metrics.incr('requests', self.labels)
+        self.assertEqual(sock.recv(1024),
+                         'dispatcher.requests.both.http___127_0_0_1_8080:1|c')
+        metrics.observe('relay_total', 0.25, (('location', ''),))
+        self.assertEqual(sock.recv(1024), 'dispatcher.relay_total.default:250|ms')
+        sock.close()
+
+    def test_status_class(self):
+        self.assertEqual(status_class(200), '2xx')
+        self.assertEqual(status_class('503'), '5xx')
+
+
+if __name__ == '__main__':
+    unittest.main()
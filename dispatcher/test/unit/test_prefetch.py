@@ -0,0 +1,98 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import eventlet
+from dispatcher.common.prefetch import PrefetchIter, plan_segments
+
+
+class TestPlanSegments(unittest.TestCase):
+    def setUp(self):
+        self.segments = [('s0', 10), ('s1', 10), ('empty', 0), ('s2', 5)]
+
+    def tearDown(self):
+        pass
+
+    def test_whole(self):
+        self.assertEqual(plan_segments(self.segments, 0, 25),
+                         [('s0', 0, 9, 10), ('s1', 0, 9, 10), ('s2', 0, 4, 5)])
+
+    def test_range(self):
+        self.assertEqual(plan_segments(self.segments, 5, 22),
+                         [('s0', 5, 9, 10), ('s1', 0, 9, 10), ('s2', 0, 1, 5)])
+        self.assertEqual(plan_segments(self.segments, 12, 15), [('s1', 2, 4, 10)])
+        self.assertEqual(plan_segments(self.segments, 20, 25), [('s2', 0, 4, 5)])
+
+    def test_nothing(self):
+        self.assertEqual(plan_segments([], 0, 0), [])
+
+
+class TestPrefetchIter(unittest.TestCase):
+    def setUp(self):
+        self.data = dict([('s%d' % i, ''.join([chr(ord('a') + i)] * 10)) for i in range(6)])
+        self.segments = [('s%d' % i, 10) for i in range(6)]
+        self.running = 0
+        self.max_running = 0
+        self.fetched = []
+
+    def tearDown(self):
+        pass
+
+    def fetch(self, fail=None):
+        def func(name, first, last, size):
+            self.fetched.append((name, first, last))
+            body = self.data[name][first:last + 1]
+
+            def body_iter():
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+                try:
+                    for i in range(0, len(body), 3):
+                        eventlet.sleep(0.001)
+                        if (name, first) == fail and i > 0:
+                            raise IOError('cut')
+                        yield body[i:i + 3]
+                finally:
+                    self.running -= 1
+            return body_iter()
+        return func
+
+    def test_in_order(self):
+        body = ''.join(PrefetchIter(plan_segments(self.segments, 0, 60), self.fetch(),
+                                    count=3, queue_size=1))
+        self.assertEqual(body, ''.join([self.data['s%d' % i] for i in range(6)]))
+        self.assertEqual(self.max_running, 3)
+
+    def test_range(self):
+        body = ''.join(PrefetchIter(plan_segments(self.segments, 15, 32), self.fetch()))
+        self.assertEqual(body, 'bbbbbccccccccccdd')
+
+    def test_refetch(self):
+        body = ''.join(PrefetchIter(plan_segments(self.segments, 0, 30),
+                                    self.fetch(fail=('s1', 0))))
+        self.assertEqual(body, 'a' * 10 + 'b' * 10 + 'c' * 10)
+        self.assertTrue(('s1', 3, 9) in self.fetched)
+
+    def test_fail(self):
+        def broken(name, first, last, size):
+            raise IOError('segment %s: 503' % name)
+        it = PrefetchIter(plan_segments(self.segments, 0, 60), broken)
+        self.assertRaises(IOError, it.next)
+        self.assertTrue(it.closed)
+
+    def test_short_segment(self):
+        self.data['s0'] = 'a' * 5
+        it = PrefetchIter(plan_segments(self.segments, 0, 60), self.fetch())
+        self.assertRaises(IOError, list, it)
+
+    def test_close(self):
+        it = PrefetchIter(plan_segments(self.segments, 0, 60), self.fetch(), count=2)
+        self.assertEqual(it.next(), 'aaa')
+        it.close()
+        eventlet.sleep(0.01)
+        self.assertEqual(self.running, 0)
+        self.assertRaises(StopIteration, it.next)
+
+
+if __name__ == '__main__':
+    unittest.main()
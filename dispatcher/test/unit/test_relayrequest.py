@@ -5,6 +5,7 @@ try:
 except (ImportError):
     import unittest
 from dispatcher.server import RelayRequest as rr
+from dispatcher.common.connpool import ConnectionPool
 from eventlet import sleep, spawn, TimeoutError, util, wsgi, listen
 from swift.common.utils import normalize_timestamp, NullLogger
 from webob import Request, Response
@@ -49,6 +50,32 @@ class DummySrv(object):
         return ''
 
 
+def raw_server(sock, received):
+    """ answers each request with an empty 200, and keeps what it received """
+    def handle(client):
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            received.append(data)
+            client.sendall('HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        client.close()
+    while True:
+        client, addr = sock.accept()
+        spawn(handle, client)
+
+
+def silent_server(sock):
+    """ reads requests and never answers """
+    def handle(client):
+        while client.recv(65536):
+            pass
+        client.close()
+    while True:
+        client, addr = sock.accept()
+        spawn(handle, client)
+
+
 class TestController(unittest.TestCase):
     def setUp(self):
         pass
@@ -211,6 +238,38 @@ class TestController(unittest.TestCase):
         self.assertFalse(r._proxy_request_check('/v1.0/AUTH_test/TEST0/test0.txt'))
 
 
+    def test_pooled_host_header(self):
+        sock = listen(('127.0.0.1', 0))
+        received = []
+        server = spawn(raw_server, sock, received)
+        try:
+            url = 'http://127.0.0.1:%d/v1.0/AUTH_test' % sock.getsockname()[1]
+            req = Request.blank(url, headers={'Accept-Encoding': 'gzip'})
+            relay = rr({}, req, url, pool=ConnectionPool())
+            resp = relay()
+            resp.read()
+            relay.release(resp)
+        finally:
+            server.kill()
+        lines = [l.lower() for l in received[0].split('\r\n')]
+        self.assertEqual(len([l for l in lines if l.startswith('host:')]), 1)
+        self.assertEqual(len([l for l in lines if l.startswith('accept-encoding:')]), 1)
+
+    def test_killed_relay_frees_slot(self):
+        sock = listen(('127.0.0.1', 0))
+        server = spawn(silent_server, sock)
+        try:
+            url = 'http://127.0.0.1:%d/v1.0/AUTH_test' % sock.getsockname()[1]
+            pool = ConnectionPool(max_per_host=1)
+            relay = spawn(rr({}, Request.blank(url), url, pool=pool))
+            sleep(0.1)
+            self.assertEqual(pool.semaphores.values()[0].counter, 0)
+            relay.kill()
+            self.assertEqual(pool.semaphores.values()[0].counter, 1)
+            self.assertEqual(pool.stats()['discarded'], 1)
+        finally:
+            server.kill()
+
     def test_over_max_size(self):
         conf = {}
         req = Request.blank('http://127.0.0.1:10000/v1.0/AUTH_test',
@@ -0,0 +1,122 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import time
+from webob import Request, Response
+from dispatcher.common.respcache import ResponseCache, split_path
+
+CLUSTER = ('http://127.0.0.1:8080',)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_bytes=1000, max_entry_size=100, ttl=10)
+
+    def tearDown(self):
+        pass
+
+    def key(self, path, method='GET', headers=None):
+        req = Request.blank(path, environ={'REQUEST_METHOD': method}, headers=headers or {})
+        return self.cache.key(req, CLUSTER, [p for p in path.split('?')[0].split('/') if p],
+                              req.query_string)
+
+    def resp(self, body='abc', status=200, etag='e1'):
+        resp = Response(body=body, status=status)
+        if etag:
+            resp.etag = etag
+        return resp
+
+    def test_key(self):
+        token = {'x-auth-token': 't'}
+        self.assertTrue(self.key('/v1.0/AUTH_a/c/o', headers=token))
+        self.assertTrue(self.key('/v1.0/AUTH_a/c?format=json'))
+        self.assertEqual(self.key('/v1.0/AUTH_a/c', headers=token), None)
+        self.assertEqual(self.key('/v1.0/AUTH_a', headers=token), None)
+        self.assertEqual(self.key('/v1.0/AUTH_a/c/o', method='HEAD'), None)
+        self.assertEqual(self.key('/v1.0/AUTH_a/c/o', headers={'range': 'bytes=0-1'}), None)
+        self.assertNotEqual(self.key('/v1.0/AUTH_a/c/o', headers=token),
+                            self.key('/v1.0/AUTH_a/c/o', headers={'x-auth-token': 'u'}))
+
+    def test_store_and_hit(self):
+        key = self.key('/v1.0/AUTH_a/c/o')
+        self.assertEqual(self.cache.get(key), None)
+        resp = self.cache.store(key, self.resp())
+        self.assertEqual(resp.body, 'abc')
+        entry = self.cache.get(key)
+        self.assertTrue(entry.fresh())
+        hit = self.cache.hit(entry)
+        self.assertEqual((hit.status_int, hit.body, hit.etag, hit.content_length),
+                         (200, 'abc', 'e1', 3))
+        snapshot = self.cache.snapshot()
+        self.assertEqual((snapshot['hits'], snapshot['misses'], snapshot['entries']), (1, 1, 1))
+        self.assertEqual(snapshot['hit_ratio'], 0.5)
+
+    def test_not_stored(self):
+        key = self.key('/v1.0/AUTH_a/c/o')
+        for resp in (self.resp(status=404), self.resp(body='x' * 101)):
+            self.assertTrue(self.cache.store(key, resp) is resp)
+        manifest = self.resp(body='')
+        manifest.headers['x-object-manifest'] = 'c_segments/o'
+        self.cache.store(key, manifest)
+        self.assertEqual(len(self.cache.entries), 0)
+
+    def test_error_drops_entry(self):
+        key = self.key('/v1.0/AUTH_a/c/o')
+        self.cache.store(key, self.resp())
+        self.cache.store(key, self.resp(status=404))
+        self.assertEqual(len(self.cache.entries), 0)
+        self.assertEqual(self.cache.bytes, 0)
+
+    def test_revalidate(self):
+        self.cache.ttl = 0
+        key = self.key('/v1.0/AUTH_a/c/o')
+        self.cache.store(key, self.resp())
+        entry = self.cache.get(key)
+        self.assertFalse(entry.fresh())
+        self.cache.ttl = 10
+        resp = self.cache.revalidated(key, entry)
+        self.assertEqual(resp.body, 'abc')
+        self.assertTrue(entry.fresh())
+        self.assertEqual(self.cache.snapshot()['revalidated'], 1)
+
+    def test_lru_eviction(self):
+        keys = [self.key('/v1.0/AUTH_a/c/o%d' % i) for i in range(20)]
+        for key in keys[:5]:
+            self.cache.store(key, self.resp(body='x' * 100))
+        size = self.cache.entries[keys[0]].size
+        count = 1000 / size
+        for key in keys[5:count]:
+            self.cache.store(key, self.resp(body='x' * 100))
+        # keys[0] is used, so keys[1] is the least recently used.
+        self.cache.get(keys[0])
+        self.cache.store(keys[count], self.resp(body='x' * 100))
+        self.assertTrue(keys[0] in self.cache.entries)
+        self.assertFalse(keys[1] in self.cache.entries)
+        self.assertTrue(self.cache.bytes <= 1000)
+        self.assertEqual(self.cache.snapshot()['evictions'], 1)
+
+    def test_invalidate(self):
+        obj = self.key('/v1.0/AUTH_a/c/o', headers={'x-auth-token': 't'})
+        other = self.key('/v1.0/AUTH_a/c/p', headers={'x-auth-token': 't'})
+        listing = self.key('/v1.0/AUTH_a/c?format=json')
+        other_cont = self.key('/v1.0/AUTH_a/c2/o', headers={'x-auth-token': 't'})
+        for key in (obj, other, listing, other_cont):
+            self.cache.store(key, self.resp())
+        self.cache.invalidate(CLUSTER, ['v1.0', 'AUTH_a', 'c', 'o'])
+        self.assertEqual(sorted(self.cache.entries.keys()), sorted([other, other_cont]))
+        self.cache.invalidate(('http://127.0.0.1:18080',), ['v1.0', 'AUTH_a', 'c2'])
+        self.assertTrue(other_cont in self.cache.entries)
+        self.cache.invalidate(CLUSTER, ['v1.0', 'AUTH_a', 'c'])
+        self.assertEqual(self.cache.entries.keys(), [other_cont])
+        self.assertEqual(self.cache.snapshot()['invalidations'], 3)
+
+    def test_split_path(self):
+        self.assertEqual(split_path(['v1.0', 'AUTH_a', 'c', 'd', 'o']),
+                         ('/v1.0/AUTH_a/c', '/v1.0/AUTH_a/c/d/o'))
+        self.assertEqual(split_path(['v1.0', 'AUTH_a', 'c']), ('/v1.0/AUTH_a/c', None))
+        self.assertEqual(split_path(['v1.0', 'AUTH_a']), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+from StringIO import StringIO
+import eventlet
+from webob.exc import HTTPCreated, HTTPServiceUnavailable
+from dispatcher.common import segment
+from dispatcher.common.segment import Segmenter
+
+
+class TestSegmenter(unittest.TestCase):
+    def setUp(self):
+        self.segmenter = Segmenter(seg_size=10, concurrency=2, queue_size=2,
+                                   chunk_size=4, timeout=0.5)
+        self.segments = {}
+        self.running = 0
+        self.max_running = 0
+
+    def tearDown(self):
+        pass
+
+    def upload(self, fail=None):
+        def func(seg, size, seg_input):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                body = ''
+                while True:
+                    chunk = seg_input.read(4)
+                    if not chunk:
+                        break
+                    body += chunk
+                    eventlet.sleep(0.001)
+                self.segments[seg] = (size, body)
+                if seg == fail:
+                    return HTTPServiceUnavailable()
+                return HTTPCreated()
+            finally:
+                self.running -= 1
+        return func
+
+    def test_count(self):
+        self.assertEqual(self.segmenter.count(0), 1)
+        self.assertEqual(self.segmenter.count(10), 1)
+        self.assertEqual(self.segmenter.count(11), 2)
+        self.assertEqual(self.segmenter.count(30), 3)
+
+    def test_split(self):
+        body = ''.join([chr(ord('a') + i % 26) for i in range(35)])
+        resps = self.segmenter.run(StringIO(body).read, len(body), self.upload())
+        self.assertEqual([r.status_int for r in resps], [201] * 4)
+        self.assertEqual([self.segments[i][0] for i in range(4)], [10, 10, 10, 5])
+        self.assertEqual(''.join([self.segments[i][1] for i in range(4)]), body)
+        self.assertEqual(self.max_running, 2)
+
+    def test_failed_segment(self):
+        body = 'x' * 50
+        resps = self.segmenter.run(StringIO(body).read, len(body), self.upload(fail=1))
+        self.assertEqual(resps[-1].status_int, 503)
+        self.assertEqual([r.status_int for r in resps[:-1]], [201])
+        self.assertTrue(len(self.segments) < 5)
+
+    def test_short_body(self):
+        resps = self.segmenter.run(StringIO('x' * 15).read, 25, self.upload())
+        self.assertEqual([r.status_int for r in resps], [201, 408])
+
+    def test_stalled_upload(self):
+        def stalled(seg, size, seg_input):
+            eventlet.sleep(10)
+            return HTTPCreated()
+        resps = self.segmenter.run(StringIO('x' * 20).read, 20, stalled)
+        self.assertEqual(resps[-1].status_int, 504)
+
+    def test_upload_died_while_feeding(self):
+        def broken(seg, size, seg_input):
+            seg_input.read(4)
+            eventlet.sleep(0.01)
+            return HTTPServiceUnavailable()
+        segmenter = Segmenter(seg_size=100, queue_size=1, chunk_size=4, timeout=5)
+        orig_interval, segment.PUT_INTERVAL = segment.PUT_INTERVAL, 0.01
+        try:
+            started = eventlet.hubs.get_hub().clock()
+            resps = segmenter.run(StringIO('x' * 100).read, 100, broken)
+        finally:
+            segment.PUT_INTERVAL = orig_interval
+        # the error of the upload, without waiting for the timeout.
+        self.assertEqual([r.status_int for r in resps], [503])
+        self.assertTrue(eventlet.hubs.get_hub().clock() - started < 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
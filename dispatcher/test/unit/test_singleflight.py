@@ -0,0 +1,121 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import eventlet
+from webob import Response
+from webob.exc import HTTPServiceUnavailable
+from dispatcher.common.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight(queue_size=2, timeout=0.1)
+        self.calls = 0
+
+    def tearDown(self):
+        pass
+
+    def slow(self, resp_func, delay=0.01):
+        def func():
+            self.calls += 1
+            eventlet.sleep(delay)
+            return resp_func()
+        return func
+
+    def run_concurrently(self, func, count=3, key='k'):
+        pool = eventlet.GreenPool()
+        return list(pool.imap(lambda i: self.single_flight.do(key, func), range(count)))
+
+    def test_body(self):
+        resps = self.run_concurrently(self.slow(lambda: Response(body='abc')))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([r.body for r in resps], ['abc'] * 3)
+        self.assertEqual([r.content_length for r in resps], [3] * 3)
+        self.assertEqual(len(set([id(r) for r in resps])), 3)
+        self.assertEqual(self.single_flight.snapshot(),
+                         {'leaders': 1, 'coalesced': 2, 'running': 0})
+
+    def test_alone(self):
+        resp = Response(body='abc')
+        self.assertTrue(self.single_flight.do('k', lambda: resp) is resp)
+        self.assertTrue(self.single_flight.do('k', lambda: resp) is resp)
+        self.assertEqual(self.single_flight.snapshot()['leaders'], 2)
+
+    def test_streamed(self):
+        chunks = ['x' * 10] * 5
+
+        def resp_func():
+            resp = Response()
+            resp.app_iter = iter(chunks)
+            resp.content_length = 50
+            return resp
+        resps = self.run_concurrently(self.slow(resp_func))
+        self.assertEqual(self.calls, 1)
+        pool = eventlet.GreenPool()
+        bodies = list(pool.imap(lambda r: ''.join(r.app_iter), resps))
+        self.assertEqual(bodies, ['x' * 50] * 3)
+        self.assertEqual([r.content_length for r in resps], [50] * 3)
+
+    def test_slow_subscriber_dropped(self):
+        def resp_func():
+            resp = Response()
+            resp.app_iter = iter(['x'] * 10)
+            return resp
+        fast, slow = self.run_concurrently(self.slow(resp_func), count=2)
+        self.assertEqual(''.join(fast.app_iter), 'x' * 10)
+        self.assertRaises(IOError, lambda: ''.join(slow.app_iter))
+
+    def test_slow_subscriber_does_not_stall(self):
+        def resp_func():
+            resp = Response()
+            resp.app_iter = iter(['x'] * 20)
+            return resp
+        fast, slow = self.run_concurrently(self.slow(resp_func), count=2)
+
+        def read_slowly():
+            try:
+                for chunk in slow.app_iter:
+                    eventlet.sleep(0.05)
+            except IOError:
+                return 'dropped'
+
+        reader = eventlet.spawn(read_slowly)
+        started = eventlet.hubs.get_hub().clock()
+        self.assertEqual(''.join(fast.app_iter), 'x' * 20)
+        # the slow one takes a chunk within timeout, but is not waited for.
+        self.assertTrue(eventlet.hubs.get_hub().clock() - started < 0.05)
+        self.assertEqual(reader.wait(), 'dropped')
+
+    def test_error(self):
+        resps = self.run_concurrently(self.slow(HTTPServiceUnavailable))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([r.status_int for r in resps], [503] * 3)
+        self.assertTrue(all([isinstance(r, HTTPServiceUnavailable) for r in resps]))
+
+    def test_exception(self):
+        def resp_func():
+            raise ValueError('boom')
+        pool = eventlet.GreenPool()
+        results = []
+
+        def call(i):
+            try:
+                self.single_flight.do('k', self.slow(resp_func))
+            except ValueError, err:
+                results.append(str(err))
+        for i in range(3):
+            pool.spawn(call, i)
+        pool.waitall()
+        self.assertEqual(results, ['boom'] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_keys(self):
+        pool = eventlet.GreenPool()
+        func = self.slow(lambda: Response(body='abc'))
+        list(pool.imap(lambda key: self.single_flight.do(key, func), ['a', 'b', 'a']))
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import os
+import time
+from dispatcher.common.tokencache import TokenCache, parse_expires, earliest_expires, \
+    token_cache_from_conf
+
+
+class FakeMemcache(object):
+    def __init__(self):
+        self.store = {}
+        self.timeouts = {}
+        self.down = False
+
+    def get(self, key):
+        if self.down:
+            raise IOError('down')
+        return self.store.get(key)
+
+    def set(self, key, value, timeout=0):
+        if self.down:
+            raise IOError('down')
+        self.store[key] = value
+        self.timeouts[key] = timeout
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.memcache = FakeMemcache()
+        self.cache = TokenCache(ttl=300, max_entries=2, memcache=self.memcache)
+
+    def tearDown(self):
+        pass
+
+    def test_parse_expires(self):
+        self.assertEqual(parse_expires('2012-01-09T19:11:27.058939'),
+                         time.mktime((2012, 1, 9, 19, 11, 27, 0, 0, -1)))
+        self.assertEqual(parse_expires('2012-01-09T19:11:27Z'), 1326136287)
+        self.assertEqual(parse_expires('tomorrow'), None)
+        self.assertEqual(parse_expires(None), None)
+
+    def test_parse_expires_local_time(self):
+        # keystone writes its local time without a zone.
+        orig_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'JST-9'
+        time.tzset()
+        try:
+            self.assertEqual(parse_expires('2012-01-09T19:11:27'), 1326136287 - 9 * 3600)
+            self.assertEqual(parse_expires('2012-01-09T19:11:27Z'), 1326136287)
+        finally:
+            if orig_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = orig_tz
+            time.tzset()
+
+    def test_earliest_expires(self):
+        accesses = [{'access': {'token': {'expires': '2012-01-09T19:11:27'}}},
+                    {'access': {'token': {'expires': '2012-01-09T18:11:27'}}}]
+        self.assertEqual(earliest_expires(accesses),
+                         time.mktime((2012, 1, 9, 18, 11, 27, 0, 0, -1)))
+        accesses.append({'access': {'token': {}}})
+        self.assertEqual(earliest_expires(accesses), None)
+
+    def test_get_set(self):
+        key = self.cache.key('t0__@@__t1', 'tenant')
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.set(key, 'access')
+        self.assertEqual(self.cache.get(key), 'access')
+        self.assertEqual(self.memcache.timeouts[key], 301)
+        self.assertEqual(self.cache.snapshot()['hits'], 1)
+
+    def test_expires(self):
+        self.cache.set('a', 'access', time.time() + 10)
+        self.assertTrue(self.cache.entries['a'][1] <= time.time() + 10)
+        self.assertTrue(self.memcache.timeouts['a'] <= 11)
+        # an expired token is not cached.
+        self.cache.set('b', 'access', time.time() - 1)
+        self.assertEqual(self.cache.get('b'), None)
+        self.cache.entries['a'] = ('access', time.time() - 1)
+        self.memcache.store['a'][1] = time.time() - 1
+        self.assertEqual(self.cache.get('a'), None)
+
+    def test_memcache_tier(self):
+        self.cache.set('a', 'access')
+        other = TokenCache(memcache=self.memcache)
+        self.assertEqual(other.get('a'), 'access')
+        self.assertEqual(other.snapshot()['memcache_hits'], 1)
+        self.assertEqual(other.get('a'), 'access')
+        self.assertEqual(other.snapshot()['hits'], 1)
+        self.memcache.down = True
+        self.cache.set('b', 'access')
+        self.assertEqual(other.get('b'), None)
+
+    def test_lru(self):
+        self.cache.memcache = None
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        self.assertEqual(self.cache.entries.keys(), ['b', 'c'])
+
+    def test_from_conf(self):
+        self.assertEqual(token_cache_from_conf({}), None)
+        cache = token_cache_from_conf({'merged_token_cache': 'yes',
+                                       'merged_token_cache_ttl': '60'})
+        self.assertEqual((cache.ttl, cache.memcache), (60, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
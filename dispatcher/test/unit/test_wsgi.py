@@ -0,0 +1,129 @@
+try:
+    import unittest2 as unittest
+except (ImportError):
+    import unittest
+import os
+import signal
+import eventlet
+from eventlet.green import socket
+from dispatcher.common import wsgi
+from dispatcher.common.wsgi import Listener, Master, MAX_BACKOFF
+
+
+class FakeLogger(object):
+    def __init__(self):
+        self.lines = []
+
+    def notice(self, msg):
+        self.lines.append(msg)
+
+    error = notice
+
+
+class FakeClock(object):
+    """ time.time() and time.sleep() of the master, without waiting """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestListener(unittest.TestCase):
+    def setUp(self):
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.stop_r, self.stop_w = os.pipe()
+        self.listener = Listener(self.sock, self.stop_r)
+
+    def tearDown(self):
+        self.sock.close()
+        os.close(self.stop_r)
+        os.close(self.stop_w)
+
+    def test_accept(self):
+        client = socket.create_connection(self.sock.getsockname())
+        conn, addr = self.listener.accept()
+        client.sendall('ping')
+        self.assertEqual(conn.recv(4), 'ping')
+        self.assertEqual(addr, client.getsockname())
+        self.assertEqual(self.listener.getsockname(), self.sock.getsockname())
+        conn.close()
+        client.close()
+
+    def test_stop(self):
+        acceptor = eventlet.spawn(self.listener.accept)
+        eventlet.sleep(0)
+        self.assertFalse(self.listener.stopped.ready())
+        os.write(self.stop_w, 'x')
+        self.listener.stopped.wait()
+        # blocked for good, even when a client connects.
+        client = socket.create_connection(self.sock.getsockname())
+        eventlet.sleep(0.05)
+        self.assertFalse(acceptor.dead)
+        acceptor.kill()
+        client.close()
+
+
+class TestMaster(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.orig_time, wsgi.time = wsgi.time, self.clock
+        self.orig_wait = os.wait
+        self.orig_term = signal.getsignal(signal.SIGTERM)
+        self.orig_hup = signal.getsignal(signal.SIGHUP)
+        self.master = Master(eventlet.listen(('127.0.0.1', 0)), 'dispatcher.conf',
+                             'dispatcher', 'dispatcher', FakeLogger())
+        self.pids = []
+        self.master.spawn = self.spawn
+
+    def tearDown(self):
+        wsgi.time = self.orig_time
+        os.wait = self.orig_wait
+        signal.signal(signal.SIGTERM, self.orig_term)
+        signal.signal(signal.SIGHUP, self.orig_hup)
+        for fd in self.master.workers.values():
+            os.close(fd)
+
+    def spawn(self):
+        """ a worker which is not forked """
+        stop_r, stop_w = os.pipe()
+        os.close(stop_r)
+        pid = 10000 + len(self.pids)
+        self.pids.append(pid)
+        self.master.workers[pid] = stop_w
+        self.master.started[pid] = self.clock.time()
+
+    def run_until(self, spawns, uptime):
+        """ each worker exits uptime seconds after its start """
+        def wait():
+            if len(self.pids) >= spawns:
+                self.master.running = False
+                raise OSError(wsgi.errno.EINTR, 'interrupted')
+            self.clock.now += uptime
+            return self.pids[-1], 256
+        os.wait = wait
+        self.master.run(1)
+
+    def test_backoff(self):
+        # the app fails to load, the workers exit at once.
+        self.run_until(10, 0)
+        self.assertEqual(self.clock.sleeps, [1, 2, 4, 8, 16, 32, MAX_BACKOFF, MAX_BACKOFF,
+                                             MAX_BACKOFF])
+        self.assertEqual(len(self.master.started), 1)
+
+    def test_no_backoff(self):
+        self.run_until(2, 0)
+        self.master.running = True
+        self.run_until(5, 3600)
+        # a worker which served for a while is restarted at once.
+        self.assertEqual(self.clock.sleeps, [1])
+        self.assertEqual(self.master.backoff, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
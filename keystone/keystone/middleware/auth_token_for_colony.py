@@ -59,11 +59,21 @@ keystone_url = http://172.30.112.168:5000
 region_name = RegionOne
 admin_role = admin
 memcache_expire = 86400
+# validated tokens are cached in the process (token_cache_size entries, 0 to
+# disable) and in memcache until they expire, memcache_expire seconds at most.
+# rejected tokens are cached for negative_cache_ttl seconds.
+token_cache_size = 10000
+negative_cache_ttl = 10
+# the write acls of containers are read from swift's container info in
+# memcache, and the info got by HEAD is cached container_acl_cache_ttl
+# seconds (0 to HEAD the container every time).
+container_acl_cache_ttl = 60
 
 """
 
 import eventlet
 from eventlet import wsgi
+from eventlet.event import Event
 import base64
 from hashlib import md5, sha1
 import hmac
@@ -71,7 +81,10 @@ import httplib
 import json
 import os
 from paste.deploy import loadapp
-from time import time
+from heapq import nsmallest
+from itertools import count
+from time import mktime, strptime, time
+from calendar import timegm
 from urllib import unquote
 from urlparse import urlparse
 from webob.exc import HTTPUnauthorized, HTTPUseProxy, HTTPForbidden, HTTPUnauthorized, HTTPNotFound
@@ -86,6 +99,67 @@ from swift.proxy.server import get_container_memcache_key
 PROTOCOL_NAME = "Token Authentication"
 
 
+def parse_expires(expires):
+    """
+    add by colony.
+    the epoch time of a token's 'expires', read as the dispatcher's
+    tokencache.parse_expires reads it, so that both cache a token for
+    the same time. the middleware can't import the dispatcher.
+    a naive 'expires' is keystone's local time, a trailing 'Z' is UTC.
+    :return: None if it can't be parsed.
+    """
+    try:
+        parsed = strptime(expires.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+    if expires.endswith('Z'):
+        return timegm(parsed)
+    return mktime(parsed)
+
+
+class LocalCache(object):
+    """
+    an in-process cache whose entries expire at their own time.
+    when it is full, the expired entries and an eighth of the least
+    recently used ones are dropped.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.ticks = count()
+
+    def get(self, key):
+        """ :return: (expires, value) of key, or None """
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        if entry[0] <= time():
+            del self.entries[key]
+            return None
+        entry[2] = self.ticks.next()
+        return entry[0], entry[1]
+
+    def set(self, key, value, expires):
+        if self.max_entries <= 0:
+            return
+        if key not in self.entries and len(self.entries) >= self.max_entries:
+            self._shrink()
+        self.entries[key] = [expires, value, self.ticks.next()]
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def _shrink(self):
+        now = time()
+        for key in [k for k, e in self.entries.iteritems() if e[0] <= now]:
+            del self.entries[key]
+        if len(self.entries) >= self.max_entries:
+            for key, entry in nsmallest(max(self.max_entries // 8, 1),
+                                        self.entries.iteritems(), key=lambda i: i[1][2]):
+                del self.entries[key]
+
+
 class AuthProtocol(object):
     """Auth Middleware that handles authenticating client calls"""
 
@@ -106,6 +180,11 @@ class AuthProtocol(object):
         # for ACL setting for containers of an account which others possesses.
         self.across_account = conf.get('across_account', 'yes').lower() in TRUE_VALUES
         self.memcache_expire = float(conf.get('memcache_expire', 86400))
+        self.negative_cache_ttl = float(conf.get('negative_cache_ttl', 10))
+        self.token_cache = LocalCache(int(conf.get('token_cache_size', 10000)))
+        # auth token -> Event of its validation in progress
+        self.validating = {}
+        self.container_acl_cache_ttl = int(conf.get('container_acl_cache_ttl', 60))
 
     def __call__(self, env, start_response):
         """ Handle incoming request. Authenticate. And send downstream. """
@@ -252,44 +331,108 @@ class AuthProtocol(object):
         """
         req = Request(env)
         memcache_client = cache_from_env(env)
+        accession = self._cached_accession(memcache_client, auth_token)
+        if accession is None:
+            accession = self._validate_once(memcache_client, auth_token)
+        if not accession:
+            return None
+        tenant, username, roles, storage_url = accession
+        if not self.across_account and not self.valid_account_owner(req, tenant):
+            return None
+        return tenant, username, roles, storage_url
 
-        #get memcache
-        if memcache_client:
-            memcache_key = 'auth/%s' % auth_token
-            cached_auth_data = memcache_client.get(memcache_key)
-            if cached_auth_data:
-                expires, tenant, username, roles, storage_url = cached_auth_data
-                if expires > time():
-                    if not self.across_account and not self.valid_account_owner(req, tenant):
-                        return None
-                    return tenant, username, roles, storage_url
-
+    def _cached_accession(self, memcache_client, auth_token):
+        """
+        add by colony.
+        :return: the cached accession of auth_token, False if it was
+                 rejected, None if it isn't cached.
+        """
+        cached = self.token_cache.get(auth_token)
+        if cached:
+            return cached[1]
+        if not memcache_client:
+            return None
+        cached_auth_data = memcache_client.get('auth/%s' % auth_token)
+        if cached_auth_data:
+            expires, tenant, username, roles, storage_url = cached_auth_data
+            if expires > time():
+                accession = (tenant, username, roles, storage_url)
+                self.token_cache.set(auth_token, accession, expires)
+                return accession
+        if memcache_client.get('auth_rejected/%s' % auth_token):
+            self.token_cache.set(auth_token, False, time() + self.negative_cache_ttl)
+            return False
+        return None
+
+    def _validate_once(self, memcache_client, auth_token):
+        """
+        add by colony.
+        validate auth_token by keystone, once for concurrent requests with it.
+        """
+        event = self.validating.get(auth_token)
+        if event:
+            return event.wait()
+        event = self.validating[auth_token] = Event()
+        try:
+            accession = self._validate_token(memcache_client, auth_token)
+        except Exception, err:
+            del self.validating[auth_token]
+            event.send_exception(err)
+            raise
+        del self.validating[auth_token]
+        event.send(accession)
+        return accession
+
+    def _validate_token(self, memcache_client, auth_token):
+        """
+        add by colony.
+        :return: the accession of auth_token, or False if keystone rejected it.
+        """
         token = {'auth': {'token': {'id': auth_token}, 'tenantId': ''}}
         req_headers = {'Content-type': 'application/json', 'Accept': 'text/json'}
         connect = httplib.HTTPConnection if self.auth_protocol == 'http' else httplib.HTTPSConnection
         conn = connect('%s' % self.auth_netloc, timeout=10)
         conn.request('POST', '/v2.0/tokens', json.dumps(token), req_headers)
         resp = conn.getresponse()
-        if resp.status == 200:
-            data = resp.read()
-        else:
-            return None
+        data = resp.read()
+        if resp.status in (401, 403, 404):
+            self._cache_rejected(memcache_client, auth_token)
+            return False
+        if resp.status != 200:
+            # keystone is in trouble, the token may be valid.
+            return False
         auth_resp = json.loads(data)
         verified_auth_token, tenant, username, roles, storage_url = \
             self._get_swift_info(auth_resp, self.region_name) 
         if auth_token != verified_auth_token:
-            return None
-
-        # set memcache
+            self._cache_rejected(memcache_client, auth_token)
+            return False
+        accession = (tenant, username, roles, storage_url)
+
+        # cache until the token expires
+        now = time()
+        expires = now + self.memcache_expire
+        token_expires = parse_expires(auth_resp['access']['token'].get('expires'))
+        if token_expires:
+            expires = min(expires, token_expires)
+        if expires > now:
+            self.token_cache.set(auth_token, accession, expires)
+            if memcache_client:
+                memcache_client.set('auth/%s' % auth_token,
+                                    (expires, tenant, username, roles, storage_url),
+                                    timeout=int(expires - now) + 1)
+        return accession
+
+    def _cache_rejected(self, memcache_client, auth_token):
+        """
+        add by colony.
+        """
+        if self.negative_cache_ttl <= 0:
+            return
+        self.token_cache.set(auth_token, False, time() + self.negative_cache_ttl)
         if memcache_client:
-            memcache_client.set(memcache_key,
-                                (time() + self.memcache_expire, 
-                                 tenant, username, roles, storage_url),
-                                timeout=self.memcache_expire)
-
-        if not self.across_account and not self.valid_account_owner(req, tenant):
-            return None
-        return tenant, username, roles, storage_url
+            memcache_client.set('auth_rejected/%s' % auth_token, True,
+                                timeout=max(int(self.negative_cache_ttl), 1))
 
 
     def valid_account_owner(self, req, tenant):
@@ -331,12 +474,7 @@ class AuthProtocol(object):
         #  because PUT/POST/DELETE container doesn't return container acls.
         write_cont_acl = None
         if req.method in ['PUT', 'POST', 'DELETE'] and container and not obj:
-            connect = httplib.HTTPConnection if self.auth_protocol == 'http' else httplib.HTTPSConnection
-            conn = connect('%s:%s' % (req.server_name, req.server_port), timeout=10)
-            conn.request('HEAD', '/v1.0%s' % req.path_info, None, req.headers)
-            resp = conn.getresponse()
-            if resp.status == 204 and resp.getheader('x-container-write'):
-                write_cont_acl = resp.getheader('x-container-write')
+            write_cont_acl = self._container_write_acl(req, account, container)
         # Deny the other account requesting 'POST' container
         # for modify container acl (and the other metadata)
         tenant = user_groups[1] if len(user_groups) >= 2 else ''
@@ -376,6 +514,44 @@ class AuthProtocol(object):
         return self.denied_response(req)
 
 
+    def _container_write_acl(self, req, account, container):
+        """
+        add by colony.
+        the write acl of the container, from swift's container info in
+        memcache if it is there, or by HEAD the container.
+        the info is dropped when the request may change the acls.
+        """
+        memcache_client = cache_from_env(req.environ)
+        if self.container_acl_cache_ttl <= 0:
+            memcache_client = None
+        cache_key = get_container_memcache_key(account, container)
+        write_cont_acl = None
+        container_info = memcache_client.get(cache_key) if memcache_client else None
+        if isinstance(container_info, dict) and container_info.get('status') in (200, 404):
+            write_cont_acl = container_info.get('write_acl')
+        else:
+            connect = httplib.HTTPConnection if self.auth_protocol == 'http' else httplib.HTTPSConnection
+            conn = connect('%s:%s' % (req.server_name, req.server_port), timeout=10)
+            conn.request('HEAD', '/v1.0%s' % req.path_info, None, req.headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 204:
+                write_cont_acl = resp.getheader('x-container-write')
+            if memcache_client and (resp.status // 100 == 2 or resp.status == 404):
+                # the same info as swift's proxy caches on HEAD container.
+                memcache_client.set(cache_key,
+                                    {'status': 200 if resp.status // 100 == 2 else 404,
+                                     'read_acl': resp.getheader('x-container-read'),
+                                     'write_acl': resp.getheader('x-container-write'),
+                                     'sync_key': resp.getheader('x-container-sync-key'),
+                                     'container_size': resp.getheader('x-container-object-count')},
+                                    timeout=self.container_acl_cache_ttl)
+        if memcache_client and (req.method == 'DELETE' or
+                                'x-container-read' in req.headers or
+                                'x-container-write' in req.headers):
+            memcache_client.delete(cache_key)
+        return write_cont_acl or None
+
     def authorize(self, req):
         """ 
         add by colony.
@@ -4,7 +4,8 @@ try:
     import unittest2 as unittest
 except (ImportError):
     import unittest
-from keystone.middleware.auth_token_for_colony import filter_factory
+from keystone.middleware import auth_token_for_colony
+from keystone.middleware.auth_token_for_colony import filter_factory, LocalCache, parse_expires
 from eventlet import sleep, spawn, TimeoutError, util, wsgi, listen
 from swift.common.utils import normalize_timestamp, NullLogger
 from webob import Request, Response
@@ -12,7 +13,7 @@ import json
 from urlparse import urlparse
 from contextlib import contextmanager
 import httplib
-from time import time
+from time import mktime, time, tzset
 
 class TmpLogger():
     def write(self, *args):
@@ -233,6 +234,76 @@ class TestController(unittest.TestCase):
         auth_token = '999888777666'
         self.assertEqual(kauth._accession_by_auth_token(env, auth_token), None)
 
+    def test_parse_expires(self):
+        self.assertEqual(parse_expires('2012-01-09T19:11:27.058939'),
+                         mktime((2012, 1, 9, 19, 11, 27, 0, 0, -1)))
+        self.assertEqual(parse_expires('2012-01-09T19:11:27Z'), 1326136287)
+        self.assertEqual(parse_expires('tomorrow'), None)
+        self.assertEqual(parse_expires(None), None)
+
+    def test_parse_expires_local_time(self):
+        # keystone writes its local time without a zone.
+        orig_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'JST-9'
+        tzset()
+        try:
+            self.assertEqual(parse_expires('2012-01-09T19:11:27'), 1326136287 - 9 * 3600)
+            self.assertEqual(parse_expires('2012-01-09T19:11:27Z'), 1326136287)
+        finally:
+            if orig_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = orig_tz
+            tzset()
+
+    def test_local_cache(self):
+        cache = LocalCache(max_entries=8)
+        cache.set('a', 'A', time() + 10)
+        cache.set('b', 'B', time() - 1)
+        self.assertEqual(cache.get('a')[1], 'A')
+        self.assertEqual(cache.get('b'), None)
+        self.assertFalse('b' in cache.entries)
+        for key in '0123456':
+            cache.set(key, key, time() + 10)
+        cache.get('0')
+        # 'a' is the least recently used one.
+        cache.set('7', '7', time() + 10)
+        self.assertEqual(sorted(cache.entries.keys()), list('01234567'))
+        cache.delete('7')
+        self.assertEqual(cache.get('7'), None)
+        cache = LocalCache(max_entries=0)
+        cache.set('a', 'A', time() + 10)
+        self.assertEqual(cache.get('a'), None)
+
+    def test_cached_accession(self):
+        memcache = FakeMemcache()
+        accession = ('admin', 'admin', ['Admin'], 'http://172.30.112.168:8080/v1.0/AUTH_admin')
+        self.assertEqual(self.kauth._cached_accession(memcache, 't'), None)
+        memcache.set('auth/t', (time() + 100,) + accession)
+        self.assertEqual(self.kauth._cached_accession(memcache, 't'), accession)
+        # the local tier answers without memcache.
+        self.assertEqual(self.kauth._cached_accession(None, 't'), accession)
+        memcache.set('auth/t2', (time() - 1,) + accession)
+        self.assertEqual(self.kauth._cached_accession(memcache, 't2'), None)
+        self.kauth._cache_rejected(memcache, 't3')
+        self.assertEqual(memcache.get('auth/t3'), None)
+        self.assertEqual(self.kauth._cached_accession(FakeMemcache(), 't3'), False)
+        self.kauth.token_cache.delete('t3')
+        self.assertEqual(self.kauth._cached_accession(memcache, 't3'), False)
+
+    def test_validate_once(self):
+        calls = []
+        def validate_token(memcache_client, auth_token):
+            calls.append(auth_token)
+            sleep(0.01)
+            return ('test', 'tester', ['Member'], 'http://127.0.0.1:8080/v1.0/AUTH_test')
+        self.kauth._validate_token = validate_token
+        waiters = [spawn(self.kauth._validate_once, None, 't') for i in range(3)]
+        results = [w.wait() for w in waiters]
+        self.assertEqual(calls, ['t'])
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(self.kauth.validating, {})
+
     def test_valid_account_owner(self):
         req = Request.blank('http://127.0.0.1:8080/v1.0/AUTH_test')
         self.assertTrue(self.kauth.valid_account_owner(req, 'test'))
@@ -342,6 +413,62 @@ class TestController(unittest.TestCase):
         self.assertEqual(self.kauth.authorize_colony(req).status, '403 Forbidden')
 
 
+    def test_container_write_acl(self):
+        memcache = FakeMemcache()
+        memcache.set('container/AUTH_test/TEST01',
+                     {'status': 200, 'read_acl': None, 'write_acl': 'test2',
+                      'sync_key': None, 'container_size': '0'})
+        # the cached acl is used, nothing listens on the port to HEAD.
+        req = Request.blank('http://127.0.0.1:1/v1.0/AUTH_test/TEST01', method='PUT',
+                            environ={'swift.cache': memcache})
+        req.remote_user = 'test:tester,test,'
+        self.assertEqual(self.kauth.authorize_colony(req).status, '403 Forbidden')
+        req = Request.blank('http://127.0.0.1:1/v1.0/AUTH_test/TEST01', method='PUT',
+                            environ={'swift.cache': memcache})
+        req.remote_user = 'test2:tester2,test2,'
+        self.assertEqual(self.kauth.authorize_colony(req), None)
+        # changing the acls drops the container info.
+        req = Request.blank('http://127.0.0.1:1/v1.0/AUTH_test/TEST01', method='PUT',
+                            headers={'X-Container-Write': 'test3'},
+                            environ={'swift.cache': memcache})
+        req.remote_user = 'test2:tester2,test2,'
+        self.assertEqual(self.kauth.authorize_colony(req), None)
+        self.assertEqual(memcache.get('container/AUTH_test/TEST01'), None)
+
+        # not cached, the container is HEADed and its info cached.
+        heads = []
+        class FakeResponse(object):
+            status = 204
+            def read(self):
+                return ''
+            def getheader(self, name):
+                return {'x-container-write': 'test2', 'x-container-object-count': '3'}.get(name)
+        class FakeConnection(object):
+            def __init__(self, netloc, timeout=None):
+                pass
+            def request(self, method, path, body, headers):
+                heads.append(path)
+            def getresponse(self):
+                return FakeResponse()
+        orig_connection = auth_token_for_colony.httplib.HTTPConnection
+        auth_token_for_colony.httplib.HTTPConnection = FakeConnection
+        try:
+            for i in range(2):
+                req = Request.blank('http://127.0.0.1:1/v1.0/AUTH_test/TEST01', method='DELETE',
+                                    environ={'swift.cache': memcache})
+                req.remote_user = 'test:tester,test,'
+                self.assertEqual(self.kauth.authorize_colony(req).status, '403 Forbidden')
+                req = Request.blank('http://127.0.0.1:1/v1.0/AUTH_test/TEST02', method='POST',
+                                    environ={'swift.cache': memcache})
+                req.remote_user = 'test2:tester2,test2,'
+                self.assertEqual(self.kauth.authorize_colony(req).status, '403 Forbidden')
+        finally:
+            auth_token_for_colony.httplib.HTTPConnection = orig_connection
+        # DELETE drops the info each time, the POST without acls keeps it.
+        self.assertEqual(len(heads), 3)
+        self.assertEqual(memcache.get('container/AUTH_test/TEST02')['write_acl'], 'test2')
+        self.assertEqual(memcache.get('container/AUTH_test/TEST02')['container_size'], '3')
+
     def test_authorize(self):
         # url check
         req = Request.blank('http://127.0.0.1:8080/')